@@ -0,0 +1,87 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+Entree = Tuple[float, Optional[int], Dict[str, Any], Dict[str, Any]] # (expire_a, user_id, claims, utilisateur)
+
+class CacheAuth:
+    """
+    Cache LRU borné des tokens déjà validés : claims décodés et enregistrement de l'utilisateur.
+
+    La clé est l'empreinte SHA-256 du token (le token lui-même n'est pas conservé). Une entrée
+    vit au plus `ttl_secondes`, et jamais au-delà de l'expiration du token. Un index par
+    utilisateur permet d'invalider d'un coup tous les tokens d'un compte modifié ou désactivé.
+    """
+
+    def __init__(self, ttl_secondes: float = 60.0, max_entrees: int = 10000):
+        self.ttl = ttl_secondes
+        self.max_entrees = max_entrees
+        self._entrees: "OrderedDict[str, Entree]" = OrderedDict()
+        self._par_utilisateur: Dict[int, Set[str]] = {}
+        self._verrou = threading.Lock() # Les dépendances synchrones s'exécutent dans le threadpool
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def empreinte(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def obtenir(self, token: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """(claims, utilisateur) si le token est en cache et encore valide, sinon None."""
+        cle = self.empreinte(token)
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None or entree[0] <= time.monotonic():
+                if entree is not None:
+                    self._retirer(cle)
+                self.stats["misses"] += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self.stats["hits"] += 1
+            return entree[2], entree[3]
+
+    def enregistrer(self, token: str, claims: Dict[str, Any], utilisateur: Dict[str, Any]):
+        duree = self.ttl
+        if "exp" in claims:
+            duree = min(duree, float(claims["exp"]) - time.time())
+        if duree <= 0:
+            return
+        cle = self.empreinte(token)
+        user_id = utilisateur.get("id")
+        with self._verrou:
+            self._retirer(cle)
+            self._entrees[cle] = (time.monotonic() + duree, user_id, claims, utilisateur)
+            if user_id is not None:
+                self._par_utilisateur.setdefault(user_id, set()).add(cle)
+            while len(self._entrees) > self.max_entrees:
+                self._retirer(next(iter(self._entrees)))
+
+    def invalider_utilisateur(self, user_id: int) -> int:
+        """Oublie tous les tokens en cache d'un utilisateur. Retourne le nombre d'entrées retirées."""
+        with self._verrou:
+            cles = list(self._par_utilisateur.get(user_id, ()))
+            for cle in cles:
+                self._retirer(cle)
+            self.stats["invalidations"] += len(cles)
+            return len(cles)
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+            self._par_utilisateur.clear()
+
+    def _retirer(self, cle: str):
+        # À appeler avec le verrou
+        entree = self._entrees.pop(cle, None)
+        if entree is None or entree[1] is None:
+            return
+        cles = self._par_utilisateur.get(entree[1])
+        if cles is not None:
+            cles.discard(cle)
+            if not cles:
+                del self._par_utilisateur[entree[1]]
+
+    def statistiques(self) -> Dict[str, Any]:
+        with self._verrou:
+            return {**self.stats, "entrees": len(self._entrees), "utilisateurs": len(self._par_utilisateur), "ttl_secondes": self.ttl}
@@ -0,0 +1,97 @@
+import asyncio
+import os
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from pydantic import BaseModel
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, create_engine
+
+R = TypeVar("R")
+
+class ProfilBase(BaseModel):
+    """Réglages du moteur SQLAlchemy pour un environnement (taille du pool, délais, journal SQL)."""
+    echo: bool = False # Chaque requête SQL écrite sur la sortie standard : débogage seulement
+    pool_size: int = 5 # Connexions gardées ouvertes (PostgreSQL et fichiers SQLite)
+    max_overflow: int = 10 # Connexions supplémentaires en pointe
+    pool_timeout: float = 30.0 # Attente maximale d'une connexion libre (secondes)
+    pool_recycle: int = -1 # Âge maximal d'une connexion (secondes, -1 = jamais)
+    pool_pre_ping: bool = False # Vérifie la connexion avant usage (coupures réseau, redémarrage du serveur)
+    sqlite_busy_timeout_ms: int = 5000 # Attente du verrou d'écriture SQLite avant « database is locked »
+    sqlite_wal: bool = True # Journal WAL : les lectures ne bloquent plus les écritures
+    sqlite_synchronous: str = "NORMAL" # Avec WAL, NORMAL reste cohérent après un arrêt brutal
+
+PROFILS: Dict[str, ProfilBase] = {
+    "developpement": ProfilBase(),
+    "test": ProfilBase(pool_size=2, max_overflow=5, sqlite_busy_timeout_ms=1000),
+    # Derrière gunicorn (4 workers) : 4 x 30 connexions au plus, sous la limite PostgreSQL courante (100-120)
+    "production": ProfilBase(pool_size=10, max_overflow=20, pool_timeout=10.0, pool_recycle=1800, pool_pre_ping=True),
+}
+
+def profil_courant() -> ProfilBase:
+    """Profil choisi par DB_PROFILE (défaut : developpement) ; DB_ECHO=1 réactive le journal SQL."""
+    nom = os.getenv("DB_PROFILE", "developpement")
+    if nom not in PROFILS:
+        raise ValueError(f"DB_PROFILE inconnu : {nom} (attendu : {', '.join(PROFILS)})")
+    profil = PROFILS[nom]
+    if os.getenv("DB_ECHO"):
+        profil = profil.model_copy(update={"echo": os.getenv("DB_ECHO").lower() in ("1", "true", "yes")})
+    return profil
+
+def normaliser_url(url: str) -> str:
+    # Heroku fournit encore des URL « postgres:// », refusées par SQLAlchemy 1.4+
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+def creer_engine(url: str, profil: Optional[ProfilBase] = None) -> Engine:
+    """Moteur SQLAlchemy configuré selon le profil (celui de DB_PROFILE par défaut)."""
+    profil = profil or profil_courant()
+    url = normaliser_url(url)
+    options: Dict[str, Any] = {"echo": profil.echo}
+    if url.startswith("sqlite"):
+        memoire = url in ("sqlite://", "sqlite:///:memory:")
+        if not memoire:
+            options.update(pool_size=profil.pool_size, max_overflow=profil.max_overflow, pool_timeout=profil.pool_timeout)
+        # Connexions partagées entre les threads du pool (sessions exécutées via asyncio.to_thread)
+        options["connect_args"] = {"check_same_thread": False, "timeout": profil.sqlite_busy_timeout_ms / 1000}
+        engine = create_engine(url, **options)
+        if not memoire:
+            configurer_sqlite(engine, profil)
+        return engine
+    options.update(
+        pool_size=profil.pool_size,
+        max_overflow=profil.max_overflow,
+        pool_timeout=profil.pool_timeout,
+        pool_recycle=profil.pool_recycle,
+        pool_pre_ping=profil.pool_pre_ping,
+    )
+    return create_engine(url, **options)
+
+def configurer_sqlite(engine: Engine, profil: ProfilBase):
+    @event.listens_for(engine, "connect")
+    def pragmas(connexion, _):
+        curseur = connexion.cursor()
+        if profil.sqlite_wal:
+            curseur.execute("PRAGMA journal_mode=WAL") # Persistant dans le fichier, sans effet s'il l'est déjà
+        curseur.execute(f"PRAGMA synchronous={profil.sqlite_synchronous}")
+        curseur.execute(f"PRAGMA busy_timeout={int(profil.sqlite_busy_timeout_ms)}")
+        curseur.close()
+
+def sauvegarder(session: Session, objet: R) -> R:
+    """Ajoute ou met à jour un objet, valide la transaction et le recharge (utilisable avec en_session)."""
+    session.add(objet)
+    session.commit()
+    session.refresh(objet)
+    return objet
+
+async def en_session(engine: Engine, fonction: Callable[..., R], *args) -> R:
+    """
+    Exécute `fonction(session, *args)` dans un thread avec une session dédiée, fermée ensuite.
+    Chemin des routes async : la boucle d'événements n'attend jamais la base.
+    Les objets renvoyés sont détachés : les charger (refresh) avant de sortir de `fonction`.
+    """
+    def executer():
+        with Session(engine) as session:
+            return fonction(session, *args)
+    return await asyncio.to_thread(executer)
@@ -0,0 +1,88 @@
+"""
+Catalogues synthétiques au format agences.json, N fois plus grands que le catalogue réel.
+
+Chaque copie des agences réelles est décalée de quelques kilomètres et reçoit un nom propre.
+La moitié de ses villes (départ et destinations) reste une ville réelle, l'autre moitié devient
+une ville synthétique (« Douala 17 ») : les lignes réelles sont donc plus fréquentées, et le
+nombre de villes grandit avec le facteur, comme un réseau qui s'étend. Même graine, même catalogue.
+
+Usage : python benchmarks/catalogue_synthetique.py FACTEUR [--source agences.json] [--sortie agences_x100.json] [--graine 0]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+JOURS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+DECALAGE_DEGRES = 0.05 # Environ 5 km : les copies restent autour des villes réelles
+
+def lire_source(chemin: Optional[str] = None) -> List[Dict[str, Any]]:
+    with open(chemin or os.path.join(RACINE, "agences.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def _ville(nom: str, copie: int, rng: random.Random, villes_par_nom: int) -> str:
+    if copie == 0 or rng.random() < 0.5:
+        return nom
+    return f"{nom} {rng.randrange(1, villes_par_nom + 1)}"
+
+def generer_catalogue(source: List[Dict[str, Any]], facteur: int, graine: int = 0) -> List[Dict[str, Any]]:
+    """Catalogue de `facteur` x len(source) agences ; la copie 0 est le catalogue source inchangé."""
+    rng = random.Random(graine)
+    villes_par_nom = max(1, facteur // 2) # Villes synthétiques dérivées de chaque ville réelle
+    agences = []
+    for copie in range(facteur):
+        for agence in source:
+            if copie == 0:
+                agences.append(agence)
+                continue
+            trajets = []
+            for trajet in agence.get("trajets", []):
+                heures, minutes = rng.randrange(5, 22), rng.choice((0, 15, 30, 45))
+                trajets.append({
+                    **trajet,
+                    "destination": _ville(trajet["destination"], copie, rng, villes_par_nom),
+                    "latitude": trajet.get("latitude") and round(trajet["latitude"] + rng.uniform(-DECALAGE_DEGRES, DECALAGE_DEGRES), 6),
+                    "longitude": trajet.get("longitude") and round(trajet["longitude"] + rng.uniform(-DECALAGE_DEGRES, DECALAGE_DEGRES), 6),
+                    "prix_classique": trajet.get("prix_classique") and trajet["prix_classique"] + 500 * rng.randrange(-2, 3),
+                    "departure": f"{heures:02d}:{minutes:02d}",
+                    "days_of_week": sorted(rng.sample(JOURS, rng.randrange(3, 8)), key=JOURS.index),
+                })
+            agences.append({
+                **agence,
+                "nom_agence": f"{agence['nom_agence']} {copie}",
+                "ville_depart": _ville(agence["ville_depart"], copie, rng, villes_par_nom),
+                "latitude": round(agence["latitude"] + rng.uniform(-DECALAGE_DEGRES, DECALAGE_DEGRES), 6),
+                "longitude": round(agence["longitude"] + rng.uniform(-DECALAGE_DEGRES, DECALAGE_DEGRES), 6),
+                "trajets": trajets,
+            })
+    return agences
+
+def paires_trajets(agences: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """Couples (départ, destination) desservis, tels qu'écrits dans le catalogue."""
+    return sorted({(agence["ville_depart"], trajet["destination"]) for agence in agences for trajet in agence.get("trajets", [])})
+
+def boite(agences: List[Dict[str, Any]]) -> Tuple[float, float, float, float]:
+    """(lat min, lat max, lon min, lon max) des agences, élargie d'un demi-degré pour tirer des points alentour."""
+    latitudes = [agence["latitude"] for agence in agences]
+    longitudes = [agence["longitude"] for agence in agences]
+    return min(latitudes) - 0.5, max(latitudes) + 0.5, min(longitudes) - 0.5, max(longitudes) + 0.5
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("facteur", type=int, help="Taille relative au catalogue source (10, 100, 1000...)")
+    parser.add_argument("--source", default=None, help="Catalogue de départ (défaut : agences.json du dépôt)")
+    parser.add_argument("--sortie", default=None, help="Fichier écrit (défaut : sortie standard)")
+    parser.add_argument("--graine", type=int, default=0, help="Graine du générateur aléatoire")
+    args = parser.parse_args()
+    agences = generer_catalogue(lire_source(args.source), args.facteur, args.graine)
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            json.dump(agences, f, ensure_ascii=False)
+        nombre_trajets = sum(len(agence.get("trajets", [])) for agence in agences)
+        print(f"{args.sortie} : {len(agences)} agences, {nombre_trajets} trajets, {len(paires_trajets(agences))} lignes.", file=sys.stderr)
+    else:
+        json.dump(agences, sys.stdout, ensure_ascii=False)
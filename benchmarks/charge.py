@@ -0,0 +1,262 @@
+"""
+Test de charge en mémoire de l'application complète (ASGI, sans serveur ni réseau).
+
+Scénarios, joués l'un après l'autre avec `--concurrence` requêtes en vol :
+- trajets : GET /trajets/ sur les lignes du catalogue (10 % de lignes inconnues, réponses 404) ;
+- agences_proches : GET /agences/proches autour des agences ;
+- trajets_sondage : GET /trajets/ répété sur quelques lignes populaires avec If-None-Match, comme l'application
+  mobile qui rafraîchit ses résultats (réponses 304 sans corps) ;
+- trajets_details : GET /trajets/details, itinéraire demandé au faux Google Maps puis mis en cache ;
+- track_update : POST /track/update pendant que `--abonnes` clients WebSocket suivent les véhicules.
+  La mesure ws_diffusion est le délai entre l'envoi d'une position et sa réception par chaque abonné ;
+- paiement_initier : POST /paiement/initier avec retenue de places, faux Notch Pay ;
+- paiement_webhook : notification de chaque paiement initié (90 % payés, SMS mis en file vers le faux Twilio).
+
+Le catalogue est un catalogue synthétique `--facteur` fois plus grand que agences.json.
+Les services externes répondent après `--latence-services` secondes en moyenne (faux_services.py).
+
+Usage : python benchmarks/charge.py [--facteur 10] [--requetes 2000] [--concurrence 32] [--abonnes 200] [--vehicules 50]
+                                    [--scenarios trajets,...] [--sortie charge.json] [--reference base.json]
+Variables utiles : DB_PROFILE, CATALOGUE_BACKEND, BROADCAST_BACKEND, LOG_LEVEL (défaut : WARNING).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import mesures
+from catalogue_synthetique import boite, generer_catalogue, lire_source, paires_trajets
+from faux_services import FauxServices, variables_environnement
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("trajets", "agences_proches", "trajets_sondage", "trajets_details", "track_update", "paiement_initier", "paiement_webhook")
+
+def preparer_environnement(dossier: str, args):
+    agences = generer_catalogue(lire_source(), args.facteur, args.graine)
+    chemin_catalogue = os.path.join(dossier, "agences.json")
+    with open(chemin_catalogue, "w", encoding="utf-8") as f:
+        json.dump(agences, f, ensure_ascii=False)
+    os.environ.update(variables_environnement())
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(dossier, 'charge.db')}",
+        "AGENCES_PATH": chemin_catalogue,
+        "CATALOGUE_WATCH_INTERVAL": "0",
+        "DIRECTIONS_CACHE_PATH": "",
+        "TRACKING_HISTORY_PATH": os.path.join(dossier, "positions_history.db"),
+        "BROADCAST_SQLITE_PATH": os.path.join(dossier, "broadcast_bus.db"),
+        "SEATS_CLASSIQUE": str(10 * args.requetes), # Le scénario mesure la retenue, pas le refus d'un départ complet
+        "SMS_RATE_PER_SECOND": "1000",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.chdir(RACINE)
+    sys.path.insert(0, RACINE)
+    return agences
+
+class ClientWebSocket:
+    """
+    Client WebSocket branché directement sur l'application ASGI (httpx ne gère pas les WebSocket).
+    Chaque message reçu est passé à `sur_message`.
+    """
+
+    def __init__(self, app, chemin: str, sur_message: Callable[[str], None]):
+        self.app = app
+        self.chemin = chemin
+        self.sur_message = sur_message
+        self._entrees: asyncio.Queue = asyncio.Queue()
+        self._accepte = asyncio.Event()
+        self._tache = None
+
+    async def connecter(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "ws",
+            "path": self.chemin, "raw_path": self.chemin.encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"test")], "client": ("127.0.0.1", 0), "server": ("test", 80), "subprotocols": [],
+        }
+        await self._entrees.put({"type": "websocket.connect"})
+        self._tache = asyncio.create_task(self.app(scope, self._entrees.get, self._envoyer))
+        await self._accepte.wait()
+
+    async def _envoyer(self, message: Dict[str, Any]):
+        if message["type"] == "websocket.accept":
+            self._accepte.set()
+        elif message["type"] == "websocket.send":
+            self.sur_message(message.get("text") or message.get("bytes", b"").decode())
+        elif message["type"] == "websocket.close":
+            self._accepte.set()
+
+    async def fermer(self):
+        await self._entrees.put({"type": "websocket.disconnect", "code": 1000})
+        await self._tache
+
+async def executer(nombre: int, concurrence: int, envoyer: Callable[[int], Awaitable[Any]], statuts=(200,)) -> Tuple[List[float], float, int, List[Any]]:
+    """
+    Envoie `nombre` requêtes depuis `concurrence` clients qui enchaînent chacun leurs requêtes ;
+    retourne (latences, durée, erreurs, réponses acceptées).
+    """
+    latences, reponses = [], []
+    erreurs = 0
+    suivantes = iter(range(nombre))
+
+    async def client():
+        nonlocal erreurs
+        for i in suivantes:
+            debut = time.perf_counter()
+            response = await envoyer(i)
+            latences.append(time.perf_counter() - debut)
+            if response.status_code in statuts:
+                reponses.append(response)
+            else:
+                erreurs += 1
+            # Sans réseau, une requête qui n'attend rien ne rend jamais la main : on laisse passer
+            # les autres tâches (envois WebSocket, files d'écriture) comme le ferait un aller-retour réseau
+            await asyncio.sleep(0)
+
+    debut = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrence)))
+    return latences, time.perf_counter() - debut, erreurs, reponses
+
+async def main(args) -> int:
+    import httpx
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise SystemExit(f"Scénario inconnu : {scenario} (disponibles : {', '.join(SCENARIOS)})")
+    if "paiement_webhook" in scenarios and "paiement_initier" not in scenarios:
+        raise SystemExit("Le scénario paiement_webhook notifie les paiements créés par paiement_initier.")
+
+    rng = random.Random(args.graine)
+    resultats: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as dossier:
+        agences = preparer_environnement(dossier, args)
+        import voyage
+        from clients_http import ClientsHTTP
+        from sqlmodel import SQLModel
+
+        faux = FauxServices(latence=args.latence_services, graine=args.graine)
+        voyage.clients_http = ClientsHTTP(voyage.clients_http.services, transport=faux.transport())
+        SQLModel.metadata.create_all(voyage.engine)
+        if os.getenv("CATALOGUE_BACKEND") == "sql":
+            from catalogue_db import importer_agences
+            importer_agences(voyage.engine, agences)
+
+        def noter(nom: str, latences: List[float], duree: float, **extra):
+            resultats[nom] = r = mesures.resumer(latences, duree, **extra)
+            erreurs = f"   erreurs {extra['erreurs']}" if extra.get("erreurs") else ""
+            print(f"{nom:<18} {r['operations']:>7} op   {r['debit_par_s']:>9.0f} op/s   p50 {r['p50_ms']:>8.2f}ms   p95 {r['p95_ms']:>8.2f}ms   p99 {r['p99_ms']:>8.2f}ms{erreurs}", flush=True)
+
+        paires = paires_trajets(agences)
+        lat_min, lat_max, lon_min, lon_max = boite(agences)
+        dates = [f"2030-01-{jour:02d}" for jour in range(7, 14)]
+
+        async with voyage.app.router.lifespan_context(voyage.app):
+            transport = httpx.ASGITransport(app=voyage.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+
+                async def scenario(nom: str, envoyer, statuts=(200,), nombre: int = args.requetes):
+                    latences, duree, erreurs, reponses = await executer(nombre, args.concurrence, envoyer, statuts)
+                    noter(nom, latences, duree, erreurs=erreurs)
+                    return reponses
+
+                if "trajets" in scenarios:
+                    requetes = [(*rng.choice(paires), rng.choice(dates)) for _ in range(args.requetes)]
+                    requetes = [(d, "Ville Inconnue" if rng.random() < 0.1 else a, j) for d, a, j in requetes]
+                    await scenario("trajets", lambda i: client.get("/trajets/", params=dict(zip(("depart", "destination", "date"), requetes[i]))), statuts=(200, 404))
+
+                if "agences_proches" in scenarios:
+                    points = [(rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)) for _ in range(args.requetes)]
+                    await scenario("agences_proches", lambda i: client.get("/agences/proches", params={"latitude": points[i][0], "longitude": points[i][1], "limit": 10}))
+
+                if "trajets_sondage" in scenarios:
+                    populaires = paires[:20]
+                    etags: Dict[Tuple[str, str], str] = {}
+
+                    async def sonder(i: int):
+                        ligne = populaires[i % len(populaires)]
+                        en_tetes = {"If-None-Match": etags[ligne]} if ligne in etags else {}
+                        response = await client.get("/trajets/", params={"depart": ligne[0], "destination": ligne[1]}, headers=en_tetes)
+                        if "etag" in response.headers:
+                            etags[ligne] = response.headers["etag"]
+                        return response
+                    await scenario("trajets_sondage", sonder, statuts=(200, 304, 404))
+
+                if "trajets_details" in scenarios:
+                    lignes = [rng.choice(paires) for _ in range(args.requetes)]
+                    await scenario("trajets_details", lambda i: client.get("/trajets/details", params={"depart": lignes[i][0], "destination": lignes[i][1]}))
+
+                if "track_update" in scenarios:
+                    envois: Dict[Tuple[str, float], float] = {}
+                    diffusion: List[float] = []
+
+                    def recevoir(texte: str):
+                        message = json.loads(texte)
+                        envoi = envois.get((message["vehicle_id"], message["latitude"]))
+                        if envoi is not None:
+                            diffusion.append(time.perf_counter() - envoi)
+
+                    abonnes = [ClientWebSocket(voyage.app, f"/ws/track/bus-{n % args.vehicules}", recevoir) for n in range(args.abonnes)]
+                    await asyncio.gather(*(abonne.connecter() for abonne in abonnes))
+
+                    def position(i: int):
+                        vehicule, latitude = f"bus-{i % args.vehicules}", 3.85 + rng.uniform(-0.5, 0.5)
+                        envois[(vehicule, latitude)] = time.perf_counter()
+                        return client.post("/track/update", json={"vehicle_id": vehicule, "latitude": latitude, "longitude": 11.5 + rng.uniform(-0.5, 0.5)})
+
+                    debut = time.perf_counter()
+                    await scenario("track_update", position)
+                    abonnes_par_vehicule = Counter(n % args.vehicules for n in range(args.abonnes))
+                    attendus = sum(abonnes_par_vehicule[i % args.vehicules] for i in range(args.requetes))
+                    limite = time.perf_counter() + 5
+                    while len(diffusion) < attendus and time.perf_counter() < limite:
+                        await asyncio.sleep(0.01) # Files d'envoi des abonnés vidées
+                    perdus = voyage.manager.statistiques()["messages_perdus"]
+                    noter("ws_diffusion", diffusion, time.perf_counter() - debut, abonnes=args.abonnes, attendus=attendus, messages_perdus=perdus)
+                    await asyncio.gather(*(abonne.fermer() for abonne in abonnes))
+                    await voyage.store_positions.vider() # Écritures différées comprises dans la mesure
+
+                references: List[str] = []
+                if "paiement_initier" in scenarios:
+                    depart, destination = agences[0]["ville_depart"], agences[0]["trajets"][0]["destination"]
+                    reponses = await scenario("paiement_initier", lambda i: client.post("/paiement/initier", json={
+                        "email": "bench@example.com", "phone": "+237600000000", "amount": 8000,
+                        "description": f"{depart} - {destination}", "depart": depart, "destination": destination,
+                        "date_voyage": rng.choice(dates), "classe": "classique", "places": 1,
+                    }))
+                    references = [response.json()["reference"] for response in reponses]
+
+                if "paiement_webhook" in scenarios and references:
+                    statuts = ["complete" if rng.random() < 0.9 else "failed" for _ in references]
+                    await scenario(
+                        "paiement_webhook",
+                        lambda i: client.post("/paiement/webhook", params={"reference": references[i], "status": statuts[i]}),
+                        nombre=len(references),
+                    )
+
+                sms = await voyage.file_sms.statistiques()
+                inventaire = await voyage.inventaire.statistiques()
+
+    print(f"Appels aux faux services : {faux.appels} ; SMS envoyés {sms.get('envoyes')}, places confirmées {inventaire.get('confirmees')}")
+    parametres = {
+        "facteur": args.facteur, "requetes": args.requetes, "concurrence": args.concurrence, "abonnes": args.abonnes,
+        "vehicules": args.vehicules, "latence_services": args.latence_services, "scenarios": scenarios, "graine": args.graine,
+        "catalogue_backend": os.getenv("CATALOGUE_BACKEND", "json"), "db_profile": os.getenv("DB_PROFILE", "developpement"),
+    }
+    return mesures.conclure(args, "charge", parametres, resultats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--facteur", type=int, default=10, help="Taille du catalogue synthétique, en multiples de agences.json")
+    parser.add_argument("--requetes", type=int, default=2000, help="Requêtes par scénario")
+    parser.add_argument("--concurrence", type=int, default=32, help="Requêtes simultanées")
+    parser.add_argument("--abonnes", type=int, default=200, help="Clients WebSocket pendant track_update")
+    parser.add_argument("--vehicules", type=int, default=50, help="Véhicules distincts (abonnés répartis entre eux)")
+    parser.add_argument("--latence-services", type=float, default=0.05, help="Latence moyenne des faux services externes (secondes)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Scénarios joués, séparés par des virgules")
+    parser.add_argument("--graine", type=int, default=0, help="Graine du catalogue et des requêtes")
+    mesures.ajouter_options(parser)
+    sys.exit(asyncio.run(main(parser.parse_args())))
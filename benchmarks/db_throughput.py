@@ -0,0 +1,94 @@
+"""
+Débit de /track/update et du webhook de paiement, application complète en mémoire (ASGI).
+
+La sortie standard de l'application (journal SQL compris) est écrite dans un fichier
+temporaire, comme le ferait un serveur dont les logs sont redirigés.
+
+Usage : python benchmarks/db_throughput.py [--requetes 5000] [--concurrence 32] [--vehicules 200] [--webhooks 1000]
+Variables utiles : DB_PROFILE, DB_ECHO, DATABASE_URL (défaut : SQLite temporaire).
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def preparer_environnement(dossier: str):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(dossier, 'db_throughput.db')}")
+    os.environ["DIRECTIONS_CACHE_PATH"] = ""
+    os.environ["TRACKING_HISTORY_PATH"] = os.path.join(dossier, "positions_history.db")
+    os.chdir(RACINE)
+    sys.path.insert(0, RACINE)
+
+def percentile(valeurs, p):
+    if not valeurs:
+        return float("nan")
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+async def mesurer(nombre: int, concurrence: int, envoyer):
+    """Envoie `nombre` requêtes avec `concurrence` en vol ; retourne (débit, latences)."""
+    latences = []
+    semaphore = asyncio.Semaphore(concurrence)
+
+    async def une(i: int):
+        async with semaphore:
+            debut = time.perf_counter()
+            response = await envoyer(i)
+            assert response.status_code == 200, response.text
+            latences.append(time.perf_counter() - debut)
+
+    debut = time.perf_counter()
+    await asyncio.gather(*(une(i) for i in range(nombre)))
+    return nombre / (time.perf_counter() - debut), latences
+
+async def main(args):
+    import httpx
+    with tempfile.TemporaryDirectory() as dossier:
+        preparer_environnement(dossier)
+        with open(os.path.join(dossier, "app.log"), "w") as journal, contextlib.redirect_stdout(journal):
+            import voyage
+            from sqlmodel import Session, SQLModel
+            SQLModel.metadata.create_all(voyage.engine)
+            with Session(voyage.engine) as session:
+                session.add_all([
+                    voyage.Ticket(notchpay_reference=f"bench-{i}", amount=5000, email="bench@example.com", phone="+237600000000", description="Yaoundé - Douala")
+                    for i in range(args.webhooks)
+                ])
+                session.commit()
+
+            async with voyage.app.router.lifespan_context(voyage.app):
+                transport = httpx.ASGITransport(app=voyage.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+                    def position(i):
+                        return client.post("/track/update", json={
+                            "vehicle_id": f"bus-{i % args.vehicules}",
+                            "latitude": 3.85 + random.uniform(-0.5, 0.5),
+                            "longitude": 11.5 + random.uniform(-0.5, 0.5),
+                        })
+
+                    def webhook(i):
+                        return client.post("/paiement/webhook", params={"reference": f"bench-{i}", "status": "failed"})
+
+                    track = await mesurer(args.requetes, args.concurrence, position)
+                    await voyage.store_positions.vider() # Écritures différées comprises dans la mesure
+                    hooks = await mesurer(args.webhooks, args.concurrence, webhook)
+            taille_journal = journal.tell()
+
+    profil = os.getenv("DB_PROFILE", "-")
+    print(f"profil {profil}, concurrence {args.concurrence}, journal applicatif {taille_journal / 1024:.0f} Ko")
+    for nom, (debit, latences) in (("/track/update", track), ("/paiement/webhook", hooks)):
+        print(f"{nom:>18} {debit:>8.0f} req/s   p50 {1000 * percentile(latences, 50):>6.2f}ms   p99 {1000 * percentile(latences, 99):>6.2f}ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requetes", type=int, default=5000, help="Positions envoyées à /track/update")
+    parser.add_argument("--concurrence", type=int, default=32, help="Requêtes simultanées")
+    parser.add_argument("--vehicules", type=int, default=200, help="Véhicules distincts")
+    parser.add_argument("--webhooks", type=int, default=1000, help="Notifications de paiement (un billet chacune)")
+    asyncio.run(main(parser.parse_args()))
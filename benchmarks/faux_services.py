@@ -0,0 +1,89 @@
+"""
+Faux Notch Pay, Google Maps et Twilio pour les tests de charge : un transport httpx en mémoire
+qui répond comme les vrais services (champs lus par voyage.py seulement), après une latence
+réseau simulée. Aucun appel ne sort de la machine.
+"""
+import asyncio
+import itertools
+import json
+import random
+from typing import Dict
+
+import httpx
+
+HOTE_NOTCHPAY = "notchpay.bench"
+HOTE_GOOGLE_MAPS = "maps.bench"
+HOTE_TWILIO = "twilio.bench"
+
+def variables_environnement() -> Dict[str, str]:
+    """Configuration de voyage.py qui envoie les trois services vers les faux (à appliquer avant l'import)."""
+    return {
+        "NOTCH_PAY_PUBLIC_KEY": "pk.bench",
+        "NOTCH_PAY_API_URL": f"https://{HOTE_NOTCHPAY}/payments",
+        "GOOGLE_MAPS_API_KEY": "cle-bench",
+        "GOOGLE_MAPS_DIRECTIONS_URL": f"https://{HOTE_GOOGLE_MAPS}/maps/api/directions/json",
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "jeton-bench",
+        "TWILIO_PHONE_NUMBER": "+15005550006",
+        "TWILIO_API_BASE_URL": f"https://{HOTE_TWILIO}",
+    }
+
+# Exemple de la documentation Google (trois points) : suffisant pour le décodage de la polyligne
+POLYLIGNE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+class FauxServices:
+    """
+    Transport httpx qui répond à la place des services externes.
+    `latence` : délai moyen de chaque réponse (secondes), avec ±50 % de gigue.
+    """
+
+    def __init__(self, latence: float = 0.0, graine: int = 0):
+        self.latence = latence
+        self._rng = random.Random(graine)
+        self._references = itertools.count(1)
+        self.appels: Dict[str, int] = {"notchpay": 0, "google_maps": 0, "twilio": 0, "inconnus": 0}
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self._repondre)
+
+    async def _repondre(self, requete: httpx.Request) -> httpx.Response:
+        if self.latence > 0:
+            await asyncio.sleep(self.latence * self._rng.uniform(0.5, 1.5))
+        hote = requete.url.host
+        if hote == HOTE_NOTCHPAY:
+            self.appels["notchpay"] += 1
+            return self._notchpay(requete)
+        if hote == HOTE_GOOGLE_MAPS:
+            self.appels["google_maps"] += 1
+            return self._google_maps(requete)
+        if hote == HOTE_TWILIO:
+            self.appels["twilio"] += 1
+            return httpx.Response(201, json={"sid": f"SMbench{next(self._references)}", "status": "queued"})
+        self.appels["inconnus"] += 1
+        return httpx.Response(404, json={"message": f"Service inconnu : {hote}"})
+
+    def _notchpay(self, requete: httpx.Request) -> httpx.Response:
+        corps = json.loads(requete.content)
+        reference = f"bench.{next(self._references)}"
+        return httpx.Response(201, json={
+            "status": "Accepted",
+            "message": "Payment initialized",
+            "authorization_url": f"https://{HOTE_NOTCHPAY}/pay/{reference}",
+            "transaction": {"reference": reference, "amount": corps.get("amount"), "currency": corps.get("currency")},
+        })
+
+    def _google_maps(self, requete: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={
+            "status": "OK",
+            "routes": [{
+                "overview_polyline": {"points": POLYLIGNE},
+                "legs": [{
+                    "distance": {"text": "243 km"},
+                    "duration": {"text": "3 heures 50 min"},
+                    "steps": [
+                        {"html_instructions": f"Étape <b>{i}</b> vers {requete.url.params.get('destination')}"}
+                        for i in range(1, 8)
+                    ],
+                }],
+            }],
+        })
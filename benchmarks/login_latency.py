@@ -0,0 +1,104 @@
+"""
+Latence de connexion (/token) sous différentes concurrences, avec le pool de hachage bcrypt.
+
+Pour chaque niveau de concurrence, envoie une rafale de connexions et, en parallèle, des
+recherches de trajets : on mesure p50/p99 des deux, et le nombre de refus 503 (pool saturé).
+
+Usage : python benchmarks/login_latency.py [--niveaux 1,4,16,64] [--connexions 64] [--rounds 12] [--processus 2] [--file 32]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def preparer_environnement(dossier: str, args):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(dossier, 'login_latency.db')}"
+    os.environ["DIRECTIONS_CACHE_PATH"] = ""
+    os.environ["TRACKING_HISTORY_PATH"] = os.path.join(dossier, "positions_history.db")
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_WORKERS"] = str(args.processus)
+    os.environ["PASSWORD_HASH_QUEUE"] = str(args.file)
+    os.chdir(RACINE)
+    sys.path.insert(0, RACINE)
+
+def percentile(valeurs, p):
+    if not valeurs:
+        return float("nan")
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+async def niveau(client, concurrence, connexions):
+    latences_login, latences_recherche, refus = [], [], 0
+    semaphore = asyncio.Semaphore(concurrence)
+    termine = asyncio.Event()
+
+    async def connexion():
+        nonlocal refus
+        async with semaphore:
+            debut = time.perf_counter()
+            response = await client.post("/token", data={"username": "bench", "password": "Motdepasse1!"})
+            if response.status_code == 503:
+                refus += 1
+                return
+            assert response.status_code == 200, response.text
+            latences_login.append(time.perf_counter() - debut)
+
+    async def recherches():
+        # Trafic sans rapport avec l'authentification, qui ne doit pas être ralenti
+        while not termine.is_set():
+            debut = time.perf_counter()
+            response = await client.get("/trajets/", params={"depart": "Yaoundé", "destination": "Douala"})
+            assert response.status_code == 200, response.text
+            latences_recherche.append(time.perf_counter() - debut)
+            await asyncio.sleep(0.01)
+
+    sonde = asyncio.create_task(recherches())
+    debut = time.perf_counter()
+    await asyncio.gather(*(connexion() for _ in range(connexions)))
+    duree = time.perf_counter() - debut
+    termine.set()
+    await sonde
+    return latences_login, latences_recherche, refus, duree
+
+async def main(args):
+    import httpx
+    with tempfile.TemporaryDirectory() as dossier:
+        preparer_environnement(dossier, args)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import voyage
+        from sqlmodel import SQLModel
+        voyage.engine.echo = False
+        SQLModel.metadata.create_all(voyage.engine)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with voyage.app.router.lifespan_context(voyage.app):
+                transport = httpx.ASGITransport(app=voyage.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+                    response = await client.post("/register", json={"username": "bench", "password": "Motdepasse1!"})
+                    assert response.status_code == 200, response.text
+                    resultats = []
+                    for concurrence in args.niveaux:
+                        resultats.append((concurrence, *await niveau(client, concurrence, args.connexions)))
+
+        print(f"bcrypt rounds={args.rounds}, processus={args.processus}, file={args.file}, {args.connexions} connexions par niveau")
+        print(f"{'concurrence':>11} {'login p50':>10} {'login p99':>10} {'débit':>9} {'503':>5} {'recherche p50':>14} {'recherche p99':>14}")
+        for concurrence, login, recherche, refus, duree in resultats:
+            print(
+                f"{concurrence:>11} {1000 * percentile(login, 50):>8.1f}ms {1000 * percentile(login, 99):>8.1f}ms "
+                f"{len(login) / duree:>7.1f}/s {refus:>5} {1000 * percentile(recherche, 50):>12.2f}ms {1000 * percentile(recherche, 99):>12.2f}ms"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--niveaux", type=lambda v: [int(n) for n in v.split(",")], default=[1, 4, 16, 64])
+    parser.add_argument("--connexions", type=int, default=64, help="Connexions envoyées par niveau")
+    parser.add_argument("--rounds", type=int, default=12, help="Coût bcrypt")
+    parser.add_argument("--processus", type=int, default=2, help="Processus du pool de hachage")
+    parser.add_argument("--file", type=int, default=32, help="Calculs en attente avant refus 503")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,159 @@
+"""
+Résultats des benchmarks : résumé des latences (p50/p95/p99, débit), fichier JSON et comparaison
+avec une référence enregistrée.
+
+Utilisé par micro.py et charge.py ; aussi exécutable seul pour comparer deux fichiers :
+
+Usage : python benchmarks/mesures.py reference.json resultats.json [--seuil 0.10]
+Code de sortie 1 si au moins une mesure régresse au-delà du seuil.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSION_FORMAT = 1
+
+def percentile(valeurs: List[float], p: float) -> float:
+    """Percentile par rang le plus proche ; `valeurs` doit être triée."""
+    if not valeurs:
+        return float("nan")
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+def resumer(latences: List[float], duree: float, **extra) -> Dict[str, Any]:
+    """Latences en secondes et durée totale de la mesure -> statistiques en millisecondes et opérations par seconde."""
+    latences = sorted(latences)
+    resume = {
+        "operations": len(latences),
+        "debit_par_s": round(len(latences) / duree, 2) if duree > 0 else None,
+        "moyenne_ms": round(1000 * sum(latences) / len(latences), 4) if latences else None,
+        "p50_ms": round(1000 * percentile(latences, 50), 4) if latences else None,
+        "p95_ms": round(1000 * percentile(latences, 95), 4) if latences else None,
+        "p99_ms": round(1000 * percentile(latences, 99), 4) if latences else None,
+        "max_ms": round(1000 * latences[-1], 4) if latences else None,
+    }
+    resume.update(extra)
+    return resume
+
+def commit_courant() -> Optional[str]:
+    try:
+        sortie = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RACINE, capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return sortie.stdout.strip() or None
+
+def environnement() -> Dict[str, Any]:
+    """Contexte de la mesure : à comparer avant de conclure à une régression."""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit_courant(),
+        "python": platform.python_version(),
+        "plateforme": platform.platform(),
+        "processeurs": os.cpu_count(),
+    }
+
+def document_resultats(suite: str, parametres: Dict[str, Any], resultats: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "format": VERSION_FORMAT,
+        "suite": suite,
+        "environnement": environnement(),
+        "parametres": parametres,
+        "resultats": resultats,
+    }
+
+def ecrire_resultats(chemin: str, document: Dict[str, Any]):
+    if chemin == "-":
+        json.dump(document, sys.stdout, indent=2, ensure_ascii=False)
+        print()
+        return
+    with open(chemin, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+def lire_resultats(chemin: str) -> Dict[str, Any]:
+    with open(chemin, encoding="utf-8") as f:
+        document = json.load(f)
+    if document.get("format") != VERSION_FORMAT:
+        raise ValueError(f"{chemin} : format de résultats {document.get('format')} non pris en charge (attendu : {VERSION_FORMAT})")
+    return document
+
+# Mesures comparées : (clé, plus grand = mieux)
+INDICATEURS = (("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("debit_par_s", True))
+
+def comparer(reference: Dict[str, Any], actuel: Dict[str, Any], seuil: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare deux documents de résultats, mesure par mesure. Une ligne par (mesure, indicateur)
+    présents des deux côtés, avec la variation relative et `regression` si elle dépasse le seuil
+    dans le mauvais sens (latence plus haute ou débit plus bas).
+    """
+    lignes = []
+    for nom, valeurs in actuel["resultats"].items():
+        base = reference["resultats"].get(nom)
+        if base is None:
+            continue
+        for indicateur, croissant in INDICATEURS:
+            avant, apres = base.get(indicateur), valeurs.get(indicateur)
+            if not avant or apres is None:
+                continue
+            variation = (apres - avant) / avant
+            degradation = -variation if croissant else variation
+            lignes.append({
+                "mesure": nom,
+                "indicateur": indicateur,
+                "reference": avant,
+                "actuel": apres,
+                "variation": round(variation, 4),
+                "regression": degradation > seuil,
+            })
+    return lignes
+
+def afficher_comparaison(lignes: List[Dict[str, Any]], reference: Dict[str, Any], actuel: Dict[str, Any], seuil: float) -> bool:
+    """Affiche le tableau de comparaison ; retourne True si aucune régression."""
+    env_ref, env_act = reference.get("environnement", {}), actuel.get("environnement", {})
+    print(f"Référence : commit {env_ref.get('commit')} du {env_ref.get('date')} ; actuel : commit {env_act.get('commit')} du {env_act.get('date')}")
+    for cle in ("python", "plateforme", "processeurs"):
+        if env_ref.get(cle) != env_act.get(cle):
+            print(f"  attention : {cle} différent ({env_ref.get(cle)} -> {env_act.get(cle)}), comparaison peu fiable")
+    if reference.get("parametres") != actuel.get("parametres"):
+        print("  attention : paramètres de mesure différents de la référence")
+    largeur = max((len(ligne["mesure"]) for ligne in lignes), default=10)
+    for ligne in lignes:
+        marque = "  RÉGRESSION" if ligne["regression"] else ""
+        print(f"{ligne['mesure']:<{largeur}}  {ligne['indicateur']:>11}  {ligne['reference']:>12.4g} -> {ligne['actuel']:<12.4g} {100 * ligne['variation']:+7.1f}%{marque}")
+    regressions = [ligne for ligne in lignes if ligne["regression"]]
+    print(f"{len(regressions)} régression(s) au-delà de {100 * seuil:.0f}% sur {len(lignes)} indicateurs comparés.")
+    return not regressions
+
+def comparer_fichiers(chemin_reference: str, actuel: Dict[str, Any], seuil: float) -> bool:
+    reference = lire_resultats(chemin_reference)
+    if reference.get("suite") != actuel.get("suite"):
+        raise ValueError(f"{chemin_reference} : suite '{reference.get('suite')}', attendu '{actuel.get('suite')}'")
+    return afficher_comparaison(comparer(reference, actuel, seuil), reference, actuel, seuil)
+
+def ajouter_options(parser: argparse.ArgumentParser):
+    """Options communes aux suites : fichier de sortie et comparaison avec une référence."""
+    parser.add_argument("--sortie", default=None, help="Fichier JSON des résultats ('-' : sortie standard)")
+    parser.add_argument("--reference", default=None, help="Résultats enregistrés à comparer (code de sortie 1 en cas de régression)")
+    parser.add_argument("--seuil", type=float, default=0.10, help="Variation relative tolérée avant de signaler une régression")
+
+def conclure(args, suite: str, parametres: Dict[str, Any], resultats: Dict[str, Dict[str, Any]]) -> int:
+    """Écrit les résultats et les compare à la référence demandée ; retourne le code de sortie."""
+    document = document_resultats(suite, parametres, resultats)
+    if args.sortie:
+        ecrire_resultats(args.sortie, document)
+    if not args.reference:
+        return 0
+    return 0 if comparer_fichiers(args.reference, document, args.seuil) else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("reference", help="Résultats de référence (JSON)")
+    parser.add_argument("resultats", help="Résultats à comparer (JSON)")
+    parser.add_argument("--seuil", type=float, default=0.10, help="Variation relative tolérée (0.10 = 10 %%)")
+    args = parser.parse_args()
+    sys.exit(0 if comparer_fichiers(args.reference, lire_resultats(args.resultats), args.seuil) else 1)
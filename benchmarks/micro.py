@@ -0,0 +1,155 @@
+"""
+Micro-benchmarks des fonctions de recherche, sur des catalogues synthétiques de taille croissante.
+
+Mesures, pour chaque facteur de taille (catalogue_synthetique.py) :
+- normalize_text sur les noms de villes du catalogue ;
+- calculer_distance, appel seul et balayage de toutes les agences (recherche naïve des plus proches) ;
+- trouver_trajet_disponible (lignes desservies, 10 % de lignes inconnues, dates sur une semaine) ;
+- trouver_agences_proches (points tirés autour des agences, 10 résultats), cache des réponses vide
+  (calcul, sérialisation et compression à chaque appel) puis rempli (/cache) ;
+- construction du SnapshotCatalogue (chargement ou rechargement du fichier).
+Les deux recherches sont mesurées avec le catalogue JSON en mémoire et avec CATALOGUE_BACKEND=sql.
+
+Usage : python benchmarks/micro.py [--facteurs 1,10,100,1000] [--backends json,sql] [--duree 1.0] [--sortie micro.json] [--reference base.json]
+"""
+import argparse
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+import mesures
+from catalogue_synthetique import boite, generer_catalogue, lire_source, paires_trajets
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def preparer_environnement(dossier: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(dossier, 'micro.db')}"
+    os.environ["DIRECTIONS_CACHE_PATH"] = ""
+    os.environ["TRACKING_HISTORY_PATH"] = os.path.join(dossier, "positions_history.db")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.chdir(RACINE)
+    sys.path.insert(0, RACINE)
+
+def chronometrer(fonction: Callable, arguments: Sequence[tuple], duree: float, min_appels: int = 20) -> Dict[str, Any]:
+    """
+    Appelle `fonction(*arguments[i])` en boucle sur les arguments, pendant `duree` secondes et au
+    moins `min_appels` fois, après un court échauffement. Chaque appel est chronométré seul.
+    """
+    for args in arguments[:min(len(arguments), 10)]:
+        fonction(*args)
+    latences = []
+    horloge = time.perf_counter
+    debut = horloge()
+    fin = debut + duree
+    i = 0
+    while True:
+        t0 = horloge()
+        fonction(*arguments[i % len(arguments)])
+        t1 = horloge()
+        latences.append(t1 - t0)
+        i += 1
+        if t1 >= fin and i >= min_appels:
+            break
+    return mesures.resumer(latences, horloge() - debut)
+
+def requetes_trajets(agences: List[Dict[str, Any]], nombre: int, rng: random.Random) -> List[tuple]:
+    paires = paires_trajets(agences)
+    dates = [f"2030-01-{jour:02d}" for jour in range(7, 14)] # Une semaine, du lundi au dimanche
+    requetes = []
+    for _ in range(nombre):
+        depart, destination = rng.choice(paires)
+        if rng.random() < 0.1:
+            destination = "Ville Inconnue"
+        requetes.append((depart, destination, rng.choice(dates)))
+    return requetes
+
+def points_proches(agences: List[Dict[str, Any]], nombre: int, rng: random.Random) -> List[tuple]:
+    lat_min, lat_max, lon_min, lon_max = boite(agences)
+    return [(rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)) for _ in range(nombre)]
+
+def main(args) -> int:
+    facteurs = [int(f) for f in args.facteurs.split(",")]
+    backends = [b for b in args.backends.split(",") if b]
+    with tempfile.TemporaryDirectory() as dossier:
+        preparer_environnement(dossier)
+        import voyage
+        from catalogue import normalize_text
+        from catalogue_db import Agence, CatalogueSQL, ImportCatalogue, Trajet, importer_agences
+        from gestion_catalogue import SnapshotCatalogue
+        from sqlmodel import SQLModel
+        from starlette.requests import Request
+
+        logging.getLogger().setLevel(os.environ["LOG_LEVEL"])
+        source = lire_source()
+        resultats: Dict[str, Dict[str, Any]] = {}
+
+        def mesurer(nom: str, fonction: Callable, arguments: Sequence[tuple], duree: float = args.duree, min_appels: int = 20):
+            gc.collect()
+            resultats[nom] = chronometrer(fonction, arguments, duree, min_appels)
+            r = resultats[nom]
+            print(f"{nom:<46} {r['debit_par_s']:>12.0f} op/s   p50 {r['p50_ms']:>9.4f}ms   p95 {r['p95_ms']:>9.4f}ms   p99 {r['p99_ms']:>9.4f}ms", flush=True)
+
+        coordonnees = [(a["latitude"], a["longitude"]) for a in source]
+        mesurer("calculer_distance", voyage.calculer_distance, [(*p, *q) for p in coordonnees for q in coordonnees])
+
+        for facteur in facteurs:
+            agences = generer_catalogue(source, facteur, args.graine)
+            suffixe = f"x{facteur}"
+            rng = random.Random(args.graine * 100003 + facteur) # Mêmes requêtes pour un facteur, quels que soient les autres
+            villes = sorted({a["ville_depart"] for a in agences} | {t["destination"] for a in agences for t in a.get("trajets", [])})
+            mesurer(f"normalize_text/{suffixe}", normalize_text, [(ville,) for ville in villes])
+
+            coords_agences = [(a["latitude"], a["longitude"]) for a in agences]
+            points = points_proches(agences, 200, rng)
+
+            def balayage(latitude: float, longitude: float):
+                return min(voyage.calculer_distance(latitude, longitude, lat, lon) for lat, lon in coords_agences)
+            mesurer(f"calculer_distance/balayage/{suffixe}", balayage, points)
+
+            mesurer(f"snapshot/{suffixe}", SnapshotCatalogue, [(agences,)], duree=args.duree, min_appels=3)
+
+            requetes = requetes_trajets(agences, 500, rng)
+            for backend in backends:
+                if backend == "json":
+                    catalogue = SnapshotCatalogue(agences)
+                    voyage.catalogue_agences.snapshot = catalogue
+                elif backend == "sql":
+                    SQLModel.metadata.create_all(voyage.engine, tables=[Agence.__table__, Trajet.__table__, ImportCatalogue.__table__])
+                    importer_agences(voyage.engine, agences)
+                    catalogue = voyage.catalogue_sql = CatalogueSQL(voyage.engine)
+                else:
+                    raise SystemExit(f"Backend inconnu : {backend} (json ou sql)")
+                voyage.CATALOGUE_BACKEND = backend
+
+                mesurer(
+                    f"trouver_trajet_disponible/{backend}/{suffixe}",
+                    lambda depart, destination, date: voyage.trouver_trajet_disponible(depart, destination, date, catalogue),
+                    requetes,
+                )
+                # Appel direct de la route : paramètres passés explicitement (pas de valeurs Query par défaut)
+                requete = Request({"type": "http", "method": "GET", "path": "/agences/proches", "query_string": b"", "headers": [(b"accept-encoding", b"gzip")]})
+                proches = lambda latitude, longitude: voyage.trouver_agences_proches(requete, latitude, longitude, limit=10, radius_km=None, offset=0)
+                voyage.cache_reponses.vider()
+                voyage.cache_reponses.max_entrees = 0 # Chaque réponse sort aussitôt du cache : toujours recalculée
+                mesurer(f"trouver_agences_proches/{backend}/{suffixe}", proches, points)
+                voyage.cache_reponses.max_entrees = len(points)
+                for point in points:
+                    proches(*point)
+                mesurer(f"trouver_agences_proches/{backend}/{suffixe}/cache", proches, points)
+
+    parametres = {"facteurs": facteurs, "backends": backends, "duree": args.duree, "graine": args.graine}
+    return mesures.conclure(args, "micro", parametres, resultats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--facteurs", default="1,10,100,1000", help="Tailles du catalogue, en multiples de agences.json")
+    parser.add_argument("--backends", default="json,sql", help="Catalogues mesurés pour les recherches (json, sql)")
+    parser.add_argument("--duree", type=float, default=1.0, help="Durée de chaque mesure (secondes)")
+    parser.add_argument("--graine", type=int, default=0, help="Graine des catalogues et des requêtes")
+    mesures.ajouter_options(parser)
+    sys.exit(main(parser.parse_args()))
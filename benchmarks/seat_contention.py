@@ -0,0 +1,122 @@
+"""
+Réservations concurrentes sur un même départ : débit et absence de survente.
+
+Plusieurs processus (comme des workers gunicorn) partagent la même base ; chacun lance des
+retenues de places en parallèle sur un seul départ. Une partie des paiements échoue et rend
+ses places, le reste est confirmé. À la fin on vérifie que places vendues + retenues + restantes
+= capacité, et qu'aucune place n'a été vendue deux fois.
+
+Usage : python benchmarks/seat_contention.py [--processus 4] [--concurrence 32] [--tentatives 500] [--capacite 70] [--echecs 0.3] [--database-url URL]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+CLE = ("Bench Voyages", "yaounde", "douala", "08:00", "2030-01-07", "classique")
+
+def creer_engine(url: str):
+    from base_donnees import creer_engine as creer_engine_app, profil_courant
+    # Profil de l'application (DB_PROFILE), avec une attente du verrou SQLite généreuse : toutes les écritures visent la même ligne
+    return creer_engine_app(url, profil_courant().model_copy(update={"sqlite_busy_timeout_ms": 60000}))
+
+async def rafale(url: str, numero: int, capacite: int, concurrence: int, tentatives: int, echecs: float):
+    from inventaire import Inventaire
+    inventaire = Inventaire(creer_engine(url), capacites={"classique": capacite}, intervalle_balayage=0)
+    semaphore = asyncio.Semaphore(concurrence)
+    latences, refus = [], 0
+
+    async def reserver(i: int):
+        nonlocal refus
+        async with semaphore:
+            debut = time.perf_counter()
+            reservation_id = await inventaire.retenir(CLE, 1)
+            latences.append(time.perf_counter() - debut)
+            if reservation_id is None:
+                refus += 1
+                return
+            reference = f"bench-{numero}-{i}"
+            await inventaire.associer(reservation_id, reference)
+            await inventaire.notifier_paiement(reference, "failed" if random.random() < echecs else "complete")
+
+    await asyncio.gather(*(reserver(i) for i in range(tentatives)))
+    return latences, refus, inventaire.stats
+
+def processus(url: str, numero: int, args, depart, resultats):
+    depart.wait()
+    debut = time.perf_counter()
+    latences, refus, stats = asyncio.run(rafale(url, numero, args.capacite, args.concurrence, args.tentatives, args.echecs))
+    resultats.put((latences, refus, stats, time.perf_counter() - debut))
+
+def percentile(valeurs, p):
+    if not valeurs:
+        return float("nan")
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+def main(args, url: str):
+    from sqlmodel import Session, SQLModel, func, select
+    from inventaire import PlacesDepart, Reservation
+
+    engine = creer_engine(url)
+    SQLModel.metadata.create_all(engine, tables=[PlacesDepart.__table__, Reservation.__table__])
+    with Session(engine) as session:
+        agence, depart_norm, destination_norm, heure, date_voyage, classe = CLE
+        session.add(PlacesDepart(
+            agence=agence, depart_norm=depart_norm, destination_norm=destination_norm, heure_depart=heure,
+            date_voyage=date_voyage, classe=classe, capacite=args.capacite, places_restantes=args.capacite,
+        ))
+        session.commit()
+
+    contexte = multiprocessing.get_context("spawn")
+    depart, resultats = contexte.Event(), contexte.Queue()
+    travailleurs = [contexte.Process(target=processus, args=(url, n, args, depart, resultats)) for n in range(args.processus)]
+    for travailleur in travailleurs:
+        travailleur.start()
+    debut = time.perf_counter()
+    depart.set()
+    lots = [resultats.get() for _ in travailleurs]
+    duree = time.perf_counter() - debut
+    for travailleur in travailleurs:
+        travailleur.join()
+
+    latences = [latence for lot in lots for latence in lot[0]]
+    refus = sum(lot[1] for lot in lots)
+    confirmees_stats = sum(lot[2]["confirmees"] for lot in lots)
+    with Session(engine) as session:
+        restantes = session.exec(select(PlacesDepart.places_restantes)).one()
+        par_statut = dict(session.exec(select(Reservation.status, func.sum(Reservation.places)).group_by(Reservation.status)).all())
+    vendues, retenues = par_statut.get("confirmed", 0), par_statut.get("held", 0)
+
+    total = args.processus * args.tentatives
+    print(f"{args.processus} processus x {args.tentatives} tentatives (concurrence {args.concurrence} par processus), capacité {args.capacite}")
+    print(f"durée {duree:.2f}s, débit {total / duree:.0f} tentatives/s, retenue p50 {1000 * percentile(latences, 50):.1f}ms p99 {1000 * percentile(latences, 99):.1f}ms")
+    print(f"refus (complet) {refus}, places par statut {par_statut}, restantes {restantes}")
+    ok = (
+        restantes >= 0
+        and vendues + retenues + restantes == args.capacite
+        and vendues == confirmees_stats
+        and "oversold" not in par_statut
+    )
+    print("Aucune survente." if ok else "SURVENTE OU INCOHÉRENCE DÉTECTÉE !")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processus", type=int, default=4, help="Processus concurrents (workers)")
+    parser.add_argument("--concurrence", type=int, default=32, help="Réservations simultanées par processus")
+    parser.add_argument("--tentatives", type=int, default=500, help="Réservations tentées par processus")
+    parser.add_argument("--capacite", type=int, default=70, help="Places du départ")
+    parser.add_argument("--echecs", type=float, default=0.3, help="Part des paiements qui échouent (places rendues)")
+    parser.add_argument("--database-url", default=None, help="Base à utiliser (défaut : SQLite temporaire)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as dossier:
+        url = args.database_url or f"sqlite:///{os.path.join(dossier, 'seat_contention.db')}"
+        sys.exit(0 if main(args, url) else 1)
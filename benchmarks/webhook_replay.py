@@ -0,0 +1,103 @@
+"""
+Test de charge du webhook Notch Pay : rejoue des milliers de notifications en double
+et dans le désordre contre une base SQLite temporaire, puis vérifie l'état final.
+
+Usage : python benchmarks/webhook_replay.py [--billets 500] [--doublons 4] [--concurrence 50]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def preparer_environnement(dossier: str):
+    # Base jetable et aucun service externe configuré (les SMS finissent en échec définitif)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(dossier, 'webhook_replay.db')}"
+    os.environ["DIRECTIONS_CACHE_PATH"] = ""
+    for variable in ("TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_NUMBER"):
+        os.environ.pop(variable, None)
+    os.chdir(RACINE)
+    sys.path.insert(0, RACINE)
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+async def rejouer(app, notifications, concurrence):
+    import httpx
+    latences = []
+    semaphore = asyncio.Semaphore(concurrence)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        async def envoyer(reference, statut):
+            async with semaphore:
+                debut = time.perf_counter()
+                response = await client.post("/paiement/webhook", params={"reference": reference, "status": statut})
+                latences.append(time.perf_counter() - debut)
+                assert response.status_code == 200, response.text
+
+        debut = time.perf_counter()
+        await asyncio.gather(*(envoyer(reference, statut) for reference, statut in notifications))
+        duree = time.perf_counter() - debut
+    return latences, duree
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as dossier:
+        preparer_environnement(dossier)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import voyage
+        from sqlmodel import Session, SQLModel, select, func
+        from sms_queue import SmsOutbox
+        voyage.engine.echo = False
+        SQLModel.metadata.create_all(voyage.engine)
+
+        references = [f"trx.replay.{i}" for i in range(args.billets)]
+        with Session(voyage.engine) as session:
+            for reference in references:
+                session.add(voyage.Ticket(notchpay_reference=reference, amount=5000, email="a@b.cm", phone="+237600000000", description="Douala"))
+            session.commit()
+
+        # Chaque billet reçoit pending, failed et complete, chacun en plusieurs exemplaires, le tout mélangé
+        random.seed(args.graine)
+        notifications = [
+            (reference, statut)
+            for reference in references
+            for statut in ("pending", "failed", "complete")
+            for _ in range(args.doublons)
+        ]
+        random.shuffle(notifications)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            async with voyage.app.router.lifespan_context(voyage.app):
+                latences, duree = await rejouer(voyage.app, notifications, args.concurrence)
+
+        with Session(voyage.engine) as session:
+            statuts = dict(session.exec(select(voyage.Ticket.status, func.count()).group_by(voyage.Ticket.status)).all())
+            evenements = session.exec(select(func.count()).select_from(voyage.WebhookEvent)).one()
+            sms = session.exec(select(func.count()).select_from(SmsOutbox)).one()
+
+        print(f"Notifications rejouées : {len(notifications)} ({args.billets} billets x 3 statuts x {args.doublons})")
+        print(f"Débit : {len(notifications) / duree:.0f} req/s en {duree:.2f}s (concurrence {args.concurrence})")
+        print(f"Latence p50 : {1000 * percentile(latences, 50):.2f} ms, p99 : {1000 * percentile(latences, 99):.2f} ms")
+        print(f"Statuts finaux : {statuts}")
+        print(f"Événements journalisés : {evenements}, SMS en file : {sms}")
+
+        # Un statut final n'est jamais écrasé et chaque doublon est acquitté sans effet
+        assert statuts == {"complete": args.billets}, statuts
+        assert evenements == 3 * args.billets, evenements
+        assert sms == args.billets, sms
+        print("OK : aucun billet régressé, un seul SMS par paiement.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--billets", type=int, default=500)
+    parser.add_argument("--doublons", type=int, default=4, help="Exemplaires de chaque notification")
+    parser.add_argument("--concurrence", type=int, default=50)
+    parser.add_argument("--graine", type=int, default=42)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import brotli # Facultatif : sans lui, les réponses sont seulement compressées en gzip
+except ImportError:
+    brotli = None
+
+class ReponseCachee:
+    """Réponse JSON sérialisée une fois, avec ses variantes compressées et leurs ETags."""
+
+    __slots__ = ("corps", "variantes", "etags", "en_tetes", "expire_a", "taille")
+
+    def __init__(self, corps: bytes, variantes: Dict[str, bytes], en_tetes: Dict[str, str], expire_a: float):
+        self.corps = corps
+        self.variantes = variantes # Content-Encoding -> corps compressé
+        empreinte = hashlib.sha256(corps).hexdigest()[:20]
+        # ETag fort par représentation : le corps gzip n'est pas le même octet pour octet que le corps brut
+        self.etags = {"identity": f'"{empreinte}"', **{codage: f'"{empreinte}-{codage}"' for codage in variantes}}
+        self.en_tetes = en_tetes
+        self.expire_a = expire_a
+        self.taille = len(corps) + sum(len(v) for v in variantes.values())
+
+def serialiser(contenu: Any) -> bytes:
+    # Mêmes options que JSONResponse : le corps est identique à celui d'une route sans cache
+    return json.dumps(contenu, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def codages_acceptes(accept_encoding: str) -> List[str]:
+    """Codages de l'en-tête Accept-Encoding acceptés (q > 0), du plus au moins préféré."""
+    codages = []
+    for partie in accept_encoding.split(","):
+        nom, _, parametres = partie.partition(";")
+        q = 1.0
+        for parametre in parametres.split(";"):
+            cle, _, valeur = parametre.strip().partition("=")
+            if cle.lower() == "q":
+                try:
+                    q = float(valeur)
+                except ValueError:
+                    q = 0.0
+        if nom.strip() and q > 0:
+            codages.append((q, nom.strip().lower()))
+    codages.sort(key=lambda codage: -codage[0]) # Tri stable : ordre du client à préférence égale
+    return [nom for _, nom in codages]
+
+def correspond(if_none_match: str, etags) -> bool:
+    """Comparaison faible de If-None-Match (RFC 9110) : W/ ignoré, '*' correspond à tout."""
+    for etag in if_none_match.split(","):
+        etag = etag.strip()
+        if etag == "*":
+            return True
+        if etag.startswith("W/"):
+            etag = etag[2:]
+        if etag in etags:
+            return True
+    return False
+
+def quantifier(valeur: float, pas: float) -> float:
+    """Arrondit une coordonnée à la grille de `pas` degrés (0 : inchangée)."""
+    if pas <= 0:
+        return valeur
+    return round(round(valeur / pas) * pas, 6)
+
+class CacheReponses:
+    """
+    Cache LRU borné des réponses JSON des routes dérivées du catalogue.
+
+    La clé contient la version du catalogue et les paramètres normalisés : un rechargement
+    d'agences.json rend les anciennes entrées inaccessibles (elles sortent ensuite du LRU),
+    sans invalidation explicite. Le corps est stocké déjà sérialisé, et compressé (gzip, brotli
+    si disponible) au-delà de `taille_min_compression` octets. Chaque réponse porte un ETag
+    fort et Cache-Control ; un If-None-Match correspondant reçoit un 304 sans corps.
+    """
+
+    def __init__(self, max_entrees: int = 5000, max_octets: int = 64 * 1024 * 1024, ttl_secondes: float = 3600.0,
+                 max_age: int = 60, taille_min_compression: int = 1024):
+        self.max_entrees = max_entrees
+        self.max_octets = max_octets
+        self.ttl = ttl_secondes # Borne aussi les données venues d'ailleurs (itinéraires Google Maps)
+        self.max_age = max_age # Cache-Control envoyé aux clients
+        self.taille_min_compression = taille_min_compression
+        self._entrees: "OrderedDict[Hashable, ReponseCachee]" = OrderedDict()
+        self._octets = 0
+        self._verrou = threading.Lock() # Routes synchrones exécutées dans le threadpool
+        self.stats = {"hits": 0, "misses": 0, "non_modifies": 0, "octets_bruts": 0, "octets_envoyes": 0}
+
+    def obtenir(self, cle: Hashable) -> Optional[ReponseCachee]:
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None or entree.expire_a <= time.monotonic():
+                if entree is not None:
+                    self._retirer(cle)
+                self.stats["misses"] += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self.stats["hits"] += 1
+            return entree
+
+    def preparer(self, contenu: Any, en_tetes: Optional[Dict[str, str]] = None) -> ReponseCachee:
+        """Sérialise et compresse une réponse (sans la mettre en cache)."""
+        corps = serialiser(contenu)
+        variantes = {}
+        if len(corps) >= self.taille_min_compression:
+            variantes["gzip"] = gzip.compress(corps, compresslevel=6, mtime=0) # mtime=0 : même octets, même ETag
+            if brotli is not None:
+                variantes["br"] = brotli.compress(corps, quality=5)
+        return ReponseCachee(corps, variantes, dict(en_tetes or {}), time.monotonic() + self.ttl)
+
+    def enregistrer(self, cle: Hashable, entree: ReponseCachee):
+        if entree.taille > self.max_octets:
+            return
+        with self._verrou:
+            self._retirer(cle)
+            self._entrees[cle] = entree
+            self._octets += entree.taille
+            while len(self._entrees) > self.max_entrees or self._octets > self.max_octets:
+                self._retirer(next(iter(self._entrees)))
+
+    def servir(self, request: Request, cle: Hashable, calculer: Callable[[], Tuple[Any, Dict[str, str]]]) -> Response:
+        """Réponse en cache, sinon `calculer()` -> (contenu, en-têtes) mis en cache. Les HTTPException passent."""
+        entree = self.obtenir(cle)
+        if entree is None:
+            entree = self.preparer(*calculer())
+            self.enregistrer(cle, entree)
+        return self.reponse(request, entree)
+
+    def reponse(self, request: Request, entree: ReponseCachee) -> Response:
+        """304 si le client a déjà cette version, sinon le corps dans le meilleur codage accepté."""
+        codage = "identity"
+        if entree.variantes:
+            for accepte in codages_acceptes(request.headers.get("accept-encoding", "")):
+                if accepte == "*":
+                    accepte = next(iter(entree.variantes))
+                if accepte in entree.variantes:
+                    codage = accepte
+                    break
+        en_tetes = {
+            **entree.en_tetes,
+            "ETag": entree.etags[codage],
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and correspond(if_none_match, entree.etags.values()):
+            with self._verrou:
+                self.stats["non_modifies"] += 1
+            return Response(status_code=304, headers=en_tetes)
+        corps = entree.corps
+        if codage != "identity":
+            corps = entree.variantes[codage]
+            en_tetes["Content-Encoding"] = codage
+        with self._verrou:
+            self.stats["octets_bruts"] += len(entree.corps)
+            self.stats["octets_envoyes"] += len(corps)
+        return Response(corps, media_type="application/json", headers=en_tetes)
+
+    def vider(self):
+        with self._verrou:
+            self._entrees.clear()
+            self._octets = 0
+
+    def _retirer(self, cle: Hashable):
+        # À appeler avec le verrou
+        entree = self._entrees.pop(cle, None)
+        if entree is not None:
+            self._octets -= entree.taille
+
+    def statistiques(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        total = stats["hits"] + stats["misses"]
+        stats["taux_hits"] = round(stats["hits"] / total, 3) if total else 0.0
+        stats["entrees"] = len(self._entrees)
+        stats["octets_en_cache"] = self._octets
+        stats["brotli"] = brotli is not None
+        return stats
@@ -0,0 +1,79 @@
+import re
+import unicodedata
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+# Jours de la semaine tels qu'ils apparaissent dans agences.json (index = datetime.weekday())
+JOURS_FR = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+TOUS_LES_JOURS = (1 << len(JOURS_FR)) - 1
+
+def normalize_text(text: str) -> str:
+    """Normalise le texte en minuscules, sans accents et sans espaces superflus."""
+    s = ''.join(c for c in unicodedata.normalize('NFD', text)
+                if unicodedata.category(c) != 'Mn')
+    return s.lower().strip() # Ajout de strip() pour enlever les espaces
+
+def parser_duree(duree: Optional[str]) -> Optional[int]:
+    """Convertit une durée du catalogue ("4h 30m", "5h", "45m") en minutes. None si illisible."""
+    if not duree:
+        return None
+    correspondance = re.fullmatch(r'\s*(?:(\d+)\s*h)?\s*(?:(\d+)\s*(?:m|min))?\s*', duree.lower())
+    if not correspondance or not any(correspondance.groups()):
+        return None
+    heures, minutes = correspondance.groups()
+    return int(heures or 0) * 60 + int(minutes or 0)
+
+def masque_jours(days_of_week: Optional[List[str]]) -> int:
+    """Convertit une liste de jours en masque de bits (bit 0 = Lundi). Liste absente ou vide = tous les jours."""
+    if not days_of_week:
+        return TOUS_LES_JOURS
+    masque = 0
+    for jour in days_of_week:
+        if jour in JOURS_FR:
+            masque |= 1 << JOURS_FR.index(jour)
+    return masque
+
+def bit_jour(date_voyage: Optional[str]) -> Optional[int]:
+    """Retourne le bit du jour de la semaine pour une date YYYY-MM-DD, ou None si la date est absente ou invalide."""
+    if not date_voyage:
+        return None
+    try:
+        date_obj = datetime.strptime(date_voyage, "%Y-%m-%d")
+    except ValueError:
+        # Si le format de date est invalide, on ne filtre pas par jour
+        return None
+    return 1 << date_obj.weekday()
+
+def construire_index_trajets(agences: List[Dict[str, Any]]) -> Dict[Tuple[str, str], List[Tuple[int, Dict[str, Any]]]]:
+    """
+    Construit l'index des trajets : (départ normalisé, destination normalisée) -> [(masque des jours, résultat pré-construit)].
+    L'ordre des agences et des trajets du fichier est conservé.
+    """
+    index: Dict[Tuple[str, str], List[Tuple[int, Dict[str, Any]]]] = {}
+    for agence in agences:
+        depart_normalized = normalize_text(agence.get('ville_depart', ''))
+        for trajet in agence.get('trajets', []):
+            cle = (depart_normalized, normalize_text(trajet.get('destination', '')))
+            trajet_info = {
+                'agence': agence.get('nom_agence'),
+                'destination': trajet.get('destination'),
+                'latitude': trajet.get('latitude'),
+                'longitude': trajet.get('longitude'),
+                'prix_vip': trajet.get('prix_vip'),
+                'prix_classique': trajet.get('prix_classique'),
+                'heureDepart': trajet.get('departure'),
+                'dureeEstimee': trajet.get('duration'),
+            }
+            index.setdefault(cle, []).append((masque_jours(trajet.get('days_of_week')), trajet_info))
+    return index
+
+def resume_agence(agence: Dict[str, Any]) -> Dict[str, Any]:
+    """Résumé léger d'une agence pour les réponses de proximité (sans la liste des trajets)."""
+    return {
+        'nom_agence': agence.get('nom_agence'),
+        'ville_depart': agence.get('ville_depart'),
+        'adresse': agence.get('adresse'),
+        'latitude': agence.get('latitude'),
+        'longitude': agence.get('longitude'),
+        'nombre_trajets': len(agence.get('trajets', [])),
+    }
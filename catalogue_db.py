@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from math import cos, radians
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Index, delete, func
+from sqlmodel import Field, Session, SQLModel, select
+
+from catalogue import TOUS_LES_JOURS, bit_jour, masque_jours, normalize_text
+from geo import boite_englobante, distance_km
+from planificateur import ReseauTrajets
+from recherche_villes import IndexVilles
+
+# --- MODÈLES ---
+
+class Agence(SQLModel, table=True):
+    # Index composite sur les coordonnées : la recherche de proximité filtre d'abord par rectangle
+    __table_args__ = (Index("ix_agence_coordonnees", "latitude", "longitude"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    nom_agence: str = Field(index=True)
+    ville_depart: str
+    ville_depart_norm: str = Field(index=True) # normalize_text(ville_depart)
+    adresse: Optional[str] = None
+    latitude: float
+    longitude: float
+    nombre_trajets: int = Field(default=0)
+
+class Trajet(SQLModel, table=True):
+    # (départ, destination) normalisés : une recherche de trajets est une seule lecture d'index
+    __table_args__ = (Index("ix_trajet_depart_destination", "depart_norm", "destination_norm"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    agence_id: int = Field(foreign_key="agence.id", index=True)
+    agence_nom: str # Recopié de l'agence pour répondre sans jointure
+    depart_norm: str
+    destination: str
+    destination_norm: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    prix_vip: Optional[int] = None
+    prix_classique: Optional[int] = None
+    heure_depart: Optional[str] = None
+    duree: Optional[str] = None
+    jours_masque: int = Field(default=TOUS_LES_JOURS) # Bit 0 = Lundi (voir catalogue.masque_jours)
+
+class ImportCatalogue(SQLModel, table=True):
+    # Une ligne par import : la dernière donne la version du catalogue en service (clé des caches de réponses)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    version: str # Empreinte du contenu, comme SnapshotCatalogue.version
+    agences: int
+    trajets: int
+    importe_a: datetime = Field(default_factory=datetime.utcnow)
+
+# --- IMPORT ---
+
+def importer_agences(engine, agences: List[Dict[str, Any]], version: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Remplace le contenu des tables Agence et Trajet par les agences données (format agences.json),
+    en une seule transaction. L'ordre du fichier est conservé (ids croissants).
+    `version` : empreinte du fichier (lire_agences), sinon calculée sur les agences.
+    Retourne (nombre d'agences, nombre de trajets).
+    """
+    if version is None:
+        version = hashlib.sha256(json.dumps(agences, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+    nombre_trajets = 0
+    with Session(engine) as session:
+        session.exec(delete(Trajet))
+        session.exec(delete(Agence))
+        lignes_agences = [
+            Agence(
+                nom_agence=agence['nom_agence'],
+                ville_depart=agence['ville_depart'],
+                ville_depart_norm=normalize_text(agence['ville_depart']),
+                adresse=agence.get('adresse'),
+                latitude=agence['latitude'],
+                longitude=agence['longitude'],
+                nombre_trajets=len(agence.get('trajets', [])),
+            )
+            for agence in agences
+        ]
+        session.add_all(lignes_agences)
+        session.flush() # Attribue les ids des agences
+        for agence, ligne in zip(agences, lignes_agences):
+            session.add_all([
+                Trajet(
+                    agence_id=ligne.id,
+                    agence_nom=ligne.nom_agence,
+                    depart_norm=ligne.ville_depart_norm,
+                    destination=trajet['destination'],
+                    destination_norm=normalize_text(trajet['destination']),
+                    latitude=trajet.get('latitude'),
+                    longitude=trajet.get('longitude'),
+                    prix_vip=trajet.get('prix_vip'),
+                    prix_classique=trajet.get('prix_classique'),
+                    heure_depart=trajet.get('departure'),
+                    duree=trajet.get('duration'),
+                    jours_masque=masque_jours(trajet.get('days_of_week')),
+                )
+                for trajet in agence.get('trajets', [])
+            ])
+            nombre_trajets += len(agence.get('trajets', []))
+        session.add(ImportCatalogue(version=version, agences=len(agences), trajets=nombre_trajets))
+        session.commit()
+    return len(agences), nombre_trajets
+
+# --- REQUÊTES ---
+
+# Colonnes lues pour les réponses de proximité : pas d'objets ORM complets
+COLONNES_RESUME_AGENCE = (Agence.id, Agence.nom_agence, Agence.ville_depart, Agence.adresse, Agence.latitude, Agence.longitude, Agence.nombre_trajets)
+
+def resume_agence_sql(agence) -> Dict[str, Any]:
+    """Même forme que catalogue.resume_agence (objet Agence ou ligne de COLONNES_RESUME_AGENCE)."""
+    return {
+        'nom_agence': agence.nom_agence,
+        'ville_depart': agence.ville_depart,
+        'adresse': agence.adresse,
+        'latitude': agence.latitude,
+        'longitude': agence.longitude,
+        'nombre_trajets': agence.nombre_trajets,
+    }
+
+def info_trajet_sql(trajet: Trajet) -> Dict[str, Any]:
+    """Même forme que les entrées de catalogue.construire_index_trajets."""
+    return {
+        'agence': trajet.agence_nom,
+        'destination': trajet.destination,
+        'latitude': trajet.latitude,
+        'longitude': trajet.longitude,
+        'prix_vip': trajet.prix_vip,
+        'prix_classique': trajet.prix_classique,
+        'heureDepart': trajet.heure_depart,
+        'dureeEstimee': trajet.duree,
+    }
+
+class CatalogueSQL:
+    """
+    Catalogue des agences interrogé directement en base (tables Agence et Trajet).
+
+    Même interface que gestion_catalogue.SnapshotCatalogue, sans copie du catalogue dans
+    chaque worker : les trajets sont lus par l'index (départ, destination) et les agences
+    proches par l'index des coordonnées, dans un rectangle élargi jusqu'à avoir assez de résultats
+    (nombre de lignes lues plafonné par LIMIT, colonnes du résumé seulement).
+    """
+
+    RAYON_INITIAL_KM = 50.0
+    RAYON_MAX_KM = 20038.0 # Demi-circonférence terrestre : au-delà, tout le globe est couvert
+    MARGE_CANDIDATS = 20 # Candidates lues en plus des `offset + limit` demandées (écarts entre distance approchée et exacte)
+    TTL_INDEX = 300.0 # Index en mémoire reconstruits au moins toutes les 5 minutes, et à chaque changement de version
+    TTL_VERSION = 2.0 # Version relue au plus toutes les 2 secondes : un import par un autre worker est vu aussi vite
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._disponible = False
+        self._villes: Optional[IndexVilles] = None
+        self._reseau: Optional[ReseauTrajets] = None
+        self._index_expire_a = 0.0
+        self._version_index: Optional[str] = None # Version du catalogue à partir de laquelle les index ont été construits
+        self._version = ""
+        self._version_expire_a = 0.0
+
+    def _actualiser_index(self):
+        # Noms de villes et horaires seulement : quelques colonnes, pas le catalogue complet.
+        # Reconstruits dès que la version change (import par un autre worker), comme les clés des caches de réponses.
+        version = self.version
+        if self._villes is not None and version == self._version_index and time.monotonic() < self._index_expire_a:
+            return
+        with Session(self.engine) as session:
+            lignes = session.exec(
+                select(
+                    Agence.ville_depart, Trajet.destination, Trajet.agence_nom, Trajet.heure_depart, Trajet.duree,
+                    Trajet.prix_classique, Trajet.prix_vip, Trajet.jours_masque
+                ).join(Agence, Trajet.agence_id == Agence.id).order_by(Trajet.id)
+            ).all()
+            departs = session.exec(select(Agence.ville_depart)).all()
+        self._villes = IndexVilles(list(departs) + [ligne[1] for ligne in lignes])
+        self._reseau = ReseauTrajets(
+            {
+                'depart': depart, 'destination': destination, 'agence': agence, 'heureDepart': heure, 'dureeEstimee': duree,
+                'prix_classique': prix_classique, 'prix_vip': prix_vip, 'masque': masque,
+            }
+            for depart, destination, agence, heure, duree, prix_classique, prix_vip, masque in lignes
+        )
+        self._index_expire_a = time.monotonic() + self.TTL_INDEX
+        self._version_index = version
+
+    @property
+    def villes(self) -> IndexVilles:
+        """Index des noms de villes (départs et destinations)."""
+        self._actualiser_index()
+        return self._villes
+
+    @property
+    def reseau(self) -> ReseauTrajets:
+        """Réseau des trajets compilé pour la recherche d'itinéraires."""
+        self._actualiser_index()
+        return self._reseau
+
+    @property
+    def version(self) -> str:
+        """Version du dernier import (table ImportCatalogue), comme SnapshotCatalogue.version."""
+        if time.monotonic() >= self._version_expire_a:
+            with Session(self.engine) as session:
+                dernier = session.exec(select(ImportCatalogue.id, ImportCatalogue.version).order_by(ImportCatalogue.id.desc()).limit(1)).first()
+            # L'id distingue deux imports successifs d'un même fichier (tables vidées puis remplies entre-temps)
+            self._version = f"{dernier[1]}-{dernier[0]}" if dernier else ""
+            self._version_expire_a = time.monotonic() + self.TTL_VERSION
+        return self._version
+
+    def invalider(self):
+        """À appeler après un import : les index en mémoire seront reconstruits à la prochaine requête."""
+        self._villes = None
+        self._version_expire_a = 0.0
+
+    def __bool__(self) -> bool:
+        if not self._disponible:
+            # Vérifié tant que les tables sont vides (import pas encore fait)
+            with Session(self.engine) as session:
+                self._disponible = session.exec(select(func.count()).select_from(Agence)).one() > 0
+        return self._disponible
+
+    def trajets(self, depart: str, destination: str, date_voyage: Optional[str] = None, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        requete = select(Trajet).where(
+            Trajet.depart_norm == normalize_text(depart),
+            Trajet.destination_norm == normalize_text(destination),
+        )
+        jour_bit = bit_jour(date_voyage)
+        if jour_bit is not None:
+            requete = requete.where(Trajet.jours_masque.op('&')(jour_bit) != 0)
+        requete = requete.order_by(Trajet.id).offset(offset)
+        if limit:
+            requete = requete.limit(limit)
+        with Session(self.engine) as session:
+            return [{**info_trajet_sql(trajet), 'date': date_voyage} for trajet in session.exec(requete)]
+
+    def _agences_proches(self, session: Session, latitude: float, longitude: float, limit: int, rayon_km: Optional[float], offset: int) -> List[Dict[str, Any]]:
+        voulues = offset + limit
+        plafond = voulues + max(self.MARGE_CANDIDATS, voulues // 2)
+        # Distance équirectangulaire au carré (degrés) : même ordre que la distance exacte à l'échelle d'un rectangle
+        facteur_lon = cos(radians(latitude)) ** 2
+        approchee = (Agence.latitude - latitude) * (Agence.latitude - latitude) + (Agence.longitude - longitude) * (Agence.longitude - longitude) * facteur_lon
+        rayon = min(rayon_km, self.RAYON_INITIAL_KM) if rayon_km else self.RAYON_INITIAL_KM
+        while True:
+            lat_min, lat_max, lon_min, lon_max = boite_englobante(latitude, longitude, rayon)
+            requete = select(*COLONNES_RESUME_AGENCE).where(Agence.latitude.between(lat_min, lat_max))
+            if lon_min is not None:
+                # Les `plafond` candidates les plus proches du rectangle, reclassées ensuite par distance exacte
+                requete = requete.where(Agence.longitude.between(lon_min, lon_max)).order_by(approchee, Agence.id).limit(plafond)
+            # Sinon (pôle, antiméridien, rayon de plusieurs milliers de km) : longitudes non comparables, pas de plafond
+            candidates = [
+                (distance_km(latitude, longitude, agence.latitude, agence.longitude), agence.id, agence)
+                for agence in session.exec(requete)
+            ]
+            trouvees = sorted(c for c in candidates if c[0] <= rayon)
+            # On élargit tant qu'il manque des agences, sans dépasser le rayon imposé
+            limite = rayon_km or self.RAYON_MAX_KM
+            if len(trouvees) >= voulues or rayon >= limite:
+                break
+            rayon = min(rayon * 4, limite)
+        return [{**resume_agence_sql(agence), 'distance_km': round(dist, 2)} for dist, _, agence in trouvees[offset:voulues]]
+
+    def agences_proches(self, latitude: float, longitude: float, limit: int, rayon_km: Optional[float] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        with Session(self.engine) as session:
+            return self._agences_proches(session, latitude, longitude, limit, rayon_km, offset)
+
+    def agences_proches_lot(self, latitudes: List[float], longitudes: List[float], limit: int, rayon_km: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        # Une seule session (et connexion) pour tout le lot
+        with Session(self.engine) as session:
+            return [self._agences_proches(session, lat, lon, limit, rayon_km, 0) for lat, lon in zip(latitudes, longitudes)]
+
+    def agence(self, nom_agence: str) -> Optional[Dict[str, Any]]:
+        with Session(self.engine) as session:
+            agence = session.exec(select(Agence).where(Agence.nom_agence == nom_agence)).first()
+        return resume_agence_sql(agence) if agence else None
+
+    def statistiques(self) -> Dict[str, Any]:
+        with Session(self.engine) as session:
+            return {
+                "backend": "sql",
+                "agences": session.exec(select(func.count()).select_from(Agence)).one(),
+                "trajets": session.exec(select(func.count()).select_from(Trajet)).one(),
+            }
+
+if __name__ == "__main__":
+    # Import du catalogue JSON en base : python catalogue_db.py [agences.json]
+    from dotenv import load_dotenv
+    from base_donnees import creer_engine
+    from gestion_catalogue import ErreurCatalogue, lire_agences
+
+    load_dotenv()
+    chemin = sys.argv[1] if len(sys.argv) > 1 else os.getenv("AGENCES_PATH", "agences.json")
+    engine = creer_engine(os.getenv("DATABASE_URL", "sqlite:///./database.db"))
+    SQLModel.metadata.create_all(engine, tables=[Agence.__table__, Trajet.__table__, ImportCatalogue.__table__])
+    try:
+        agences, version, _ = lire_agences(chemin)
+    except ErreurCatalogue as e:
+        sys.exit(f"Erreur: {e}")
+    nombre_agences, nombre_trajets = importer_agences(engine, agences, version)
+    print(f"Catalogue {chemin} (version {version}) importé : {nombre_agences} agences, {nombre_trajets} trajets.")
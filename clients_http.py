@@ -0,0 +1,92 @@
+import asyncio
+import random
+from typing import Dict, Optional
+
+import httpx
+from pydantic import BaseModel
+
+# Statuts pour lesquels une nouvelle tentative a du sens
+STATUTS_REESSAYABLES = {429, 502, 503, 504}
+METHODES_IDEMPOTENTES = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+class ConfigService(BaseModel):
+    """Paramètres d'un service externe : délais (secondes), taille du pool et politique de nouvelles tentatives."""
+    timeout_connexion: float = 5.0
+    timeout_lecture: float = 10.0
+    max_connexions: int = 20
+    max_tentatives: int = 3
+    backoff_initial: float = 0.2
+    backoff_max: float = 2.0
+
+class ClientsHTTP:
+    """
+    Clients HTTP asynchrones (keep-alive, pool de connexions) par service externe.
+
+    Les clients sont créés une fois au démarrage (lifespan) et fermés à l'arrêt.
+    Les requêtes non idempotentes (POST) ne sont rejouées que si elles n'ont pas pu
+    être envoyées (échec de connexion) ou si le service demande explicitement de réessayer (429).
+    """
+
+    def __init__(self, services: Dict[str, ConfigService], transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.services = services
+        self._transport = transport # Permet de brancher un faux serveur en test
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _creer_client(self, config: ConfigService) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(config.timeout_lecture, connect=config.timeout_connexion),
+            limits=httpx.Limits(max_connections=config.max_connexions, max_keepalive_connections=config.max_connexions),
+            transport=self._transport,
+        )
+
+    async def demarrer(self):
+        for nom, config in self.services.items():
+            if nom not in self._clients:
+                self._clients[nom] = self._creer_client(config)
+
+    async def fermer(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def _client(self, service: str) -> httpx.AsyncClient:
+        client = self._clients.get(service)
+        if client is None:
+            # Appel hors lifespan (script, test) : création à la demande
+            client = self._clients[service] = self._creer_client(self.services[service])
+        return client
+
+    def _delai(self, config: ConfigService, tentative: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), config.backoff_max)
+        delai = min(config.backoff_initial * (2 ** tentative), config.backoff_max)
+        return delai * random.uniform(0.5, 1.0) # Jitter pour éviter les rafales synchronisées
+
+    async def requete(self, service: str, methode: str, url: str, **kwargs) -> httpx.Response:
+        """Envoie une requête via le client du service, avec nouvelles tentatives et backoff exponentiel."""
+        config = self.services[service]
+        client = self._client(service)
+        idempotente = methode.upper() in METHODES_IDEMPOTENTES
+        tentative = 0
+        while True:
+            try:
+                response = await client.request(methode, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                # La requête n'est pas partie : on peut toujours réessayer
+                if tentative + 1 >= config.max_tentatives:
+                    raise
+            except httpx.TransportError:
+                if not idempotente or tentative + 1 >= config.max_tentatives:
+                    raise
+            else:
+                reessayable = response.status_code == 429 or (idempotente and response.status_code in STATUTS_REESSAYABLES)
+                if not reessayable or tentative + 1 >= config.max_tentatives:
+                    return response
+                await response.aclose()
+                await asyncio.sleep(self._delai(config, tentative, response))
+                tentative += 1
+                continue
+            await asyncio.sleep(self._delai(config, tentative))
+            tentative += 1
@@ -1,15 +1,20 @@
 import os
 from dotenv import load_dotenv
-from sqlmodel import SQLModel, create_engine, Field, Session, select
+from sqlmodel import SQLModel, Field, Session, select
+from sqlalchemy import Index, UniqueConstraint, inspect, text
 from typing import Optional
 from datetime import datetime, timedelta
+from base_donnees import creer_engine
+from sms_queue import SmsOutbox # noqa: F401 - enregistre la table de la file SMS
+from catalogue_db import Agence, ImportCatalogue, Trajet # noqa: F401 - enregistre les tables du catalogue
+from inventaire import PlacesDepart, Reservation # noqa: F401 - enregistre les tables des places par départ
 
 # Load environment variables
 load_dotenv()
 
 # Database Configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
-engine = create_engine(DATABASE_URL, echo=True)
+engine = creer_engine(DATABASE_URL) # Même profil que l'application (DB_PROFILE, DB_ECHO)
 
 # --- MODELS (Copied from voyage.py for table creation) ---
 class User(SQLModel, table=True, extend_existing=True):
@@ -20,17 +25,29 @@ class User(SQLModel, table=True, extend_existing=True):
     is_active: bool = Field(default=True)
 
 class Ticket(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_ticket_status_created_at", "status", "created_at"),
+        Index("ix_ticket_email_created_at", "email", "created_at"),
+        Index("ix_ticket_phone_created_at", "phone", "created_at"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    notchpay_reference: str = Field(index=True)
+    notchpay_reference: str = Field(index=True, unique=True)
     status: str = Field(default="pending")
     amount: int
     currency: str = "XAF"
     email: str
     phone: str
     description: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class WebhookEvent(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("notchpay_reference", "status"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    notchpay_reference: str = Field(index=True)
+    status: str
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+
 class VehicleLocation(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     vehicle_id: str = Field(index=True, unique=True)
@@ -42,7 +59,26 @@ class VehicleLocation(SQLModel, table=True):
 def create_db_and_tables():
     print("Attempting to create database tables...")
     SQLModel.metadata.create_all(engine)
+    ensure_unique_ticket_reference()
+    ensure_ticket_indexes()
     print("Database tables created (or already exist).")
 
+def ensure_ticket_indexes():
+    # Bases existantes : create_all ne crée pas les index d'une table déjà présente
+    for index in Ticket.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+def ensure_unique_ticket_reference():
+    # Bases créées avant la contrainte d'unicité : l'index sur notchpay_reference n'est pas unique
+    for index in inspect(engine).get_indexes("ticket"):
+        if index["name"] == "ix_ticket_notchpay_reference" and not index["unique"]:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("DROP INDEX ix_ticket_notchpay_reference"))
+                    conn.execute(text("CREATE UNIQUE INDEX ix_ticket_notchpay_reference ON ticket (notchpay_reference)"))
+                print("Index ix_ticket_notchpay_reference rendu unique.")
+            except Exception as e:
+                print(f"Impossible de rendre ix_ticket_notchpay_reference unique (références en double ?): {e}")
+
 if __name__ == "__main__":
     create_db_and_tables()
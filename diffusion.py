@@ -0,0 +1,337 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket
+
+journal = logging.getLogger(__name__)
+
+# Sujets réservés aux messages internes entre workers (inventaire, catalogue...) : jamais remis aux WebSockets
+PREFIXE_CONTROLE = "_"
+
+# Politiques appliquées quand la file d'envoi d'un client lent est pleine
+SUPPRIMER_PLUS_ANCIEN = "drop_oldest"
+DECONNECTER = "disconnect"
+
+class Abonne:
+    """
+    Client WebSocket abonné à un véhicule, avec sa propre file d'envoi bornée.
+    Une tâche dédiée vide la file : un téléphone lent ne retarde que lui-même.
+    """
+
+    def __init__(self, websocket: WebSocket, vehicle_id: str, taille_file: int, politique: str):
+        self.websocket = websocket
+        self.vehicle_id = vehicle_id
+        self.taille_file = taille_file
+        self.politique = politique
+        self.messages_perdus = 0
+        self.ferme = False
+        self._file: deque = deque()
+        self._signal = asyncio.Event()
+        self._tache: Optional[asyncio.Task] = None
+
+    def demarrer(self, sur_fermeture):
+        self._tache = asyncio.create_task(self._boucle_envoi(sur_fermeture))
+
+    def pousser(self, message: str) -> bool:
+        """Ajoute un message à la file sans attendre. Retourne False si le client est (ou devient) déconnecté."""
+        if self.ferme:
+            return False
+        if len(self._file) >= self.taille_file:
+            if self.politique == DECONNECTER:
+                self.fermer(code=1013) # Try Again Later : client trop lent
+                return False
+            self._file.popleft()
+            self.messages_perdus += 1
+        self._file.append(message)
+        self._signal.set()
+        return True
+
+    def fermer(self, code: Optional[int] = None):
+        if self.ferme:
+            return
+        self.ferme = True
+        self._file.clear()
+        self._signal.set()
+        if code is not None:
+            asyncio.create_task(self._fermer_websocket(code))
+
+    async def _fermer_websocket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _boucle_envoi(self, sur_fermeture):
+        try:
+            while not self.ferme:
+                await self._signal.wait()
+                self._signal.clear()
+                while self._file and not self.ferme:
+                    await self.websocket.send_text(self._file.popleft())
+        except Exception:
+            # Connexion rompue pendant l'envoi
+            self.ferme = True
+        finally:
+            sur_fermeture(self)
+
+    async def attendre(self):
+        if self._tache is not None:
+            await asyncio.gather(self._tache, return_exceptions=True)
+
+# Rappel appelé pour chaque message reçu d'un autre worker : (sujet, message JSON)
+Recepteur = Callable[[str, str], None]
+# Rappel d'un sujet de contrôle : message JSON
+EcouteurControle = Callable[[str], None]
+
+class BusDiffusion:
+    """
+    Interface des bus de diffusion entre workers.
+    Un backend transmet chaque message publié localement aux autres processus, qui
+    le remettent à leurs propres abonnés. Un backend Redis (PUBLISH/SUBSCRIBE) n'aurait
+    qu'à implémenter ces trois méthodes.
+    """
+
+    async def demarrer(self, recevoir: Recepteur):
+        pass
+
+    async def arreter(self):
+        pass
+
+    def publier(self, sujet: str, message: str):
+        """Transmet un message aux autres workers, sans attendre."""
+        raise NotImplementedError
+
+class BusMemoire(BusDiffusion):
+    """Mode un seul processus : les abonnés locaux reçoivent déjà tout, rien à transmettre."""
+
+    def publier(self, sujet: str, message: str):
+        pass
+
+class BusSQLite(BusDiffusion):
+    """
+    Bus entre les workers d'une même machine via une table SQLite partagée (journal WAL).
+
+    Les messages publiés sont insérés par lots ; chaque worker lit les nouvelles lignes
+    (curseur sur l'id) à intervalle court et ignore les siennes, si bien que chaque
+    worker voit chaque mise à jour une seule fois. Les lignes anciennes sont purgées.
+    """
+
+    def __init__(self, chemin: str, intervalle: float = 0.05, retention: float = 60.0):
+        self.chemin = chemin
+        self.intervalle = intervalle
+        self.retention = retention
+        self.origine = uuid.uuid4().hex
+        self._sortants: List[Tuple[str, str]] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        self._dernier_id = 0
+        self._derniere_purge = 0.0
+        self._actif = False
+        self._tache: Optional[asyncio.Task] = None
+
+    def _ouvrir(self):
+        self._conn = sqlite3.connect(self.chemin, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bus_messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, origine TEXT NOT NULL, sujet TEXT NOT NULL, "
+            "message TEXT NOT NULL, cree_a REAL NOT NULL)"
+        )
+        # On ne rejoue pas l'historique : lecture à partir des messages à venir
+        self._dernier_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus_messages").fetchone()[0]
+
+    def _cycle(self, sortants: List[Tuple[str, str]]) -> List[Tuple[int, str, str, str]]:
+        maintenant = time.time()
+        if sortants:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO bus_messages (origine, sujet, message, cree_a) VALUES (?, ?, ?, ?)",
+                    [(self.origine, sujet, message, maintenant) for sujet, message in sortants]
+                )
+        if maintenant - self._derniere_purge > self.retention:
+            self._conn.execute("DELETE FROM bus_messages WHERE cree_a < ?", (maintenant - self.retention,))
+            self._derniere_purge = maintenant
+        return self._conn.execute(
+            "SELECT id, origine, sujet, message FROM bus_messages WHERE id > ? ORDER BY id LIMIT 5000",
+            (self._dernier_id,)
+        ).fetchall()
+
+    async def demarrer(self, recevoir: Recepteur):
+        await asyncio.to_thread(self._ouvrir)
+        self._actif = True
+        self._tache = asyncio.create_task(self._boucle(recevoir))
+
+    async def arreter(self):
+        # Pas d'annulation : le cycle en cours se termine (la connexion n'est jamais partagée entre deux threads)
+        self._actif = False
+        if self._tache is not None:
+            await asyncio.gather(self._tache, return_exceptions=True)
+            self._tache = None
+        if self._sortants and self._conn is not None:
+            sortants, self._sortants = self._sortants, []
+            await asyncio.to_thread(self._cycle, sortants)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def publier(self, sujet: str, message: str):
+        self._sortants.append((sujet, message))
+
+    async def _boucle(self, recevoir: Recepteur):
+        while self._actif:
+            sortants, self._sortants = self._sortants, []
+            try:
+                lignes = await asyncio.to_thread(self._cycle, sortants)
+            except sqlite3.Error as e:
+                journal.error("Erreur du bus de diffusion SQLite : %s", e)
+                self._sortants[:0] = sortants # Nouvelle tentative au prochain cycle
+                lignes = []
+            for id_message, origine, sujet, message in lignes:
+                self._dernier_id = id_message
+                if origine != self.origine:
+                    try:
+                        recevoir(sujet, message)
+                    except Exception:
+                        # Un message invalide ne doit pas arrêter le bus de ce worker
+                        journal.exception("Erreur lors du traitement d'un message du bus (sujet %s)", sujet)
+            await asyncio.sleep(self.intervalle)
+
+def creer_bus(backend: str, chemin_sqlite: str) -> BusDiffusion:
+    """Crée le bus de diffusion configuré : 'memory' (un seul processus) ou 'sqlite' (plusieurs workers)."""
+    if backend == "sqlite":
+        return BusSQLite(chemin_sqlite)
+    if backend == "memory":
+        return BusMemoire()
+    raise ValueError(f"Backend de diffusion inconnu : {backend}")
+
+class ConnectionManager:
+    """
+    Hub publish/subscribe des positions : un sujet par véhicule, plusieurs abonnés par sujet.
+    Chaque message est sérialisé une seule fois puis déposé dans la file de chaque abonné
+    intéressé ; le coût d'une diffusion dépend du nombre d'abonnés du véhicule, pas du
+    nombre total de connexions. Le bus transmet les messages aux autres workers, qui
+    les remettent à leurs abonnés locaux.
+
+    Les sujets commençant par PREFIXE_CONTROLE transportent les messages internes entre
+    workers : ils ne vont qu'aux écouteurs de contrôle, jamais aux abonnés WebSocket ni
+    aux écouteurs de positions.
+    """
+
+    def __init__(self, taille_file: int = 32, politique: str = SUPPRIMER_PLUS_ANCIEN, bus: Optional[BusDiffusion] = None):
+        self.taille_file = taille_file
+        self.politique = politique
+        self.bus = bus or BusMemoire()
+        self.sujets: Dict[str, Set[Abonne]] = {}
+        self.ecouteurs_distants: List[Recepteur] = [] # Appelés pour chaque position venant d'un autre worker
+        self.ecouteurs_controle: Dict[str, List[EcouteurControle]] = {}
+        self.stats = {
+            "messages_publies": 0,
+            "messages_recus_bus": 0,
+            "messages_livres": 0,
+            "messages_perdus": 0,
+            "clients_lents_deconnectes": 0,
+        }
+
+    async def demarrer(self):
+        await self.bus.demarrer(self._recevoir)
+
+    async def arreter(self):
+        await self.bus.arreter()
+
+    def ecouter_controle(self, sujet: str, ecouteur: EcouteurControle):
+        """Abonne `ecouteur` aux messages de contrôle `sujet` publiés par les autres workers."""
+        if not sujet.startswith(PREFIXE_CONTROLE):
+            raise ValueError(f"Sujet de contrôle sans le préfixe {PREFIXE_CONTROLE!r} : {sujet}")
+        self.ecouteurs_controle.setdefault(sujet, []).append(ecouteur)
+
+    def publier_controle(self, sujet: str, message: str):
+        """Transmet un message de contrôle aux autres workers (pas aux abonnés WebSocket)."""
+        if not sujet.startswith(PREFIXE_CONTROLE):
+            raise ValueError(f"Sujet de contrôle sans le préfixe {PREFIXE_CONTROLE!r} : {sujet}")
+        self.bus.publier(sujet, message)
+
+    def _recevoir(self, sujet: str, texte: str):
+        self.stats["messages_recus_bus"] += 1
+        if sujet.startswith(PREFIXE_CONTROLE):
+            for ecouteur in self.ecouteurs_controle.get(sujet, ()):
+                self._appeler(ecouteur, sujet, texte)
+            return
+        self._diffuser_local(sujet, texte)
+        for ecouteur in self.ecouteurs_distants:
+            self._appeler(ecouteur, sujet, sujet, texte)
+
+    def _appeler(self, ecouteur: Callable, sujet: str, *arguments):
+        # Une erreur d'un écouteur n'empêche ni les autres écouteurs ni les messages suivants
+        try:
+            ecouteur(*arguments)
+        except Exception:
+            journal.exception("Erreur d'un écouteur du bus de diffusion (sujet %s)", sujet)
+
+    @property
+    def nombre_connexions(self) -> int:
+        return sum(len(abonnes) for abonnes in self.sujets.values())
+
+    async def connect(self, websocket: WebSocket, vehicle_id: str) -> Abonne:
+        await websocket.accept()
+        abonne = Abonne(websocket, vehicle_id, self.taille_file, self.politique)
+        self.sujets.setdefault(vehicle_id, set()).add(abonne)
+        abonne.demarrer(self.disconnect)
+        return abonne
+
+    def disconnect(self, abonne: Abonne):
+        abonnes = self.sujets.get(abonne.vehicle_id)
+        if abonnes is not None and abonne in abonnes:
+            abonnes.discard(abonne)
+            self.stats["messages_perdus"] += abonne.messages_perdus
+            if not abonnes:
+                del self.sujets[abonne.vehicle_id]
+        abonne.fermer()
+
+    async def send_personal_message(self, message: str, websocket: WebSocket):
+        await websocket.send_text(message)
+
+    def publier(self, vehicle_id: str, message: Union[str, Dict[str, Any]]) -> int:
+        """
+        Diffuse un message aux abonnés du véhicule, dans ce worker et dans les autres (via le bus).
+        Retourne le nombre d'abonnés locaux atteints.
+        """
+        if vehicle_id.startswith(PREFIXE_CONTROLE):
+            raise ValueError(f"Identifiant de véhicule réservé : {vehicle_id}")
+        texte = message if isinstance(message, str) else json.dumps(message)
+        self.stats["messages_publies"] += 1
+        self.bus.publier(vehicle_id, texte)
+        return self._diffuser_local(vehicle_id, texte)
+
+    def _diffuser_local(self, vehicle_id: str, texte: str) -> int:
+        abonnes = self.sujets.get(vehicle_id)
+        if not abonnes:
+            return 0
+        livres = 0
+        for abonne in list(abonnes):
+            if abonne.pousser(texte):
+                livres += 1
+            elif abonne.politique == DECONNECTER and abonne.ferme:
+                self.stats["clients_lents_deconnectes"] += 1
+                self.disconnect(abonne)
+        self.stats["messages_livres"] += livres
+        return livres
+
+    def broadcast(self, message: Union[str, Dict[str, Any]]) -> int:
+        """Diffuse un message à tous les abonnés locaux, tous véhicules confondus (annonces générales)."""
+        texte = message if isinstance(message, str) else json.dumps(message)
+        return sum(self._diffuser_local(vehicle_id, texte) for vehicle_id in list(self.sujets))
+
+    def statistiques(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["connexions"] = self.nombre_connexions
+        stats["sujets"] = len(self.sujets)
+        stats["bus"] = type(self.bus).__name__
+        stats["messages_perdus"] += sum(a.messages_perdus for abonnes in self.sujets.values() for a in abonnes)
+        return stats
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+journal = logging.getLogger(__name__)
+
+Cle = Tuple[str, str]
+
+class CacheDirections:
+    """
+    Cache à deux niveaux des itinéraires Google Maps déjà traités (distance, durée, étapes, polyligne).
+
+    - niveau 1 : dictionnaire LRU en mémoire, propre au processus ;
+    - niveau 2 : base SQLite partagée par les workers gunicorn.
+
+    Les deux niveaux appliquent la même durée de vie (TTL). Les requêtes simultanées
+    manquant la même clé sont regroupées en un seul appel à Google. Les accès SQLite
+    sont exécutés dans un thread pour ne pas bloquer la boucle d'événements ; le fichier
+    n'est créé qu'au premier accès.
+    """
+
+    def __init__(self, chemin: Optional[str], ttl_secondes: float, max_memoire: int = 1024, max_disque: int = 50000):
+        self.chemin = chemin
+        self.ttl = ttl_secondes
+        self.max_memoire = max_memoire
+        self.max_disque = max_disque
+        self._memoire: "OrderedDict[Cle, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._verrou = threading.Lock()
+        self._en_cours: Dict[Cle, "asyncio.Future[Optional[Dict[str, Any]]]"] = {}
+        self.stats = {
+            "hits_memoire": 0,
+            "hits_disque": 0,
+            "misses": 0,
+            "appels_regroupes": 0,
+            "appels_google": 0,
+            "erreurs_disque": 0,
+            "latence_google_totale_s": 0.0,
+        }
+        self._disque_pret = False # Fichier SQLite créé à la première lecture ou écriture, pas à l'import
+        self._verrou_disque = threading.Lock()
+
+    def _disque_disponible(self) -> bool:
+        # Appelé dans un thread (to_thread) : création de la table une seule fois, même en concurrence
+        if not self.chemin:
+            return False
+        if self._disque_pret:
+            return True
+        with self._verrou_disque:
+            if not self._disque_pret and self.chemin:
+                try:
+                    with self._connexion() as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.execute(
+                            "CREATE TABLE IF NOT EXISTS directions_cache ("
+                            "cle TEXT PRIMARY KEY, valeur TEXT NOT NULL, expire_a REAL NOT NULL, dernier_acces REAL NOT NULL)"
+                        )
+                        conn.execute("CREATE INDEX IF NOT EXISTS ix_directions_cache_acces ON directions_cache (dernier_acces)")
+                    self._disque_pret = True
+                except sqlite3.Error as e:
+                    journal.warning("Cache disque des itinéraires désactivé (%s)", e)
+                    self.chemin = None
+        return self._disque_pret
+
+    def _connexion(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.chemin, timeout=5)
+
+    @staticmethod
+    def _cle_texte(cle: Cle) -> str:
+        return f"{cle[0]}|{cle[1]}"
+
+    # --- Niveau 1 : mémoire ---
+
+    def _lire_memoire(self, cle: Cle, maintenant: float) -> Optional[Dict[str, Any]]:
+        with self._verrou:
+            entree = self._memoire.get(cle)
+            if entree is None:
+                return None
+            expire_a, valeur = entree
+            if expire_a <= maintenant:
+                del self._memoire[cle]
+                return None
+            self._memoire.move_to_end(cle)
+            return valeur
+
+    def _ecrire_memoire(self, cle: Cle, valeur: Dict[str, Any], expire_a: float):
+        with self._verrou:
+            self._memoire[cle] = (expire_a, valeur)
+            self._memoire.move_to_end(cle)
+            while len(self._memoire) > self.max_memoire:
+                self._memoire.popitem(last=False)
+
+    # --- Niveau 2 : SQLite partagé ---
+
+    def _lire_disque(self, cle: Cle, maintenant: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if not self._disque_disponible():
+            return None
+        try:
+            with self._connexion() as conn:
+                ligne = conn.execute(
+                    "SELECT valeur, expire_a FROM directions_cache WHERE cle = ? AND expire_a > ?",
+                    (self._cle_texte(cle), maintenant)
+                ).fetchone()
+                if ligne is None:
+                    return None
+                conn.execute("UPDATE directions_cache SET dernier_acces = ? WHERE cle = ?", (maintenant, self._cle_texte(cle)))
+                return ligne[1], json.loads(ligne[0])
+        except sqlite3.Error:
+            self.stats["erreurs_disque"] += 1
+            return None
+
+    def _ecrire_disque(self, cle: Cle, valeur: Dict[str, Any], expire_a: float, maintenant: float):
+        if not self._disque_disponible():
+            return
+        try:
+            with self._connexion() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO directions_cache (cle, valeur, expire_a, dernier_acces) VALUES (?, ?, ?, ?)",
+                    (self._cle_texte(cle), json.dumps(valeur), expire_a, maintenant)
+                )
+                # Purge des entrées expirées puis éviction LRU au-delà de la taille maximale
+                conn.execute("DELETE FROM directions_cache WHERE expire_a <= ?", (maintenant,))
+                conn.execute(
+                    "DELETE FROM directions_cache WHERE cle IN ("
+                    "SELECT cle FROM directions_cache ORDER BY dernier_acces DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disque,)
+                )
+        except sqlite3.Error:
+            self.stats["erreurs_disque"] += 1
+
+    # --- API publique ---
+
+    async def obtenir(self, cle: Cle, calculer: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """Retourne la valeur en cache pour la clé, ou la calcule (une seule fois pour les appels simultanés)."""
+        maintenant = time.time()
+        valeur = self._lire_memoire(cle, maintenant)
+        if valeur is not None:
+            self.stats["hits_memoire"] += 1
+            return valeur
+
+        attente = self._en_cours.get(cle)
+        if attente is not None:
+            # Une autre requête interroge déjà Google pour cette clé : on partage son résultat
+            self.stats["appels_regroupes"] += 1
+            return await asyncio.shield(attente)
+
+        attente = self._en_cours[cle] = asyncio.get_running_loop().create_future()
+        try:
+            valeur = await self._obtenir_hors_memoire(cle, calculer)
+            attente.set_result(valeur)
+            return valeur
+        except asyncio.CancelledError:
+            attente.cancel()
+            raise
+        except Exception as e:
+            attente.set_exception(e)
+            # Évite l'avertissement "exception never retrieved" si personne n'attendait
+            attente.exception()
+            raise
+        finally:
+            del self._en_cours[cle]
+
+    async def _obtenir_hors_memoire(self, cle: Cle, calculer: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        entree_disque = await asyncio.to_thread(self._lire_disque, cle, time.time())
+        if entree_disque is not None:
+            expire_a, valeur = entree_disque
+            self._ecrire_memoire(cle, valeur, expire_a)
+            self.stats["hits_disque"] += 1
+            return valeur
+
+        self.stats["misses"] += 1
+        self.stats["appels_google"] += 1
+        debut = time.perf_counter()
+        valeur = await calculer()
+        self.stats["latence_google_totale_s"] += time.perf_counter() - debut
+        # Les échecs (None) ne sont pas mis en cache
+        if valeur is not None:
+            maintenant = time.time()
+            expire_a = maintenant + self.ttl
+            self._ecrire_memoire(cle, valeur, expire_a)
+            await asyncio.to_thread(self._ecrire_disque, cle, valeur, expire_a, maintenant)
+        return valeur
+
+    def statistiques(self) -> Dict[str, Any]:
+        """Compteurs du cache, avec le taux de hits et la latence moyenne des appels Google."""
+        stats = dict(self.stats)
+        hits = stats["hits_memoire"] + stats["hits_disque"]
+        total = hits + stats["misses"] + stats["appels_regroupes"]
+        stats["taux_hits"] = round(hits / total, 4) if total else 0.0
+        stats["appels_google_evites"] = total - stats["appels_google"]
+        stats["latence_google_moyenne_ms"] = round(1000 * stats["latence_google_totale_s"] / stats["appels_google"], 2) if stats["appels_google"] else 0.0
+        stats["entrees_memoire"] = len(self._memoire)
+        return stats
@@ -0,0 +1,177 @@
+from collections import deque
+from datetime import datetime, timedelta
+from math import cos, radians, sqrt
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+KM_PAR_DEGRE_LAT = 110.574
+KM_PAR_DEGRE_LON_EQUATEUR = 111.320
+
+class GeometrieRoute:
+    """
+    Polyligne d'un trajet préparée pour la projection des positions GPS.
+
+    Les points sont projetés une fois en coordonnées planes locales (km), avec la
+    distance cumulée le long de la route et une grille qui associe chaque cellule
+    aux segments qui la traversent.
+    """
+
+    TAILLE_CELLULE_KM = 2.0
+    ANNEAUX_MAX = 5
+
+    def __init__(self, coords: Sequence[Sequence[float]]):
+        if len(coords) < 2:
+            raise ValueError("Une route doit contenir au moins deux points.")
+        self.coords = tuple((float(point[0]), float(point[1])) for point in coords) # Pour reconnaître une route modifiée
+        self.lat0 = sum(point[0] for point in coords) / len(coords)
+        self._kx = KM_PAR_DEGRE_LON_EQUATEUR * cos(radians(self.lat0))
+        self.xs = [point[1] * self._kx for point in coords]
+        self.ys = [point[0] * KM_PAR_DEGRE_LAT for point in coords]
+        self.cumul = [0.0]
+        for i in range(1, len(coords)):
+            self.cumul.append(self.cumul[-1] + sqrt((self.xs[i] - self.xs[i - 1]) ** 2 + (self.ys[i] - self.ys[i - 1]) ** 2))
+        self.longueur_km = self.cumul[-1]
+        self._grille: Dict[Tuple[int, int], List[int]] = {}
+        for i in range(len(coords) - 1):
+            cx0, cx1 = sorted((self._cellule(self.xs[i]), self._cellule(self.xs[i + 1])))
+            cy0, cy1 = sorted((self._cellule(self.ys[i]), self._cellule(self.ys[i + 1])))
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self._grille.setdefault((cx, cy), []).append(i)
+
+    @property
+    def nombre_segments(self) -> int:
+        return len(self.xs) - 1
+
+    def _cellule(self, valeur_km: float) -> int:
+        return int(valeur_km // self.TAILLE_CELLULE_KM)
+
+    def _projeter_segment(self, i: int, x: float, y: float) -> Tuple[float, float]:
+        """(distance au segment en km, progression le long de la route en km) pour le segment i."""
+        ax, ay, bx, by = self.xs[i], self.ys[i], self.xs[i + 1], self.ys[i + 1]
+        dx, dy = bx - ax, by - ay
+        longueur2 = dx * dx + dy * dy
+        t = 0.0 if longueur2 == 0 else max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / longueur2))
+        px, py = ax + t * dx, ay + t * dy
+        return sqrt((x - px) ** 2 + (y - py) ** 2), self.cumul[i] + t * (self.cumul[i + 1] - self.cumul[i])
+
+    def _meilleur(self, segments, x: float, y: float) -> Optional[Tuple[int, float, float]]:
+        meilleur = None
+        for i in segments:
+            ecart, progression = self._projeter_segment(i, x, y)
+            if meilleur is None or ecart < meilleur[1]:
+                meilleur = (i, ecart, progression)
+        return meilleur
+
+    def projeter(self, latitude: float, longitude: float, segment_precedent: Optional[int] = None, tolerance_km: float = 0.5) -> Tuple[int, float, float]:
+        """
+        Projette une position sur la route : (segment, écart à la route en km, progression en km).
+        On cherche d'abord autour du segment précédent (cas courant), puis dans la grille,
+        et seulement en dernier recours sur toute la route.
+        """
+        x, y = longitude * self._kx, latitude * KM_PAR_DEGRE_LAT
+        if segment_precedent is not None:
+            fenetre = range(max(0, segment_precedent - 2), min(self.nombre_segments, segment_precedent + 25))
+            resultat = self._meilleur(fenetre, x, y)
+            if resultat is not None and resultat[1] <= tolerance_km:
+                return resultat
+        # Anneaux de cellules de plus en plus larges : le résultat est exact dès que le meilleur
+        # segment trouvé est plus proche que le rayon déjà couvert
+        cx, cy = self._cellule(x), self._cellule(y)
+        candidats = set()
+        for rayon in range(1, self.ANNEAUX_MAX + 1):
+            for ddx in range(-rayon, rayon + 1):
+                for ddy in range(-rayon, rayon + 1):
+                    if rayon == 1 or max(abs(ddx), abs(ddy)) == rayon:
+                        candidats.update(self._grille.get((cx + ddx, cy + ddy), ()))
+            resultat = self._meilleur(candidats, x, y)
+            if resultat is not None and resultat[1] <= rayon * self.TAILLE_CELLULE_KM:
+                return resultat
+        # Véhicule très loin de la route : parcours complet
+        return self._meilleur(range(self.nombre_segments), x, y)
+
+class SuiviVehicule:
+    """État incrémental d'un véhicule affecté à une route."""
+
+    def __init__(self, route_id: str, geometrie: GeometrieRoute, vitesse_nominale_kmh: float, fenetre: int):
+        self.route_id = route_id
+        self.geometrie = geometrie
+        self.vitesse_nominale_kmh = vitesse_nominale_kmh
+        self.segment: Optional[int] = None
+        self.observations: Deque[Tuple[datetime, float]] = deque(maxlen=fenetre)
+        self.derniere_eta: Optional[Dict[str, Any]] = None
+
+class MoteurETA:
+    """
+    Estimation de l'heure d'arrivée des véhicules en circulation.
+
+    À chaque ping, la position est projetée sur la route du véhicule en partant du
+    segment précédent (pas de recalcul de toute la route). La vitesse est la moyenne
+    glissante de la progression observée sur les derniers pings ; tant qu'il n'y a
+    pas assez d'observations, on utilise la vitesse nominale (longueur / durée du catalogue).
+    """
+
+    VITESSE_MIN_KMH = 5.0
+    VITESSE_MAX_KMH = 110.0
+    DUREE_OBSERVATION_MIN_S = 20.0
+
+    def __init__(self, fenetre: int = 10):
+        self.fenetre = fenetre
+        self.geometries: Dict[str, GeometrieRoute] = {}
+        self.vehicules: Dict[str, SuiviVehicule] = {}
+
+    def geometrie(self, route_id: str, coords: Sequence[Sequence[float]]) -> GeometrieRoute:
+        """
+        Géométrie préparée d'une route, partagée par tous les véhicules qui la suivent.
+        Reconstruite si les points ont changé (polyligne Google rafraîchie, catalogue rechargé) :
+        les véhicules déjà affectés gardent l'ancienne.
+        """
+        geometrie = self.geometries.get(route_id)
+        if geometrie is None or geometrie.coords != tuple((float(point[0]), float(point[1])) for point in coords):
+            geometrie = self.geometries[route_id] = GeometrieRoute(coords)
+        return geometrie
+
+    def affecter(self, vehicle_id: str, route_id: str, coords: Sequence[Sequence[float]], duree_minutes: Optional[int] = None) -> SuiviVehicule:
+        geometrie = self.geometrie(route_id, coords)
+        vitesse = geometrie.longueur_km / (duree_minutes / 60) if duree_minutes else 60.0
+        suivi = SuiviVehicule(route_id, geometrie, self._borner(vitesse), self.fenetre)
+        self.vehicules[vehicle_id] = suivi
+        return suivi
+
+    def retirer(self, vehicle_id: str):
+        self.vehicules.pop(vehicle_id, None)
+
+    def _borner(self, vitesse_kmh: float) -> float:
+        return max(self.VITESSE_MIN_KMH, min(self.VITESSE_MAX_KMH, vitesse_kmh))
+
+    def mettre_a_jour(self, vehicle_id: str, latitude: float, longitude: float, timestamp: datetime) -> Optional[Dict[str, Any]]:
+        """Met à jour l'ETA d'un véhicule à partir d'un nouveau ping. None si le véhicule n'a pas de route."""
+        suivi = self.vehicules.get(vehicle_id)
+        if suivi is None:
+            return None
+        segment, ecart_km, progression_km = suivi.geometrie.projeter(latitude, longitude, suivi.segment)
+        suivi.segment = segment
+        if suivi.observations and timestamp <= suivi.observations[-1][0]:
+            return suivi.derniere_eta # Ping en retard : il ne fait pas progresser l'estimation
+        suivi.observations.append((timestamp, progression_km))
+
+        vitesse_kmh = suivi.vitesse_nominale_kmh
+        source = "nominale"
+        debut, fin = suivi.observations[0], suivi.observations[-1]
+        duree_s = (fin[0] - debut[0]).total_seconds()
+        if duree_s >= self.DUREE_OBSERVATION_MIN_S and fin[1] > debut[1]:
+            vitesse_kmh = self._borner((fin[1] - debut[1]) / (duree_s / 3600))
+            source = "observee"
+
+        restant_km = max(0.0, suivi.geometrie.longueur_km - progression_km)
+        minutes = restant_km / vitesse_kmh * 60
+        suivi.derniere_eta = {
+            "route": suivi.route_id,
+            "distance_restante_km": round(restant_km, 2),
+            "progression": round(progression_km / suivi.geometrie.longueur_km, 4) if suivi.geometrie.longueur_km else 1.0,
+            "ecart_route_km": round(ecart_km, 3),
+            "vitesse_kmh": round(vitesse_kmh, 1),
+            "source_vitesse": source,
+            "eta_minutes": round(minutes, 1),
+            "arrivee_estimee": str(timestamp + timedelta(minutes=minutes)),
+        }
+        return suivi.derniere_eta
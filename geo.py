@@ -0,0 +1,154 @@
+import heapq
+from math import asin, cos, degrees, pi, radians, sin, sqrt
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+R_TERRE_KM = 6371  # Rayon de la Terre en km
+
+def vers_sphere(lat: float, lon: float) -> Tuple[float, float, float]:
+    """Projette un point GPS sur la sphère unité (coordonnées cartésiennes x, y, z)."""
+    phi, lam = radians(lat), radians(lon)
+    return (cos(phi) * cos(lam), cos(phi) * sin(lam), sin(phi))
+
+def corde_vers_km(corde: float) -> float:
+    """Convertit une corde de la sphère unité en distance orthodromique (km)."""
+    return 2 * R_TERRE_KM * asin(min(1.0, corde / 2))
+
+def km_vers_corde(distance_km: float) -> float:
+    """Convertit une distance orthodromique (km) en corde de la sphère unité."""
+    angle = min(distance_km / R_TERRE_KM, 3.141592653589793)
+    return 2 * sin(angle / 2)
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance orthodromique (km) entre deux points GPS."""
+    a, b = vers_sphere(lat1, lon1), vers_sphere(lat2, lon2)
+    return corde_vers_km(sqrt(sum((u - v) ** 2 for u, v in zip(a, b))))
+
+def boite_englobante(lat: float, lon: float, rayon_km: float) -> Tuple[float, float, Optional[float], Optional[float]]:
+    """
+    Rectangle (lat_min, lat_max, lon_min, lon_max) contenant tous les points à moins de `rayon_km`,
+    pour filtrer par index B-tree avant le calcul exact. lon_min/lon_max valent None quand le
+    cercle touche un pôle ou l'antiméridien (pas de filtre sur la longitude).
+    """
+    angle = rayon_km / R_TERRE_KM
+    dlat = degrees(angle)
+    lat_min, lat_max = lat - dlat, lat + dlat
+    if angle >= pi / 2 or lat_min <= -90 or lat_max >= 90 or sin(angle) >= cos(radians(lat)):
+        return lat_min, lat_max, None, None
+    dlon = degrees(asin(sin(angle) / cos(radians(lat))))
+    if lon - dlon < -180 or lon + dlon > 180:
+        return lat_min, lat_max, None, None
+    return lat_min, lat_max, lon - dlon, lon + dlon
+
+class IndexSpatial:
+    """
+    Arbre k-d sur les points projetés sur la sphère unité.
+    La corde étant monotone avec la distance Haversine, les k plus proches
+    voisins et les requêtes par rayon se font sans parcourir tous les points.
+    """
+
+    def __init__(self, points: List[Tuple[float, float]]):
+        self._coords = [vers_sphere(lat, lon) for lat, lon in points]
+        self._racine = self._construire(list(range(len(self._coords))), 0)
+
+    def __len__(self) -> int:
+        return len(self._coords)
+
+    def _construire(self, indices: List[int], profondeur: int):
+        if not indices:
+            return None
+        axe = profondeur % 3
+        indices.sort(key=lambda i: self._coords[i][axe])
+        milieu = len(indices) // 2
+        # Noeud : (indice du point, axe de coupe, sous-arbre gauche, sous-arbre droit)
+        return (
+            indices[milieu],
+            axe,
+            self._construire(indices[:milieu], profondeur + 1),
+            self._construire(indices[milieu + 1:], profondeur + 1),
+        )
+
+    def plus_proches(self, latitude: float, longitude: float, k: Optional[int] = None, rayon_km: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Retourne les (indice, distance_km) des k points les plus proches, triés par distance.
+        k=None : pas de limite de nombre ; rayon_km=None : pas de limite de distance.
+        """
+        if k is not None and k <= 0:
+            return []
+        cible = vers_sphere(latitude, longitude)
+        rayon2 = km_vers_corde(rayon_km) ** 2 if rayon_km is not None else float('inf')
+        # Tas max (distances négatives) des meilleurs candidats
+        meilleurs: List[Tuple[float, int]] = []
+
+        def borne() -> float:
+            if k is not None and len(meilleurs) == k:
+                return min(rayon2, -meilleurs[0][0])
+            return rayon2
+
+        def visiter(noeud):
+            if noeud is None:
+                return
+            indice, axe, gauche, droite = noeud
+            point = self._coords[indice]
+            d2 = (point[0] - cible[0]) ** 2 + (point[1] - cible[1]) ** 2 + (point[2] - cible[2]) ** 2
+            if d2 <= borne():
+                heapq.heappush(meilleurs, (-d2, indice))
+                if k is not None and len(meilleurs) > k:
+                    heapq.heappop(meilleurs)
+            ecart = cible[axe] - point[axe]
+            proche, loin = (gauche, droite) if ecart < 0 else (droite, gauche)
+            visiter(proche)
+            if ecart * ecart <= borne():
+                visiter(loin)
+
+        visiter(self._racine)
+        return [(indice, corde_vers_km(sqrt(-moins_d2))) for moins_d2, indice in sorted(meilleurs, reverse=True)]
+
+class NoyauHaversine:
+    """
+    Coordonnées stockées en tableaux float64 contigus (radians et cosinus de la latitude
+    précalculés) pour calculer en un seul appel les distances de nombreux points de requête.
+    """
+
+    # Nombre de points de requête traités par bloc, pour borner la taille des matrices intermédiaires
+    TAILLE_BLOC = 256
+
+    def __init__(self, points: List[Tuple[float, float]]):
+        coords = np.array(points, dtype=np.float64).reshape(-1, 2)
+        self.lat_rad = np.ascontiguousarray(np.radians(coords[:, 0]))
+        self.lon_rad = np.ascontiguousarray(np.radians(coords[:, 1]))
+        self.cos_lat = np.cos(self.lat_rad)
+
+    def __len__(self) -> int:
+        return self.lat_rad.shape[0]
+
+    def distances(self, latitudes, longitudes) -> np.ndarray:
+        """Matrice (requêtes x points) des distances en km, même formule que calculer_distance."""
+        q_lat = np.radians(np.asarray(latitudes, dtype=np.float64))[:, None]
+        q_lon = np.radians(np.asarray(longitudes, dtype=np.float64))[:, None]
+        d_lat = self.lat_rad[None, :] - q_lat
+        d_lon = self.lon_rad[None, :] - q_lon
+        a = np.sin(d_lat / 2) ** 2 + np.cos(q_lat) * self.cos_lat[None, :] * np.sin(d_lon / 2) ** 2
+        return R_TERRE_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    def plus_proches(self, latitudes, longitudes, k: int, rayon_km: Optional[float] = None) -> List[List[Tuple[int, float]]]:
+        """Pour chaque point de requête, les (indice, distance_km) des k points les plus proches, triés."""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        n = len(self)
+        k = min(k, n)
+        resultats: List[List[Tuple[int, float]]] = []
+        if k <= 0:
+            return [[] for _ in range(latitudes.shape[0])]
+        for debut in range(0, latitudes.shape[0], self.TAILLE_BLOC):
+            bloc = self.distances(latitudes[debut:debut + self.TAILLE_BLOC], longitudes[debut:debut + self.TAILLE_BLOC])
+            # Sélection partielle O(n) puis tri des k candidats seulement
+            candidats = np.argpartition(bloc, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (bloc.shape[0], 1))
+            dist_candidats = np.take_along_axis(bloc, candidats, axis=1)
+            ordre = np.argsort(dist_candidats, axis=1, kind='stable')
+            candidats = np.take_along_axis(candidats, ordre, axis=1)
+            dist_candidats = np.take_along_axis(dist_candidats, ordre, axis=1)
+            for indices, dists in zip(candidats.tolist(), dist_candidats.tolist()):
+                resultats.append([(i, d) for i, d in zip(indices, dists) if rayon_km is None or d <= rayon_km])
+        return resultats
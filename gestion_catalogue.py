@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from catalogue import bit_jour, construire_index_trajets, masque_jours, normalize_text, resume_agence
+from geo import IndexSpatial, NoyauHaversine
+from planificateur import ReseauTrajets
+from recherche_villes import IndexVilles
+
+journal = logging.getLogger(__name__)
+
+class ErreurCatalogue(Exception):
+    """Fichier du catalogue illisible ou invalide : la version en service est conservée."""
+
+def valider_agences(data: Any) -> List[Dict[str, Any]]:
+    """Vérifie la structure du catalogue avant de le mettre en service. Lève ErreurCatalogue sinon."""
+    if not isinstance(data, list):
+        raise ErreurCatalogue("Le catalogue doit être une liste d'agences.")
+    for i, agence in enumerate(data):
+        if not isinstance(agence, dict):
+            raise ErreurCatalogue(f"Agence n°{i} : un objet est attendu.")
+        nom = agence.get('nom_agence')
+        if not nom or not agence.get('ville_depart'):
+            raise ErreurCatalogue(f"Agence n°{i} : 'nom_agence' et 'ville_depart' sont obligatoires.")
+        lat, lon = agence.get('latitude'), agence.get('longitude')
+        if not isinstance(lat, (int, float)) or not isinstance(lon, (int, float)) or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ErreurCatalogue(f"Agence '{nom}' : coordonnées invalides.")
+        trajets = agence.get('trajets', [])
+        if not isinstance(trajets, list):
+            raise ErreurCatalogue(f"Agence '{nom}' : 'trajets' doit être une liste.")
+        for trajet in trajets:
+            if not isinstance(trajet, dict) or not trajet.get('destination'):
+                raise ErreurCatalogue(f"Agence '{nom}' : chaque trajet doit avoir une 'destination'.")
+            for prix in ('prix_vip', 'prix_classique'):
+                if trajet.get(prix) is not None and not isinstance(trajet[prix], (int, float)):
+                    raise ErreurCatalogue(f"Agence '{nom}', trajet vers {trajet['destination']} : '{prix}' doit être un nombre.")
+    return data
+
+class SnapshotCatalogue:
+    """
+    Version du catalogue avec toutes ses structures dérivées, construite en une fois et jamais
+    modifiée ensuite. Une requête lit `gestionnaire.snapshot` une seule fois au début et
+    travaille sur cette version du début à la fin, même si un rechargement a lieu entre-temps.
+    """
+
+    __slots__ = ("version", "mtime", "charge_a", "agences", "agences_par_nom", "index_trajets", "index_agences", "noyau_agences", "resumes_agences", "villes", "reseau")
+
+    def __init__(self, agences: List[Dict[str, Any]], version: str = "", mtime: Optional[float] = None):
+        self.version = version # Empreinte du contenu : identique dans tous les workers pour un même fichier
+        self.mtime = mtime
+        self.charge_a = datetime.utcnow()
+        self.agences: Tuple[Dict[str, Any], ...] = tuple(agences)
+        self.agences_par_nom: Dict[str, Dict[str, Any]] = {agence.get('nom_agence'): agence for agence in self.agences}
+        self.index_trajets = construire_index_trajets(self.agences)
+        self.resumes_agences = [resume_agence(agence) for agence in self.agences]
+        self.villes = IndexVilles(
+            [agence.get('ville_depart') for agence in self.agences]
+            + [trajet.get('destination') for agence in self.agences for trajet in agence.get('trajets', [])]
+        )
+        self.reseau = ReseauTrajets(
+            {
+                'depart': agence['ville_depart'],
+                'destination': trajet['destination'],
+                'agence': agence.get('nom_agence'),
+                'heureDepart': trajet.get('departure'),
+                'dureeEstimee': trajet.get('duration'),
+                'prix_classique': trajet.get('prix_classique'),
+                'prix_vip': trajet.get('prix_vip'),
+                'masque': masque_jours(trajet.get('days_of_week')),
+            }
+            for agence in self.agences
+            for trajet in agence.get('trajets', [])
+        )
+        if self.agences:
+            coords_agences = [(agence['latitude'], agence['longitude']) for agence in self.agences]
+            self.index_agences: Optional[IndexSpatial] = IndexSpatial(coords_agences)
+            self.noyau_agences: Optional[NoyauHaversine] = NoyauHaversine(coords_agences)
+        else:
+            self.index_agences = None
+            self.noyau_agences = None
+
+    def __bool__(self) -> bool:
+        return bool(self.agences)
+
+    # --- Requêtes (même interface que catalogue_db.CatalogueSQL) ---
+
+    def trajets(self, depart: str, destination: str, date_voyage: Optional[str] = None, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        # Bit du jour demandé (None si pas de date ou date invalide : pas de filtre)
+        jour_bit = bit_jour(date_voyage)
+        cle = (normalize_text(depart), normalize_text(destination))
+
+        trajets_trouves = []
+        for masque, trajet_info in self.index_trajets.get(cle, ()):
+            if jour_bit is not None and not masque & jour_bit:
+                continue # Ce trajet ne circule pas le jour demandé
+            # On ajoute la date au résultat pour la clarté
+            trajets_trouves.append({**trajet_info, 'date': date_voyage})
+        return trajets_trouves[offset:offset + limit if limit else None]
+
+    def agences_proches(self, latitude: float, longitude: float, limit: int, rayon_km: Optional[float] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        # Les k plus proches via l'index spatial, sans copier les agences ni trier tout le catalogue
+        voisins = self.index_agences.plus_proches(latitude, longitude, k=offset + limit, rayon_km=rayon_km)
+        return [{**self.resumes_agences[i], 'distance_km': round(dist, 2)} for i, dist in voisins[offset:]]
+
+    def agences_proches_lot(self, latitudes: List[float], longitudes: List[float], limit: int, rayon_km: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        # Toutes les distances sont calculées en un seul passage vectorisé
+        voisins_par_point = self.noyau_agences.plus_proches(latitudes, longitudes, k=limit, rayon_km=rayon_km)
+        return [
+            [{**self.resumes_agences[i], 'distance_km': round(dist, 2)} for i, dist in voisins]
+            for voisins in voisins_par_point
+        ]
+
+    def agence(self, nom_agence: str) -> Optional[Dict[str, Any]]:
+        return self.agences_par_nom.get(nom_agence)
+
+    def resume(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "charge_a": str(self.charge_a),
+            "agences": len(self.agences),
+            "villes": len(self.villes),
+            "connexions_hebdomadaires": len(self.reseau),
+            "trajets": sum(len(trajets) for trajets in self.index_trajets.values()),
+        }
+
+def lire_agences(chemin: str) -> Tuple[List[Dict[str, Any]], str, float]:
+    """Lit et valide le fichier du catalogue : (agences, empreinte du contenu, date de modification)."""
+    try:
+        mtime = os.stat(chemin).st_mtime
+        with open(chemin, "rb") as f:
+            contenu = f.read()
+        data = json.loads(contenu)
+    except FileNotFoundError:
+        raise ErreurCatalogue(f"Le fichier {chemin} est introuvable.")
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ErreurCatalogue(f"Impossible de décoder le fichier {chemin} : {e}")
+    return valider_agences(data), hashlib.sha256(contenu).hexdigest()[:16], mtime
+
+def construire_snapshot(chemin: str) -> SnapshotCatalogue:
+    """Lit, valide et indexe le fichier du catalogue (exécuté hors de la boucle d'événements)."""
+    return SnapshotCatalogue(*lire_agences(chemin))
+
+class GestionnaireCatalogue:
+    """
+    Catalogue des agences rechargeable à chaud.
+
+    Le fichier est surveillé par sa date de modification (toutes les `intervalle` secondes) et
+    peut aussi être rechargé à la demande. La lecture, la validation et la construction des
+    index se font dans un thread ; la nouvelle version remplace l'ancienne par une simple
+    affectation de `snapshot`. Un fichier invalide est refusé et l'ancienne version reste en service.
+    """
+
+    def __init__(self, chemin: str, intervalle: float = 5.0):
+        self.chemin = chemin
+        self.intervalle = intervalle
+        self.snapshot = SnapshotCatalogue([])
+        self.derniere_erreur: Optional[str] = None
+        self._mtime: Optional[float] = None # Date de modification du fichier déjà traitée
+        self._verrou: Optional[asyncio.Lock] = None
+        self._actif = False
+        self._tache: Optional[asyncio.Task] = None
+        self.stats = {"rechargements": 0, "inchanges": 0, "echecs": 0}
+
+    async def demarrer(self):
+        self._verrou = asyncio.Lock()
+        try:
+            await self.recharger()
+            journal.info("Données des agences chargées avec succès.", extra={"version": self.snapshot.version})
+        except ErreurCatalogue as e:
+            journal.error("Erreur: %s", e)
+        if self.intervalle > 0:
+            self._actif = True
+            self._tache = asyncio.create_task(self._surveiller())
+
+    async def arreter(self):
+        self._actif = False
+        if self._tache is not None:
+            self._tache.cancel()
+            await asyncio.gather(self._tache, return_exceptions=True)
+            self._tache = None
+
+    async def recharger(self, force: bool = False) -> bool:
+        """
+        Recharge le fichier. Retourne True si une nouvelle version a été mise en service,
+        False si le contenu n'a pas changé. Lève ErreurCatalogue si le fichier est invalide.
+        """
+        async with self._verrou:
+            try:
+                snapshot = await asyncio.to_thread(construire_snapshot, self.chemin)
+            except ErreurCatalogue as e:
+                self.stats["echecs"] += 1
+                self.derniere_erreur = str(e)
+                raise
+            self.derniere_erreur = None
+            self._mtime = snapshot.mtime
+            if snapshot.version == self.snapshot.version and not force:
+                self.stats["inchanges"] += 1
+                return False
+            self.snapshot = snapshot
+            self.stats["rechargements"] += 1
+            return True
+
+    async def _surveiller(self):
+        while self._actif:
+            await asyncio.sleep(self.intervalle)
+            try:
+                mtime = os.stat(self.chemin).st_mtime
+            except OSError:
+                continue
+            if mtime == self._mtime:
+                continue
+            try:
+                if await self.recharger():
+                    journal.info("Catalogue des agences rechargé.", extra={"version": self.snapshot.version})
+            except ErreurCatalogue as e:
+                # On ne réessaie qu'à la prochaine modification du fichier
+                self._mtime = mtime
+                journal.error("Erreur lors du rechargement du catalogue, version précédente conservée : %s", e)
+
+    def statistiques(self) -> Dict[str, Any]:
+        return {**self.stats, **self.snapshot.resume(), "derniere_erreur": self.derniere_erreur}
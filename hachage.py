@@ -0,0 +1,92 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+# Contexte passlib propre à chaque processus du pool (créé au premier appel)
+_contexte: Optional[CryptContext] = None
+
+def creer_contexte(rounds: int) -> CryptContext:
+    # needs_update signale les hachages dont le coût diffère de `rounds` (à la hausse comme à la baisse)
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+def _initialiser(rounds: int):
+    global _contexte
+    _contexte = creer_contexte(rounds)
+
+def _hacher(mot_de_passe: str) -> str:
+    return _contexte.hash(mot_de_passe)
+
+def _verifier(mot_de_passe: str, hachage: str) -> Tuple[bool, Optional[str]]:
+    # (mot de passe correct, nouveau hachage si le coût a changé depuis sa création)
+    return _contexte.verify_and_update(mot_de_passe, hachage)
+
+def _pret() -> bool:
+    return True
+
+class PoolSature(Exception):
+    """Trop de calculs bcrypt en attente : la requête doit être refusée tout de suite (503)."""
+
+class PoolHachage:
+    """
+    Hachage et vérification bcrypt dans un pool de processus dédié et borné.
+
+    bcrypt coûte volontairement ~100 ms de CPU : exécuté dans le threadpool du serveur, il
+    retarde toutes les autres requêtes du worker. Ici au plus `processus` calculs tournent en
+    parallèle et `file_max` attendent ; au-delà, PoolSature est levée immédiatement plutôt que
+    de laisser les connexions s'accumuler.
+    """
+
+    def __init__(self, processus: int = 2, file_max: int = 32, rounds: int = 12):
+        self.processus = processus
+        self.file_max = file_max
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._en_cours = 0
+        self.stats = {"hachages": 0, "verifications": 0, "rehachages": 0, "refus_sature": 0}
+
+    async def demarrer(self):
+        # 'spawn' : pas de fork d'un processus qui a déjà une boucle asyncio et des threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processus,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialiser,
+            initargs=(self.rounds,),
+        )
+        # Démarrage des processus maintenant, pas à la première connexion
+        boucle = asyncio.get_running_loop()
+        await asyncio.gather(*(boucle.run_in_executor(self._executor, _pret) for _ in range(self.processus)))
+
+    async def arreter(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _executer(self, fonction, *args):
+        if self._executor is None:
+            raise RuntimeError("Le pool de hachage n'est pas démarré.")
+        if self._en_cours >= self.processus + self.file_max:
+            self.stats["refus_sature"] += 1
+            raise PoolSature()
+        self._en_cours += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fonction, *args)
+        finally:
+            self._en_cours -= 1
+
+    async def hacher(self, mot_de_passe: str) -> str:
+        self.stats["hachages"] += 1
+        return await self._executer(_hacher, mot_de_passe)
+
+    async def verifier(self, mot_de_passe: str, hachage: str) -> Tuple[bool, Optional[str]]:
+        """(mot de passe correct, nouveau hachage à enregistrer ou None)."""
+        self.stats["verifications"] += 1
+        correct, nouveau = await self._executer(_verifier, mot_de_passe, hachage)
+        if nouveau is not None:
+            self.stats["rehachages"] += 1
+        return correct, nouveau
+
+    def statistiques(self) -> Dict[str, int]:
+        return {**self.stats, "en_cours": self._en_cours, "processus": self.processus, "file_max": self.file_max, "rounds": self.rounds}
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import re
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+journal = logging.getLogger(__name__)
+
+# Une table par jour (UTC) : positions_AAAAMMJJ
+FORMAT_TABLE = "positions_%Y%m%d"
+MOTIF_TABLE = re.compile(r"^positions_(\d{8})$")
+
+Point = Tuple[str, float, float, float] # (vehicle_id, latitude, longitude, timestamp epoch UTC)
+
+def vers_epoch(moment: datetime) -> float:
+    """Datetime naïf (UTC) ou avec fuseau -> secondes epoch UTC."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def depuis_epoch(ts: float) -> datetime:
+    """Secondes epoch UTC -> datetime naïf UTC, comme les timestamps de VehicleLocation."""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None)
+
+def vers_utc_naif(moment: datetime) -> datetime:
+    """Ramène un datetime avec fuseau en UTC naïf ; un datetime naïf est supposé déjà en UTC."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+def nom_table(ts: float) -> str:
+    return depuis_epoch(ts).strftime(FORMAT_TABLE)
+
+class HistoriquePositions:
+    """
+    Historique append-only des positions, partitionné par jour dans une base SQLite dédiée.
+
+    Chaque table journalière est une table WITHOUT ROWID de clé (vehicle_id, ts) : les
+    points d'un véhicule sont stockés contigus et triés, donc une requête sur une plage
+    de temps est une lecture d'index, pas un parcours de table. La rétention supprime
+    les tables entières (DROP TABLE) puis rend l'espace disque (incremental_vacuum).
+
+    Le tampon est borné (`max_tampon` points, les plus anciens sont abandonnés au-delà) et un
+    lot dont l'écriture échoue `max_tentatives` fois de suite est abandonné : une erreur
+    persistante n'arrête pas l'historique et ne fait pas grossir la mémoire.
+    """
+
+    def __init__(self, chemin: str, retention_jours: int = 30, intervalle: float = 1.0, max_tampon: int = 100000, max_tentatives: int = 3):
+        self.chemin = chemin
+        self.retention_jours = retention_jours
+        self.intervalle = intervalle
+        self.max_tampon = max_tampon
+        self.max_tentatives = max_tentatives
+        self._tampon: List[Point] = []
+        self._reprise: List[Point] = [] # Lot en échec, réessayé au prochain cycle
+        self._echecs = 0
+        self._tables: set = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._actif = False
+        self._tache: Optional[asyncio.Task] = None
+        self._verrou: Optional[asyncio.Lock] = None # Une seule écriture à la fois sur la connexion partagée
+        self._derniere_purge = 0.0
+        self.stats = {
+            "points_ajoutes": 0, "points_ecrits": 0, "tables_supprimees": 0, "erreurs_ecriture": 0,
+            "points_trop_anciens": 0, "points_abandonnes": 0,
+        }
+
+    def _connexion(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.chemin, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _ouvrir(self):
+        self._conn = self._connexion()
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Le mode incrémental ne s'active que par un VACUUM (quasi gratuit sur une base neuve)
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("VACUUM")
+        self._tables = set(self._lister_tables(self._conn))
+
+    @staticmethod
+    def _lister_tables(conn: sqlite3.Connection) -> List[str]:
+        return [
+            nom for (nom,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'positions_%'")
+            if MOTIF_TABLE.match(nom)
+        ]
+
+    # --- Écriture ---
+
+    def ajouter(self, vehicle_id: str, latitude: float, longitude: float, timestamp: datetime) -> int:
+        """Ajoute un point au tampon ; il sera écrit avec le prochain lot. Retourne 0 s'il est refusé (trop ancien)."""
+        return self.ajouter_lot([(vehicle_id, latitude, longitude, timestamp)])
+
+    def ajouter_lot(self, points: List[Tuple[str, float, float, datetime]]) -> int:
+        """Ajoute des points au tampon. Retourne le nombre de points acceptés."""
+        # Points antérieurs à la rétention (horloge de traceur à 1970...) : leur table serait aussitôt purgée
+        limite = datetime.now(timezone.utc).timestamp() - self.retention_jours * 86400
+        acceptes: List[Point] = []
+        for vehicle_id, latitude, longitude, moment in points:
+            ts = vers_epoch(moment)
+            if ts >= limite:
+                acceptes.append((vehicle_id, latitude, longitude, ts))
+        self.stats["points_trop_anciens"] += len(points) - len(acceptes)
+        self._tampon.extend(acceptes)
+        self.stats["points_ajoutes"] += len(acceptes)
+        exces = len(self._tampon) + len(self._reprise) - self.max_tampon
+        if exces > 0:
+            # Écritures en échec depuis longtemps : on garde les points les plus récents
+            del self._tampon[:exces]
+            self.stats["points_abandonnes"] += exces
+        return len(acceptes)
+
+    def _ecrire(self, lot: List[Point]):
+        try:
+            self._ecrire_tables(lot)
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            # Table journalière supprimée par la purge d'un autre worker : liste relue, une seule nouvelle tentative
+            self._tables = set(self._lister_tables(self._conn))
+            self._ecrire_tables(lot)
+
+    def _ecrire_tables(self, lot: List[Point]):
+        par_table: Dict[str, List[Point]] = {}
+        for point in lot:
+            par_table.setdefault(nom_table(point[3]), []).append(point)
+        with self._conn:
+            for table, points in par_table.items():
+                if table not in self._tables:
+                    self._conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table} ("
+                        "vehicle_id TEXT NOT NULL, ts REAL NOT NULL, latitude REAL NOT NULL, longitude REAL NOT NULL, "
+                        "PRIMARY KEY (vehicle_id, ts)) WITHOUT ROWID"
+                    )
+                    self._tables.add(table)
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} (vehicle_id, ts, latitude, longitude) VALUES (?, ?, ?, ?)",
+                    [(v, ts, lat, lon) for v, lat, lon, ts in points]
+                )
+
+    def _purger(self, maintenant: float) -> int:
+        limite = depuis_epoch(maintenant) - timedelta(days=self.retention_jours)
+        limite_table = limite.strftime(FORMAT_TABLE)
+        supprimees = 0
+        for table in self._lister_tables(self._conn):
+            if table < limite_table:
+                self._conn.execute(f"DROP TABLE {table}")
+                self._tables.discard(table)
+                supprimees += 1
+        if supprimees:
+            self._conn.commit()
+            self._conn.execute("PRAGMA incremental_vacuum")
+        return supprimees
+
+    def _cycle(self, lot: List[Point], purger: bool, maintenant: float) -> int:
+        if lot:
+            self._ecrire(lot)
+        return self._purger(maintenant) if purger else 0
+
+    async def demarrer(self):
+        await asyncio.to_thread(self._ouvrir)
+        self._verrou = asyncio.Lock()
+        self._actif = True
+        self._tache = asyncio.create_task(self._boucle())
+
+    async def arreter(self):
+        self._actif = False
+        if self._tache is not None:
+            await asyncio.gather(self._tache, return_exceptions=True)
+            self._tache = None
+        await self.vider()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _boucle(self):
+        while self._actif:
+            await asyncio.sleep(self.intervalle)
+            await self.vider()
+
+    async def vider(self) -> bool:
+        """
+        Écrit le tampon en une transaction (executemany par table journalière).
+        Retourne False si l'écriture a échoué (lot gardé pour la prochaine tentative ou abandonné),
+        True sinon, y compris quand l'historique n'est pas démarré (rien à écrire).
+        """
+        if self._conn is None:
+            return True
+        async with self._verrou:
+            lot, self._reprise, self._tampon = self._reprise + self._tampon, [], []
+            maintenant = datetime.now(timezone.utc).timestamp()
+            purger = maintenant - self._derniere_purge > 3600 # Rétention vérifiée une fois par heure
+            try:
+                self.stats["tables_supprimees"] += await asyncio.to_thread(self._cycle, lot, purger, maintenant)
+                self.stats["points_ecrits"] += len(lot)
+                self._echecs = 0
+                if purger:
+                    self._derniere_purge = maintenant
+                return True
+            except sqlite3.Error as e:
+                self.stats["erreurs_ecriture"] += 1
+                self._echecs += 1
+                if self._echecs >= self.max_tentatives:
+                    # Erreur persistante : le lot est abandonné pour que les points suivants soient écrits
+                    self.stats["points_abandonnes"] += len(lot)
+                    self._echecs = 0
+                    journal.error("Écriture de l'historique des positions impossible (%s) : %d points abandonnés après %d tentatives", e, len(lot), self.max_tentatives)
+                else:
+                    journal.error("Erreur lors de l'écriture de l'historique des positions : %s", e)
+                    self._reprise = lot
+                return False
+
+    # --- Lecture ---
+
+    def lire(self, vehicle_id: str, debut: datetime, fin: datetime, taille_lot: int = 1000) -> Iterator[Tuple[float, float, datetime]]:
+        """
+        Parcourt les points (latitude, longitude, timestamp) d'un véhicule entre debut (inclus) et fin (exclu),
+        dans l'ordre chronologique, table journalière par table journalière et par lots.
+        """
+        ts_debut, ts_fin = vers_epoch(debut), vers_epoch(fin)
+        conn = self._connexion()
+        try:
+            tables = set(self._lister_tables(conn))
+            jour = depuis_epoch(ts_debut).date()
+            dernier_jour = depuis_epoch(ts_fin).date()
+            while jour <= dernier_jour:
+                table = jour.strftime(FORMAT_TABLE)
+                jour += timedelta(days=1)
+                if table not in tables:
+                    continue
+                curseur = conn.execute(
+                    f"SELECT latitude, longitude, ts FROM {table} WHERE vehicle_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (vehicle_id, ts_debut, ts_fin)
+                )
+                while True:
+                    lignes = curseur.fetchmany(taille_lot)
+                    if not lignes:
+                        break
+                    for latitude, longitude, ts in lignes:
+                        yield latitude, longitude, depuis_epoch(ts)
+        finally:
+            conn.close()
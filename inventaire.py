@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import UniqueConstraint, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Field, Session, SQLModel, select
+
+from catalogue import normalize_text
+
+journal = logging.getLogger(__name__)
+
+# (agence, départ normalisé, destination normalisée, heure de départ, date "AAAA-MM-JJ", classe)
+CleDepart = Tuple[str, str, str, str, str, str]
+
+def cle_depart(agence: str, depart: str, destination: str, heure_depart: Optional[str], date_voyage: str, classe: str) -> CleDepart:
+    return (agence, normalize_text(depart), normalize_text(destination), heure_depart or "", date_voyage, classe)
+
+# --- MODÈLES ---
+
+class PlacesDepart(SQLModel, table=True):
+    # Une ligne par départ réel (trajet du catalogue à une date donnée) et par classe
+    __table_args__ = (UniqueConstraint("agence", "depart_norm", "destination_norm", "heure_depart", "date_voyage", "classe"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    agence: str
+    depart_norm: str
+    destination_norm: str
+    heure_depart: str = "" # "08:00", vide si le catalogue ne la donne pas
+    date_voyage: str # AAAA-MM-JJ
+    classe: str # classique ou vip
+    capacite: int
+    places_restantes: int # Capacité moins les places retenues ou vendues (jamais négatif)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Reservation(SQLModel, table=True):
+    # Places retenues pour un paiement : confirmées par le webhook ou rendues à l'expiration
+    id: Optional[int] = Field(default=None, primary_key=True)
+    depart_id: int = Field(foreign_key="placesdepart.id", index=True)
+    notchpay_reference: Optional[str] = Field(default=None, index=True, unique=True) # Connue après l'appel à Notch Pay
+    places: int
+    status: str = Field(default="held", index=True) # held, confirmed, expired, released, cancelled, oversold
+    expires_at: datetime = Field(index=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CompteurPlaces:
+    """
+    Places restantes par départ, gardées en mémoire pour les lectures de disponibilité.
+
+    Mis à jour après chaque retenue ou libération de ce worker et par les messages des autres
+    workers ; une entrée plus vieille que `ttl` secondes est relue en base. La base reste la
+    seule référence pour retenir des places.
+    """
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._valeurs: Dict[CleDepart, Tuple[int, float]] = {}
+
+    def lire(self, cle: CleDepart) -> Optional[int]:
+        entree = self._valeurs.get(cle)
+        if entree is None or time.monotonic() - entree[1] > self.ttl:
+            return None
+        return entree[0]
+
+    def mettre_a_jour(self, cle: CleDepart, places: int):
+        self._valeurs[cle] = (places, time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._valeurs)
+
+class Inventaire:
+    """
+    Inventaire des places par départ, avec retenues de courte durée pendant le paiement.
+
+    Une retenue décrémente `places_restantes` par un UPDATE conditionnel
+    (`places_restantes >= n`) dans la même transaction que l'insertion de la réservation :
+    deux workers ne peuvent pas vendre la même place. Le webhook confirme la réservation,
+    un échec de paiement ou le balayage des retenues expirées rend les places.
+    """
+
+    def __init__(
+        self,
+        engine,
+        capacites: Dict[str, int],
+        duree_retenue: timedelta = timedelta(minutes=15),
+        intervalle_balayage: float = 30.0,
+        publier: Optional[Callable[[CleDepart, int], None]] = None,
+    ):
+        self.engine = engine
+        self.capacites = capacites # Places par classe pour un départ absent de la table
+        self.duree_retenue = duree_retenue
+        self.intervalle_balayage = intervalle_balayage
+        self.publier = publier # Diffusion des nouvelles disponibilités aux autres workers
+        self.compteur = CompteurPlaces()
+        self._ids: Dict[CleDepart, int] = {}
+        self._tache: Optional[asyncio.Task] = None
+        self.stats = {"retenues": 0, "complet": 0, "confirmees": 0, "liberees": 0, "expirees": 0, "survendues": 0}
+
+    # --- Accès base de données (exécutés dans un thread) ---
+
+    def _depart_id(self, session: Session, cle: CleDepart) -> int:
+        if cle in self._ids:
+            return self._ids[cle]
+        agence, depart_norm, destination_norm, heure, date_voyage, classe = cle
+        conditions = (
+            PlacesDepart.agence == agence, PlacesDepart.depart_norm == depart_norm,
+            PlacesDepart.destination_norm == destination_norm, PlacesDepart.heure_depart == heure,
+            PlacesDepart.date_voyage == date_voyage, PlacesDepart.classe == classe,
+        )
+        depart_id = session.exec(select(PlacesDepart.id).where(*conditions)).first()
+        if depart_id is None:
+            capacite = self.capacites[classe]
+            ligne = PlacesDepart(
+                agence=agence, depart_norm=depart_norm, destination_norm=destination_norm, heure_depart=heure,
+                date_voyage=date_voyage, classe=classe, capacite=capacite, places_restantes=capacite,
+            )
+            session.add(ligne)
+            try:
+                session.commit()
+                depart_id = ligne.id
+            except IntegrityError:
+                # Créé au même moment par une autre requête ou un autre worker
+                session.rollback()
+                depart_id = session.exec(select(PlacesDepart.id).where(*conditions)).one()
+        self._ids[cle] = depart_id
+        return depart_id
+
+    def _places_restantes(self, session: Session, depart_id: int) -> int:
+        return session.exec(select(PlacesDepart.places_restantes).where(PlacesDepart.id == depart_id)).one()
+
+    def _retenir(self, cle: CleDepart, places: int) -> Tuple[Optional[int], int]:
+        """(id de la réservation ou None si complet, places restantes après l'opération)."""
+        with Session(self.engine) as session:
+            depart_id = self._depart_id(session, cle)
+            maintenant = datetime.utcnow()
+            restantes = session.execute(
+                update(PlacesDepart)
+                .where(PlacesDepart.id == depart_id, PlacesDepart.places_restantes >= places)
+                .values(places_restantes=PlacesDepart.places_restantes - places, updated_at=maintenant)
+                .returning(PlacesDepart.places_restantes)
+            ).scalar()
+            if restantes is None:
+                session.rollback()
+                return None, self._places_restantes(session, depart_id)
+            reservation = Reservation(depart_id=depart_id, places=places, expires_at=maintenant + self.duree_retenue)
+            session.add(reservation)
+            session.commit()
+            return reservation.id, restantes
+
+    def _rendre(self, session: Session, depart_id: int, places: int) -> Tuple[CleDepart, int]:
+        session.execute(
+            update(PlacesDepart)
+            .where(PlacesDepart.id == depart_id)
+            .values(places_restantes=PlacesDepart.places_restantes + places, updated_at=datetime.utcnow())
+        )
+        *cle, places_restantes = session.execute(
+            select(
+                PlacesDepart.agence, PlacesDepart.depart_norm, PlacesDepart.destination_norm, PlacesDepart.heure_depart,
+                PlacesDepart.date_voyage, PlacesDepart.classe, PlacesDepart.places_restantes,
+            ).where(PlacesDepart.id == depart_id)
+        ).one()
+        return tuple(cle), places_restantes
+
+    def _changer_statut(self, condition, anciens: Tuple[str, ...], nouveau: str) -> List[Tuple[CleDepart, int]]:
+        """Passe les réservations visées de `anciens` à `nouveau` (UPDATE conditionnel) et rend leurs places."""
+        with Session(self.engine) as session:
+            changements = self._changer_statut_en_session(session, condition, anciens, nouveau)
+            session.commit()
+        return changements
+
+    def _changer_statut_en_session(self, session: Session, condition, anciens: Tuple[str, ...], nouveau: str) -> List[Tuple[CleDepart, int]]:
+        lignes = session.execute(
+            update(Reservation)
+            .where(condition, Reservation.status.in_(anciens))
+            .values(status=nouveau, updated_at=datetime.utcnow())
+            .returning(Reservation.depart_id, Reservation.places)
+        ).all()
+        return [self._rendre(session, depart_id, places) for depart_id, places in lignes]
+
+    def _associer(self, reservation_id: int, reference: str):
+        with Session(self.engine) as session:
+            session.execute(
+                update(Reservation).where(Reservation.id == reservation_id).values(notchpay_reference=reference, updated_at=datetime.utcnow())
+            )
+            session.commit()
+
+    def _confirmer(self, session: Session, reference: str) -> str:
+        """'confirmed', 'oversold' (retenue expirée et départ complet entre-temps) ou 'inconnue'. Sans commit."""
+        resultat = session.execute(
+            update(Reservation)
+            .where(Reservation.notchpay_reference == reference, Reservation.status == "held")
+            .values(status="confirmed", updated_at=datetime.utcnow())
+        )
+        if resultat.rowcount == 1:
+            return "confirmed"
+        # Paiement arrivé après l'expiration de la retenue : on reprend les places si elles sont encore libres
+        reservation = session.exec(
+            select(Reservation).where(Reservation.notchpay_reference == reference, Reservation.status.in_(("expired", "released")))
+        ).first()
+        if reservation is None:
+            return "inconnue"
+        resultat = session.execute(
+            update(PlacesDepart)
+            .where(PlacesDepart.id == reservation.depart_id, PlacesDepart.places_restantes >= reservation.places)
+            .values(places_restantes=PlacesDepart.places_restantes - reservation.places, updated_at=datetime.utcnow())
+        )
+        statut = "confirmed" if resultat.rowcount == 1 else "oversold"
+        reservation.status = statut
+        reservation.updated_at = datetime.utcnow()
+        session.add(reservation)
+        return statut
+
+    def appliquer_paiement(self, session: Session, reference: str, statut: str) -> Tuple[Optional[str], List[Tuple[CleDepart, int]]]:
+        """
+        Répercute une notification de paiement sur la réservation liée à `reference`, dans la
+        transaction de l'appelant (sans commit). Retourne (nouveau statut de la réservation ou None
+        si elle n'est pas concernée, places rendues). Après le commit : paiement_applique(...).
+        """
+        if statut == "complete":
+            resultat = self._confirmer(session, reference)
+            return (None if resultat == "inconnue" else resultat), []
+        if statut in ("failed", "expired", "canceled", "cancelled"):
+            nouveau = "cancelled" if statut in ("canceled", "cancelled") else "released"
+            # Un billet confirmé puis annulé rend aussi ses places
+            anciens = ("held", "confirmed") if nouveau == "cancelled" else ("held",)
+            changements = self._changer_statut_en_session(session, Reservation.notchpay_reference == reference, anciens, nouveau)
+            return (nouveau if changements else None), changements
+        return None, []
+
+    def paiement_applique(self, reference: str, resultat: Optional[str], changements: List[Tuple[CleDepart, int]]):
+        """Statistiques et compteurs de places, une fois la transaction de appliquer_paiement validée."""
+        if resultat in ("confirmed", "oversold"):
+            self.stats["confirmees" if resultat == "confirmed" else "survendues"] += 1
+            if resultat == "oversold":
+                journal.warning("Paiement reçu après l'expiration de sa retenue, départ complet : remboursement nécessaire.", extra={"reference": reference})
+        elif resultat is not None:
+            self.stats["liberees"] += len(changements)
+            self._signaler(changements)
+
+    def _notifier(self, reference: str, statut: str) -> Tuple[Optional[str], List[Tuple[CleDepart, int]]]:
+        with Session(self.engine) as session:
+            resultat = self.appliquer_paiement(session, reference, statut)
+            session.commit()
+        return resultat
+
+    def _expirees(self) -> List[int]:
+        with Session(self.engine) as session:
+            return list(session.exec(
+                select(Reservation.id)
+                .where(Reservation.status == "held", Reservation.expires_at <= datetime.utcnow())
+                .limit(1000)
+            ))
+
+    def _lire_places(self, cle: CleDepart) -> int:
+        agence, depart_norm, destination_norm, heure, date_voyage, classe = cle
+        with Session(self.engine) as session:
+            places = session.exec(
+                select(PlacesDepart.places_restantes).where(
+                    PlacesDepart.agence == agence, PlacesDepart.depart_norm == depart_norm,
+                    PlacesDepart.destination_norm == destination_norm, PlacesDepart.heure_depart == heure,
+                    PlacesDepart.date_voyage == date_voyage, PlacesDepart.classe == classe,
+                )
+            ).first()
+        return self.capacites[classe] if places is None else places
+
+    def _nombre_retenues(self) -> int:
+        with Session(self.engine) as session:
+            return session.exec(select(func.count()).select_from(Reservation).where(Reservation.status == "held")).one()
+
+    # --- Cycle de vie ---
+
+    async def demarrer(self):
+        if self.intervalle_balayage > 0:
+            self._tache = asyncio.create_task(self._balayer())
+
+    async def arreter(self):
+        if self._tache is not None:
+            self._tache.cancel()
+            await asyncio.gather(self._tache, return_exceptions=True)
+            self._tache = None
+
+    def _signaler(self, changements: List[Tuple[CleDepart, int]]):
+        for cle, places in changements:
+            self.compteur.mettre_a_jour(cle, places)
+            if self.publier is not None:
+                self.publier(cle, places)
+
+    async def retenir(self, cle: CleDepart, places: int = 1) -> Optional[int]:
+        """Retient `places` places sur le départ. Retourne l'id de la réservation, ou None si le départ est complet."""
+        connues = self.compteur.lire(cle)
+        if connues is not None and connues < places:
+            # Complet d'après un compteur récent : inutile d'écrire en base
+            self.stats["complet"] += 1
+            return None
+        reservation_id, restantes = await asyncio.to_thread(self._retenir, cle, places)
+        self._signaler([(cle, restantes)])
+        self.stats["retenues" if reservation_id is not None else "complet"] += 1
+        return reservation_id
+
+    async def associer(self, reservation_id: int, reference: str):
+        """Relie la réservation à la référence Notch Pay (qui sera reçue par le webhook)."""
+        await asyncio.to_thread(self._associer, reservation_id, reference)
+
+    async def liberer(self, reservation_id: int):
+        """Rend les places d'une retenue dont le paiement n'a pas pu être initié."""
+        changements = await asyncio.to_thread(self._changer_statut, Reservation.id == reservation_id, ("held",), "released")
+        self.stats["liberees"] += len(changements)
+        self._signaler(changements)
+
+    async def notifier_paiement(self, reference: str, statut: str) -> Optional[str]:
+        """
+        Répercute une notification de paiement sur la réservation liée à `reference`.
+        Retourne le nouveau statut de la réservation, ou None si elle n'est pas concernée.
+        """
+        resultat, changements = await asyncio.to_thread(self._notifier, reference, statut)
+        self.paiement_applique(reference, resultat, changements)
+        return resultat
+
+    async def disponibles(self, cle: CleDepart) -> int:
+        """Places restantes (compteur en mémoire, relu en base s'il est trop ancien)."""
+        places = self.compteur.lire(cle)
+        if places is None:
+            places = await asyncio.to_thread(self._lire_places, cle)
+            self.compteur.mettre_a_jour(cle, places)
+        return places
+
+    async def expirer(self) -> int:
+        """Rend les places des retenues expirées. Retourne le nombre de réservations expirées."""
+        expirees = 0
+        for reservation_id in await asyncio.to_thread(self._expirees):
+            # Réclamée par UPDATE conditionnel : un autre worker ou le webhook a pu passer avant
+            changements = await asyncio.to_thread(self._changer_statut, Reservation.id == reservation_id, ("held",), "expired")
+            expirees += len(changements)
+            self._signaler(changements)
+        self.stats["expirees"] += expirees
+        return expirees
+
+    async def _balayer(self):
+        while True:
+            await asyncio.sleep(self.intervalle_balayage)
+            try:
+                await self.expirer()
+            except Exception as e:
+                journal.error("Erreur lors du balayage des places retenues : %s", e)
+
+    async def statistiques(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "retenues_en_cours": await asyncio.to_thread(self._nombre_retenues),
+            "departs_en_memoire": len(self.compteur),
+        }
@@ -0,0 +1,54 @@
+import json
+import logging
+import sys
+from datetime import datetime, timezone
+
+# Attributs standard d'un LogRecord : tout le reste vient de `extra=` et forme les champs structurés
+_ATTRIBUTS_STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def champs(record: logging.LogRecord) -> dict:
+    return {cle: valeur for cle, valeur in vars(record).items() if cle not in _ATTRIBUTS_STANDARD}
+
+class FormatteurJSON(logging.Formatter):
+    """Une ligne JSON par message : horodatage, niveau, logger, message et champs passés dans `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        ligne = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "niveau": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **champs(record),
+        }
+        if record.exc_info:
+            ligne["exception"] = self.formatException(record.exc_info)
+        return json.dumps(ligne, ensure_ascii=False, default=str)
+
+class FormatteurTexte(logging.Formatter):
+    """Format lisible pour le développement ; les champs structurés suivent le message en clé=valeur."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        texte = super().format(record)
+        supplement = champs(record)
+        if supplement:
+            texte += " " + " ".join(f"{cle}={valeur}" for cle, valeur in supplement.items())
+        return texte
+
+def configurer_journalisation(niveau: str = "INFO", format: str = "texte"):
+    """
+    Journal de l'application sur la sortie standard (LOG_LEVEL, LOG_FORMAT=texte|json).
+    Les messages sous le niveau choisi sont écartés avant tout formatage.
+    """
+    gestionnaire = logging.StreamHandler(sys.stdout)
+    gestionnaire.setFormatter(FormatteurJSON() if format == "json" else FormatteurTexte())
+    racine = logging.getLogger()
+    for ancien in [g for g in racine.handlers if getattr(g, "_voyage", False)]:
+        racine.removeHandler(ancien) # Rechargement du module (uvicorn --reload) : pas de doublons
+    gestionnaire._voyage = True
+    racine.addHandler(gestionnaire)
+    racine.setLevel(niveau.upper())
+    # httpx journalise chaque requête en INFO, URL comprise (clé Google Maps en paramètre)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
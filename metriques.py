@@ -0,0 +1,320 @@
+import asyncio
+import glob
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Bornes par défaut des histogrammes de durée (secondes)
+BORNES_REQUETES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BORNES_SQL = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+Etiquettes = Tuple[str, ...]
+
+class Metrique:
+    """Métrique nommée avec des étiquettes (valeurs passées dans l'ordre de `etiquettes`)."""
+    type = ""
+
+    def __init__(self, nom: str, aide: str, etiquettes: Sequence[str] = ()):
+        self.nom = nom
+        self.aide = aide
+        self.etiquettes = tuple(etiquettes)
+        self._verrou = threading.Lock() # Observations venant aussi des threads (requêtes SQL)
+
+    def valeurs(self) -> List[Tuple[Etiquettes, Any]]:
+        raise NotImplementedError
+
+class Compteur(Metrique):
+    """Valeur qui ne fait qu'augmenter. `fonction` : valeur lue à la collecte (compteur tenu ailleurs)."""
+    type = "counter"
+
+    def __init__(self, nom: str, aide: str, etiquettes: Sequence[str] = (), fonction: Optional[Callable[[], float]] = None):
+        super().__init__(nom, aide, etiquettes)
+        self.fonction = fonction
+        self._valeurs: Dict[Etiquettes, float] = {}
+
+    def inc(self, *etiquettes: str, valeur: float = 1.0):
+        with self._verrou:
+            self._valeurs[etiquettes] = self._valeurs.get(etiquettes, 0.0) + valeur
+
+    def valeurs(self) -> List[Tuple[Etiquettes, Any]]:
+        if self.fonction is not None:
+            return [((), float(self.fonction()))]
+        with self._verrou:
+            return list(self._valeurs.items())
+
+class Jauge(Metrique):
+    """Valeur instantanée. `fonction` : lue à la collecte (nombre de connexions...)."""
+    type = "gauge"
+
+    def __init__(self, nom: str, aide: str, etiquettes: Sequence[str] = (), fonction: Optional[Callable[[], float]] = None):
+        super().__init__(nom, aide, etiquettes)
+        self.fonction = fonction
+        self._valeurs: Dict[Etiquettes, float] = {}
+
+    def definir(self, valeur: float, *etiquettes: str):
+        self._valeurs[etiquettes] = valeur
+
+    def valeurs(self) -> List[Tuple[Etiquettes, Any]]:
+        if self.fonction is not None:
+            return [((), float(self.fonction()))]
+        return list(self._valeurs.items())
+
+class Histogramme(Metrique):
+    """Répartition d'observations (durées) par tranches cumulées, avec somme et nombre."""
+    type = "histogram"
+
+    def __init__(self, nom: str, aide: str, etiquettes: Sequence[str] = (), bornes: Sequence[float] = BORNES_REQUETES):
+        super().__init__(nom, aide, etiquettes)
+        self.bornes = tuple(sorted(bornes))
+        self._valeurs: Dict[Etiquettes, List[float]] = {} # [compte par tranche..., +Inf, somme]
+
+    def observer(self, valeur: float, *etiquettes: str):
+        # Tranche de la valeur seulement ; le cumul est fait à l'exposition
+        i = 0
+        for borne in self.bornes:
+            if valeur <= borne:
+                break
+            i += 1
+        with self._verrou:
+            serie = self._valeurs.get(etiquettes)
+            if serie is None:
+                serie = self._valeurs[etiquettes] = [0.0] * (len(self.bornes) + 2)
+            serie[i] += 1
+            serie[-1] += valeur
+
+    def valeurs(self) -> List[Tuple[Etiquettes, Any]]:
+        with self._verrou:
+            return [(etiquettes, list(serie)) for etiquettes, serie in self._valeurs.items()]
+
+@contextmanager
+def chronometre(histogramme: Histogramme, *etiquettes: str, erreurs: Optional[Compteur] = None):
+    """Mesure la durée du bloc dans `histogramme` ; une exception incrémente aussi `erreurs`."""
+    debut = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if erreurs is not None:
+            erreurs.inc(*etiquettes)
+        raise
+    finally:
+        histogramme.observer(time.perf_counter() - debut, *etiquettes)
+
+class Registre:
+    """Ensemble des métriques d'un processus, exposées au format texte de Prometheus."""
+
+    def __init__(self):
+        self.metriques: Dict[str, Metrique] = {}
+
+    def _ajouter(self, metrique: Metrique):
+        if metrique.nom in self.metriques:
+            raise ValueError(f"Métrique déjà enregistrée : {metrique.nom}")
+        self.metriques[metrique.nom] = metrique
+        return metrique
+
+    def compteur(self, nom: str, aide: str, etiquettes: Sequence[str] = (), fonction: Optional[Callable[[], float]] = None) -> Compteur:
+        return self._ajouter(Compteur(nom, aide, etiquettes, fonction))
+
+    def jauge(self, nom: str, aide: str, etiquettes: Sequence[str] = (), fonction: Optional[Callable[[], float]] = None) -> Jauge:
+        return self._ajouter(Jauge(nom, aide, etiquettes, fonction))
+
+    def histogramme(self, nom: str, aide: str, etiquettes: Sequence[str] = (), bornes: Sequence[float] = BORNES_REQUETES) -> Histogramme:
+        return self._ajouter(Histogramme(nom, aide, etiquettes, bornes))
+
+    def instantane(self) -> Dict[str, Any]:
+        """Valeurs courantes, sérialisables en JSON (échangées entre les workers)."""
+        return {
+            nom: {
+                "type": m.type,
+                "aide": m.aide,
+                "etiquettes": list(m.etiquettes),
+                "bornes": list(getattr(m, "bornes", ())),
+                "valeurs": [[list(etiquettes), valeur] for etiquettes, valeur in m.valeurs()],
+            }
+            for nom, m in self.metriques.items()
+        }
+
+def fusionner(instantanes: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Additionne les instantanés de plusieurs processus, série par série."""
+    total: Dict[str, Any] = {}
+    for instantane in instantanes:
+        for nom, metrique in instantane.items():
+            cible = total.setdefault(nom, {**metrique, "valeurs": {}})
+            for etiquettes, valeur in metrique["valeurs"]:
+                cle = tuple(etiquettes)
+                actuelle = cible["valeurs"].get(cle)
+                if actuelle is None:
+                    cible["valeurs"][cle] = list(valeur) if isinstance(valeur, list) else valeur
+                elif isinstance(valeur, list):
+                    cible["valeurs"][cle] = [a + b for a, b in zip(actuelle, valeur)]
+                else:
+                    cible["valeurs"][cle] = actuelle + valeur
+    for metrique in total.values():
+        metrique["valeurs"] = [[list(cle), valeur] for cle, valeur in metrique["valeurs"].items()]
+    return total
+
+def _echapper(valeur: str) -> str:
+    return valeur.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _etiquettes(noms: Sequence[str], valeurs: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    paires = [f'{nom}="{_echapper(str(valeur))}"' for nom, valeur in zip(noms, valeurs)]
+    if extra is not None:
+        paires.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(paires) + "}" if paires else ""
+
+def _nombre(valeur: float) -> str:
+    if math.isinf(valeur):
+        return "+Inf"
+    return repr(float(valeur)) if not float(valeur).is_integer() else str(int(valeur))
+
+def exposer(instantane: Dict[str, Any]) -> str:
+    """Format texte d'exposition Prometheus (version 0.0.4)."""
+    lignes: List[str] = []
+    for nom, metrique in sorted(instantane.items()):
+        lignes.append(f"# HELP {nom} {metrique['aide']}")
+        lignes.append(f"# TYPE {nom} {metrique['type']}")
+        noms = metrique["etiquettes"]
+        for etiquettes, valeur in sorted(metrique["valeurs"], key=lambda v: v[0]):
+            if metrique["type"] != "histogram":
+                lignes.append(f"{nom}{_etiquettes(noms, etiquettes)} {_nombre(valeur)}")
+                continue
+            cumul = 0.0
+            for borne, compte in zip(list(metrique["bornes"]) + [math.inf], valeur[:-1]):
+                cumul += compte
+                lignes.append(f"{nom}_bucket{_etiquettes(noms, etiquettes, ('le', _nombre(borne)))} {_nombre(cumul)}")
+            lignes.append(f"{nom}_sum{_etiquettes(noms, etiquettes)} {_nombre(valeur[-1])}")
+            lignes.append(f"{nom}_count{_etiquettes(noms, etiquettes)} {_nombre(cumul)}")
+    return "\n".join(lignes) + "\n"
+
+def processus_actif(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class AgregateurMultiprocessus:
+    """
+    Agrégation des métriques des workers gunicorn via un dossier partagé.
+
+    Chaque worker écrit son instantané dans `<dossier>/<pid>.json` (remplacement atomique)
+    toutes les `intervalle` secondes et avant de répondre à /metrics ; la réponse additionne
+    les fichiers de tous les workers. Les compteurs et histogrammes des workers arrêtés sont
+    conservés (les totaux ne reculent pas), leurs jauges sont ignorées. Le dossier est à vider
+    au démarrage du serveur.
+    """
+
+    def __init__(self, registre: Registre, dossier: Optional[str], intervalle: float = 5.0):
+        self.registre = registre
+        self.dossier = dossier
+        self.intervalle = intervalle
+        self._tache: Optional[asyncio.Task] = None
+
+    def _chemin(self, pid: int) -> str:
+        return os.path.join(self.dossier, f"{pid}.json")
+
+    def ecrire(self):
+        if not self.dossier:
+            return
+        os.makedirs(self.dossier, exist_ok=True)
+        chemin = self._chemin(os.getpid())
+        temporaire = f"{chemin}.tmp"
+        with open(temporaire, "w") as f:
+            json.dump(self.registre.instantane(), f)
+        os.replace(temporaire, chemin)
+
+    def collecter(self) -> Dict[str, Any]:
+        """Instantané de ce processus, ou de tous les workers si un dossier partagé est configuré."""
+        if not self.dossier:
+            return fusionner([self.registre.instantane()])
+        self.ecrire()
+        instantanes = []
+        for chemin in glob.glob(os.path.join(self.dossier, "*.json")):
+            try:
+                with open(chemin) as f:
+                    instantane = json.load(f)
+                pid = int(os.path.basename(chemin).split(".")[0])
+            except (OSError, ValueError):
+                continue # Fichier en cours de remplacement ou étranger
+            if pid != os.getpid() and not processus_actif(pid):
+                instantane = {nom: m for nom, m in instantane.items() if m["type"] != "gauge"}
+            instantanes.append(instantane)
+        return fusionner(instantanes)
+
+    async def demarrer(self):
+        if self.dossier and self.intervalle > 0:
+            self._tache = asyncio.create_task(self._boucle())
+
+    async def arreter(self):
+        if self._tache is not None:
+            self._tache.cancel()
+            await asyncio.gather(self._tache, return_exceptions=True)
+            self._tache = None
+        if self.dossier:
+            await asyncio.to_thread(self.ecrire) # Derniers compteurs de ce worker
+
+    async def _boucle(self):
+        while True:
+            await asyncio.sleep(self.intervalle)
+            try:
+                await asyncio.to_thread(self.ecrire)
+            except OSError:
+                pass # Dossier indisponible : réessayé au prochain cycle
+
+class MiddlewareMetriques:
+    """
+    Middleware ASGI : durée de chaque requête HTTP par méthode, modèle de route
+    (« /track/{vehicle_id} », pas l'URL réelle) et classe de statut.
+    """
+
+    def __init__(self, app, histogramme: Histogramme):
+        self.app = app
+        self.histogramme = histogramme
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        debut = time.perf_counter()
+        statut = [500]
+
+        async def envoyer(message):
+            if message["type"] == "http.response.start":
+                statut[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, envoyer)
+        finally:
+            route = scope.get("route")
+            # Routes inconnues regroupées : pas une série par URL scannée
+            modele = getattr(route, "path", None) or "inconnue"
+            self.histogramme.observer(time.perf_counter() - debut, scope["method"], modele, f"{statut[0] // 100}xx")
+
+def instrumenter_engine(engine, histogramme: Histogramme, erreurs: Compteur):
+    """Durée et nombre des requêtes SQL par type d'opération (SELECT, INSERT...), via les événements SQLAlchemy."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def avant(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("debuts_requetes", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def apres(conn, cursor, statement, parameters, context, executemany):
+        debut = conn.info["debuts_requetes"].pop()
+        histogramme.observer(time.perf_counter() - debut, _operation(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def erreur(contexte):
+        debuts = contexte.connection.info.get("debuts_requetes") if contexte.connection is not None else None
+        if debuts:
+            debuts.pop()
+        erreurs.inc(_operation(contexte.statement or ""))
+
+def _operation(statement: str) -> str:
+    mot = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return mot if mot in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "AUTRE"
@@ -0,0 +1,32 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+Curseur = Tuple[datetime, int] # (date de création, id) de la dernière ligne renvoyée
+
+def encoder_curseur(date: datetime, identifiant: int) -> str:
+    """Curseur opaque pour la page suivante (base64 URL, sans remplissage)."""
+    brut = json.dumps([date.isoformat(), identifiant], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(brut).decode().rstrip("=")
+
+def decoder_curseur(curseur: Optional[str]) -> Optional[Curseur]:
+    """Curseur reçu du client ; 400 s'il n'a pas été produit par encoder_curseur."""
+    if not curseur:
+        return None
+    try:
+        date, identifiant = json.loads(base64.urlsafe_b64decode(curseur + "=" * (-len(curseur) % 4)))
+        return datetime.fromisoformat(date), int(identifiant)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide.")
+
+def avant_curseur(colonne_date, colonne_id, curseur: Curseur) -> Any:
+    """
+    Condition « après la ligne du curseur » pour un parcours du plus récent au plus ancien.
+    Comparaison de couples (date, id) : l'index (filtre, date) est parcouru à partir du curseur
+    au lieu de sauter OFFSET lignes, et deux billets créés à la même date ne sont ni perdus ni répétés.
+    """
+    return tuple_(colonne_date, colonne_id) < tuple_(*curseur)
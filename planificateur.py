@@ -0,0 +1,168 @@
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from catalogue import JOURS_FR, normalize_text, parser_duree
+
+MINUTES_JOUR = 24 * 60
+MINUTES_SEMAINE = 7 * MINUTES_JOUR
+
+def parser_heure(heure: Optional[str]) -> Optional[int]:
+    """"08:00" -> minutes depuis minuit. None si absente ou illisible."""
+    try:
+        heures, minutes = (heure or "").strip().split(":")
+        valeur = int(heures) * 60 + int(minutes)
+    except ValueError:
+        return None
+    return valeur if 0 <= valeur < MINUTES_JOUR else None
+
+class Etiquette:
+    """Façon d'atteindre une ville : heure d'arrivée, prix cumulé, nombre de trajets et trajet précédent."""
+    __slots__ = ("arrivee", "prix", "etapes", "connexion", "parent")
+
+    def __init__(self, arrivee: int, prix: int, etapes: int, connexion: Optional[Tuple[int, int, int, int, int]], parent: Optional["Etiquette"]):
+        self.arrivee = arrivee
+        self.prix = prix
+        self.etapes = etapes
+        self.connexion = connexion
+        self.parent = parent
+
+    def domine(self, autre: "Etiquette") -> bool:
+        return self.arrivee <= autre.arrivee and self.prix <= autre.prix and self.etapes <= autre.etapes
+
+class ReseauTrajets:
+    """
+    Réseau des trajets compilé pour la recherche d'itinéraires avec correspondances.
+
+    Chaque trajet du catalogue devient une « connexion » par jour où il circule, sur une semaine
+    type (minutes depuis lundi 00:00), triées par heure de départ. Une recherche parcourt ces
+    connexions dans l'ordre à partir de l'heure demandée (Connection Scan Algorithm) en gardant
+    pour chaque ville les compromis non dominés (arrivée, prix, nombre de trajets) : la plus
+    rapide et la moins chère sortent du même parcours. Construit une fois par version du catalogue.
+    """
+
+    def __init__(self, trajets: Iterable[Dict[str, Any]]):
+        """
+        `trajets` : dictionnaires avec 'depart', 'destination', 'agence', 'heureDepart', 'dureeEstimee',
+        'prix_classique', 'prix_vip' et 'masque' (jours de circulation, bit 0 = lundi).
+        """
+        self.villes: List[str] = [] # Noms affichés, indexés par identifiant de ville
+        self.ids_villes: Dict[str, int] = {} # Nom normalisé -> identifiant
+        self.trajets: List[Dict[str, Any]] = []
+        connexions = []
+        for trajet in trajets:
+            heure, duree = parser_heure(trajet.get('heureDepart')), parser_duree(trajet.get('dureeEstimee'))
+            if heure is None or not duree:
+                continue # Horaire incomplet : trajet ignoré par le planificateur
+            origine, arrivee = self._ville(trajet['depart']), self._ville(trajet['destination'])
+            if origine == arrivee:
+                continue
+            indice = len(self.trajets)
+            self.trajets.append(trajet)
+            for jour in range(len(JOURS_FR)):
+                if trajet['masque'] & (1 << jour):
+                    depart = jour * MINUTES_JOUR + heure
+                    connexions.append((depart, depart + duree, origine, arrivee, indice))
+        connexions.sort()
+        self.connexions: List[Tuple[int, int, int, int, int]] = connexions
+        self._departs = [c[0] for c in connexions]
+
+    def _ville(self, nom: str) -> int:
+        cle = normalize_text(nom)
+        if cle not in self.ids_villes:
+            self.ids_villes[cle] = len(self.villes)
+            self.villes.append(nom.strip())
+        return self.ids_villes[cle]
+
+    def __len__(self) -> int:
+        return len(self.connexions)
+
+    def _parcourir(self, debut: int, fin: int) -> Iterable[Tuple[int, int, int, int, int]]:
+        """Connexions dont le départ (en minutes depuis le lundi de la semaine de `debut`) est dans [debut, fin]."""
+        decalage = (debut // MINUTES_SEMAINE) * MINUTES_SEMAINE
+        while decalage <= fin and self.connexions:
+            i = bisect_left(self._departs, max(0, debut - decalage))
+            while i < len(self.connexions):
+                depart, arrivee, origine, destination, trajet = self.connexions[i]
+                if depart + decalage > fin:
+                    return
+                yield depart + decalage, arrivee + decalage, origine, destination, trajet
+                i += 1
+            decalage += MINUTES_SEMAINE
+
+    def rechercher(
+        self,
+        depart: str,
+        destination: str,
+        date_voyage: date,
+        heure_min: int = 0,
+        classe: str = "classique",
+        max_trajets: int = 3,
+        correspondance_min: int = 30,
+        horizon_heures: int = 48,
+    ) -> List[Etiquette]:
+        """Itinéraires non dominés (arrivée, prix, nombre de trajets) vers la destination, non triés."""
+        origine, cible = self.ids_villes.get(normalize_text(depart)), self.ids_villes.get(normalize_text(destination))
+        if origine is None or cible is None or origine == cible:
+            return []
+        cle_prix = "prix_vip" if classe == "vip" else "prix_classique"
+        debut = date_voyage.weekday() * MINUTES_JOUR + heure_min
+        etiquettes: Dict[int, List[Etiquette]] = {origine: [Etiquette(debut, 0, 0, None, None)]}
+        for connexion in self._parcourir(debut, debut + horizon_heures * 60):
+            depart_c, arrivee_c, u, v, indice = connexion
+            a_u = etiquettes.get(u)
+            if not a_u or v == origine:
+                continue
+            prix = self.trajets[indice].get(cle_prix)
+            if prix is None:
+                continue
+            arrivees_cible = etiquettes.get(cible, ())
+            nouvelles = []
+            for etiquette in a_u:
+                if etiquette.etapes >= max_trajets:
+                    continue
+                # Temps de correspondance exigé sauf pour le premier trajet
+                if etiquette.arrivee + (correspondance_min if etiquette.etapes else 0) > depart_c:
+                    continue
+                candidate = Etiquette(arrivee_c, etiquette.prix + prix, etiquette.etapes + 1, connexion, etiquette)
+                # Inutile de poursuivre un chemin déjà battu par un itinéraire complet
+                if v != cible and any(e.arrivee <= candidate.arrivee and e.prix <= candidate.prix for e in arrivees_cible):
+                    continue
+                nouvelles.append(candidate)
+            for candidate in nouvelles:
+                a_v = etiquettes.setdefault(v, [])
+                if any(e.domine(candidate) for e in a_v):
+                    continue
+                a_v[:] = [e for e in a_v if not candidate.domine(e)]
+                a_v.append(candidate)
+        return list(etiquettes.get(cible, ()))
+
+    def decrire(self, etiquette: Etiquette, date_voyage: date) -> Dict[str, Any]:
+        """Itinéraire lisible : étapes avec dates et heures réelles, durée, prix et correspondances."""
+        lundi = datetime.combine(date_voyage, datetime.min.time()) - timedelta(days=date_voyage.weekday())
+        etapes = []
+        courante = etiquette
+        while courante.parent is not None:
+            depart_c, arrivee_c, u, v, indice = courante.connexion
+            trajet = self.trajets[indice]
+            etapes.append({
+                "agence": trajet.get('agence'),
+                "depart": self.villes[u],
+                "destination": self.villes[v],
+                "heureDepart": str(lundi + timedelta(minutes=depart_c)),
+                "heureArrivee": str(lundi + timedelta(minutes=arrivee_c)),
+                "dureeEstimee": trajet.get('dureeEstimee'),
+                "prix_classique": trajet.get('prix_classique'),
+                "prix_vip": trajet.get('prix_vip'),
+            })
+            courante = courante.parent
+            premier_depart = depart_c
+        etapes.reverse()
+        return {
+            "depart": etapes[0]["heureDepart"],
+            "arrivee": etapes[-1]["heureArrivee"],
+            "duree_minutes": etiquette.arrivee - premier_depart,
+            "prix_total": etiquette.prix,
+            "correspondances": len(etapes) - 1,
+            "etapes": etapes,
+        }
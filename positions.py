@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import Table, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+journal = logging.getLogger(__name__)
+
+class PositionVehicule:
+    """Dernière position connue d'un véhicule (enregistrement compact)."""
+    __slots__ = ("vehicle_id", "latitude", "longitude", "timestamp")
+
+    def __init__(self, vehicle_id: str, latitude: float, longitude: float, timestamp: datetime):
+        self.vehicle_id = vehicle_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+
+    def en_dict(self) -> Dict[str, object]:
+        return {
+            "vehicle_id": self.vehicle_id,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "timestamp": str(self.timestamp)
+        }
+
+class StorePositions:
+    """
+    Dernières positions des véhicules en mémoire, avec écriture différée (write-behind).
+
+    Les pings GPS ne touchent que la mémoire ; un flusher en tâche de fond écrit les
+    positions modifiées en base par lots (upsert), toutes les `intervalle` secondes ou
+    dès que `seuil` véhicules sont en attente, et une dernière fois à l'arrêt.
+    """
+
+    def __init__(self, engine, table: Table, intervalle: float = 2.0, seuil: int = 500):
+        self.engine = engine
+        self.table = table
+        self.intervalle = intervalle
+        self.seuil = seuil
+        self._positions: Dict[str, PositionVehicule] = {}
+        self._modifiees: Dict[str, PositionVehicule] = {}
+        self._reveil: Optional[asyncio.Event] = None
+        self._tache: Optional[asyncio.Task] = None
+        self._verrou: Optional[asyncio.Lock] = None
+        self.stats = {"pings": 0, "lots_ecrits": 0, "positions_ecrites": 0, "erreurs_ecriture": 0}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def obtenir(self, vehicle_id: str) -> Optional[PositionVehicule]:
+        return self._positions.get(vehicle_id)
+
+    def mettre_a_jour(self, vehicle_id: str, latitude: float, longitude: float, timestamp: Optional[datetime] = None) -> Optional[PositionVehicule]:
+        """
+        Enregistre la position en mémoire et la marque à écrire en base.
+        Retourne None si une position plus récente est déjà connue (point envoyé en retard).
+        """
+        position = PositionVehicule(vehicle_id, latitude, longitude, timestamp or datetime.utcnow())
+        actuelle = self._positions.get(vehicle_id)
+        if actuelle is not None and actuelle.timestamp > position.timestamp:
+            return None
+        self._positions[vehicle_id] = position
+        self._modifiees[vehicle_id] = position
+        self.stats["pings"] += 1
+        if self._reveil is not None and len(self._modifiees) >= self.seuil:
+            self._reveil.set()
+        return position
+
+    def enregistrer_distante(self, vehicle_id: str, latitude: float, longitude: float, timestamp: datetime):
+        """Position reçue d'un autre worker : mise à jour de la mémoire seulement (ce worker-là l'écrit en base)."""
+        actuelle = self._positions.get(vehicle_id)
+        if actuelle is None or actuelle.timestamp <= timestamp:
+            self._positions[vehicle_id] = PositionVehicule(vehicle_id, latitude, longitude, timestamp)
+
+    # --- Base de données (exécuté dans un thread) ---
+
+    def _charger(self) -> List[PositionVehicule]:
+        with self.engine.connect() as conn:
+            lignes = conn.execute(select(
+                self.table.c.vehicle_id, self.table.c.latitude, self.table.c.longitude, self.table.c.timestamp
+            )).all()
+        return [PositionVehicule(*ligne) for ligne in lignes]
+
+    def _ecrire(self, lot: List[PositionVehicule]):
+        valeurs = [
+            {"vehicle_id": p.vehicle_id, "latitude": p.latitude, "longitude": p.longitude, "timestamp": p.timestamp}
+            for p in lot
+        ]
+        dialecte = self.engine.dialect.name
+        with self.engine.begin() as conn:
+            if dialecte in ("sqlite", "postgresql"):
+                insert = sqlite.insert if dialecte == "sqlite" else postgresql.insert
+                requete = insert(self.table)
+                conn.execute(requete.on_conflict_do_update(
+                    index_elements=["vehicle_id"],
+                    set_={
+                        "latitude": requete.excluded.latitude,
+                        "longitude": requete.excluded.longitude,
+                        "timestamp": requete.excluded.timestamp,
+                    }
+                ), valeurs)
+            else:
+                # Autres bases : UPDATE puis INSERT des véhicules absents
+                for v in valeurs:
+                    resultat = conn.execute(
+                        update(self.table).where(self.table.c.vehicle_id == v["vehicle_id"])
+                        .values(latitude=v["latitude"], longitude=v["longitude"], timestamp=v["timestamp"])
+                    )
+                    if resultat.rowcount == 0:
+                        conn.execute(self.table.insert().values(**v))
+
+    # --- Cycle de vie ---
+
+    async def demarrer(self):
+        try:
+            for position in await asyncio.to_thread(self._charger):
+                self._positions.setdefault(position.vehicle_id, position)
+        except Exception as e:
+            journal.warning("Impossible de charger les positions des véhicules : %s", e)
+        self._reveil = asyncio.Event()
+        self._verrou = asyncio.Lock()
+        self._tache = asyncio.create_task(self._boucle())
+
+    async def arreter(self):
+        if self._tache is not None:
+            self._tache.cancel()
+            await asyncio.gather(self._tache, return_exceptions=True)
+            self._tache = None
+        # Dernière écriture des positions en attente avant l'arrêt
+        await self.vider()
+
+    async def _boucle(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._reveil.wait(), timeout=self.intervalle)
+            except asyncio.TimeoutError:
+                pass
+            self._reveil.clear()
+            await self.vider()
+
+    async def vider(self):
+        """Écrit en base toutes les positions modifiées depuis la dernière écriture."""
+        if not self._modifiees:
+            return
+        async with self._verrou or asyncio.Lock():
+            lot, self._modifiees = self._modifiees, {}
+            if not lot:
+                return
+            try:
+                await asyncio.to_thread(self._ecrire, list(lot.values()))
+                self.stats["lots_ecrits"] += 1
+                self.stats["positions_ecrites"] += len(lot)
+            except Exception as e:
+                self.stats["erreurs_ecriture"] += 1
+                journal.error("Erreur lors de l'écriture des positions des véhicules : %s", e)
+                # On remet le lot en attente, sans écraser une position plus récente
+                for vehicle_id, position in lot.items():
+                    self._modifiees.setdefault(vehicle_id, position)
@@ -0,0 +1,148 @@
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from catalogue import normalize_text
+
+def normaliser_requete(texte: str) -> str:
+    """normalize_text, plus les espaces multiples ramenés à un seul."""
+    return " ".join(normalize_text(texte).split())
+
+def trigrammes(texte: str) -> Set[str]:
+    # Les espaces de bord donnent du poids au début du mot (là où l'on se trompe le moins)
+    bord = f"  {texte} "
+    return {bord[i:i + 3] for i in range(len(bord) - 2)}
+
+def distance_edition(a: str, b: str, maximum: int) -> int:
+    """Distance de Levenshtein entre a et b, arrêtée dès qu'elle dépasse `maximum` (renvoie alors maximum + 1)."""
+    if abs(len(a) - len(b)) > maximum:
+        return maximum + 1
+    precedente = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        courante = [i]
+        for j, cb in enumerate(b, 1):
+            courante.append(min(precedente[j] + 1, courante[j - 1] + 1, precedente[j - 1] + (ca != cb)))
+        if min(courante) > maximum:
+            return maximum + 1
+        precedente = courante
+    return min(precedente[-1], maximum + 1)
+
+def tolerance(longueur: int) -> int:
+    """Nombre de fautes tolérées selon la longueur du nom (aucune en dessous de 4 lettres)."""
+    if longueur < 4:
+        return 0
+    return 1 if longueur < 8 else 2
+
+class IndexVilles:
+    """
+    Index des noms de villes du catalogue pour l'autocomplétion et la recherche approchée.
+
+    - tableau trié des noms normalisés et de leurs suffixes commençant à un mot : une recherche
+      par préfixe est une dichotomie (« centre » trouve « yaounde centre ») ;
+    - index de trigrammes : les fautes de frappe ne comparent la distance d'édition qu'aux
+      quelques noms qui partagent le plus de trigrammes avec la saisie.
+    Construit une fois par version du catalogue.
+    """
+
+    MAX_CANDIDATS = 20 # Noms comparés par distance d'édition pour une requête approchée
+
+    def __init__(self, noms: Iterable[str]):
+        self.popularite: Dict[str, int] = {} # Nombre d'apparitions dans le catalogue (départs + destinations)
+        self.affichage: Dict[str, str] = {} # Nom normalisé -> première orthographe rencontrée
+        for nom in noms:
+            cle = normaliser_requete(nom or "")
+            if not cle:
+                continue
+            self.popularite[cle] = self.popularite.get(cle, 0) + 1
+            self.affichage.setdefault(cle, nom.strip())
+        entrees = sorted(
+            (cle[i:], cle)
+            for cle in self.popularite
+            for i in range(len(cle))
+            if i == 0 or cle[i - 1] == " "
+        )
+        self._cles = [entree[0] for entree in entrees]
+        self._noms = [entree[1] for entree in entrees]
+        self._trigrammes: Dict[str, List[str]] = {}
+        for cle in self.popularite:
+            for trigramme in trigrammes(cle):
+                self._trigrammes.setdefault(trigramme, []).append(cle)
+
+    def __len__(self) -> int:
+        return len(self.popularite)
+
+    def _par_prefixe(self, requete: str, maximum: int) -> List[str]:
+        trouves: List[str] = []
+        i = bisect_left(self._cles, requete)
+        while i < len(self._cles) and self._cles[i].startswith(requete) and len(trouves) < maximum:
+            if self._noms[i] not in trouves:
+                trouves.append(self._noms[i])
+            i += 1
+        return trouves
+
+    def _candidats(self, requete: str) -> List[str]:
+        communs: Dict[str, int] = {}
+        for trigramme in trigrammes(requete):
+            for cle in self._trigrammes.get(trigramme, ()):
+                communs[cle] = communs.get(cle, 0) + 1
+        return sorted(communs, key=lambda cle: (-communs[cle], cle))[:self.MAX_CANDIDATS]
+
+    def suggerer(self, texte: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Villes correspondant à une saisie partielle : préfixes d'abord, puis noms proches (fautes de frappe)."""
+        requete = normaliser_requete(texte)
+        if not requete:
+            return []
+        suggestions = []
+        prefixes = self._par_prefixe(requete, maximum=limit * 4)
+        # Début du nom avant début d'un mot intérieur, puis les villes les plus desservies
+        prefixes.sort(key=lambda cle: (not cle.startswith(requete), -self.popularite[cle], cle))
+        for cle in prefixes[:limit]:
+            suggestions.append({"ville": self.affichage[cle], "correspondance": "prefixe", "distance": 0})
+        maximum = tolerance(len(requete))
+        if len(suggestions) < limit and maximum:
+            deja = set(prefixes)
+            approchees = []
+            for cle in self._candidats(requete):
+                if cle in deja:
+                    continue
+                # Saisie partielle : on compare aussi au début du nom de même longueur
+                distance = min(distance_edition(requete, cle, maximum), distance_edition(requete, cle[:len(requete)], maximum))
+                if distance <= maximum:
+                    approchees.append((distance, -self.popularite[cle], cle))
+            for distance, _, cle in sorted(approchees)[:limit - len(suggestions)]:
+                suggestions.append({"ville": self.affichage[cle], "correspondance": "approchee", "distance": distance})
+        if not suggestions:
+            # Saisie complète avec des mots en trop (« Gare de Douala »)
+            cle = self.resoudre(requete)
+            if cle is not None:
+                suggestions.append({"ville": self.affichage[cle], "correspondance": "approchee", "distance": None})
+        return suggestions
+
+    def resoudre(self, texte: str) -> Optional[str]:
+        """
+        Nom normalisé de la ville du catalogue désignée par une saisie libre, ou None.
+        Accepte les fautes de frappe (« Bafousam ») et les mots en trop (« Yaoundé Centre »).
+        """
+        requete = normaliser_requete(texte)
+        if not requete:
+            return None
+        if requete in self.popularite:
+            return requete
+        prefixes = [cle for cle in self._par_prefixe(requete, maximum=5) if cle.startswith(requete)]
+        if len(requete) >= 3 and len(prefixes) == 1:
+            return prefixes[0] # Début de nom sans ambiguïté (« Yaoun »)
+        mots = requete.split(" ")
+        meilleur = None
+        for cle in self._candidats(requete):
+            maximum = tolerance(len(cle))
+            # Suites de mots consécutives de la saisie, comparées au nom entier
+            for debut in range(len(mots)):
+                for fin in range(debut + 1, len(mots) + 1):
+                    morceau = " ".join(mots[debut:fin])
+                    if len(morceau) > len(cle) + maximum:
+                        break
+                    distance = distance_edition(morceau, cle, maximum)
+                    if distance <= maximum:
+                        rang = (distance, len(mots) - (fin - debut), -self.popularite[cle], cle)
+                        if meilleur is None or rang < meilleur:
+                            meilleur = rang
+        return meilleur[3] if meilleur else None
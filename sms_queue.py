@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Field, Session, SQLModel, select
+
+journal = logging.getLogger(__name__)
+
+class SmsOutbox(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    notchpay_reference: str = Field(index=True, unique=True) # Un seul SMS par paiement (déduplication)
+    to_number: str
+    body: str
+    status: str = Field(default="pending", index=True) # pending, sending, sent, failed
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+
+class ErreurSmsDefinitive(Exception):
+    """Erreur d'envoi qu'une nouvelle tentative ne corrigera pas (configuration, numéro invalide...)."""
+
+class LimiteurDebit:
+    """Seau à jetons : au plus `debit` envois par seconde, avec une rafale de `rafale` envois."""
+
+    def __init__(self, debit: float, rafale: int = 1):
+        self.debit = debit
+        self.rafale = rafale
+        self._jetons = float(rafale)
+        self._dernier = time.monotonic()
+        self._verrou = asyncio.Lock()
+
+    async def acquerir(self):
+        async with self._verrou:
+            while True:
+                maintenant = time.monotonic()
+                self._jetons = min(self.rafale, self._jetons + (maintenant - self._dernier) * self.debit)
+                self._dernier = maintenant
+                if self._jetons >= 1:
+                    self._jetons -= 1
+                    return
+                await asyncio.sleep((1 - self._jetons) / self.debit)
+
+class FileSMS:
+    """
+    File d'envoi des SMS : table SmsOutbox persistée + pool de workers asynchrones.
+
+    Le webhook enregistre le SMS et rend la main immédiatement. Chaque envoi est
+    "réclamé" par un UPDATE conditionnel, si bien que plusieurs workers gunicorn
+    peuvent balayer la même table sans envoyer deux fois le même message.
+    """
+
+    def __init__(
+        self,
+        engine,
+        envoyer: Callable[[str, str], Awaitable[Any]],
+        concurrence: int = 4,
+        debit_par_seconde: float = 1.0,
+        max_tentatives: int = 5,
+        backoff_initial: float = 5.0,
+        intervalle_balayage: float = 15.0,
+    ):
+        self.engine = engine
+        self.envoyer = envoyer
+        self.concurrence = concurrence
+        self.limiteur = LimiteurDebit(debit_par_seconde, rafale=max(1, concurrence))
+        self.max_tentatives = max_tentatives
+        self.backoff_initial = backoff_initial
+        self.intervalle_balayage = intervalle_balayage
+        self._file: Optional[asyncio.Queue] = None
+        self._en_file: Set[int] = set() # Évite de mettre deux fois le même SMS dans la file
+        self._taches: List[asyncio.Task] = []
+        self.stats: Dict[str, Any] = {
+            "ajoutes": 0,
+            "doublons": 0,
+            "envoyes": 0,
+            "echecs_definitifs": 0,
+            "nouvelles_tentatives": 0,
+            "latence_envoi_totale_s": 0.0,
+            "latence_envoi_max_s": 0.0,
+        }
+
+    # --- Accès base de données (exécutés dans un thread) ---
+
+    def _inserer(self, reference: str, to_number: str, body: str) -> Optional[int]:
+        with Session(self.engine) as session:
+            sms = SmsOutbox(notchpay_reference=reference, to_number=to_number, body=body)
+            session.add(sms)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Webhook rejoué : le SMS de ce paiement est déjà dans la file
+                session.rollback()
+                return None
+            return sms.id
+
+    def inserer_en_session(self, session: Session, reference: str, to_number: str, body: str) -> Optional[int]:
+        """
+        Ajoute le SMS à la transaction de l'appelant (sans commit), pour qu'il soit enregistré
+        avec le changement qui le motive. Retourne son id, ou None s'il existe déjà pour cette
+        référence. Après le commit : signaler_ajout(id).
+        """
+        if session.exec(select(SmsOutbox.id).where(SmsOutbox.notchpay_reference == reference)).first() is not None:
+            return None
+        sms = SmsOutbox(notchpay_reference=reference, to_number=to_number, body=body)
+        session.add(sms)
+        session.flush() # Attribue l'id
+        return sms.id
+
+    def _reclamer(self, sms_id: int) -> Optional[SmsOutbox]:
+        """Passe le SMS en 'sending' si personne ne l'a déjà pris ; retourne None sinon."""
+        with Session(self.engine) as session:
+            maintenant = datetime.utcnow()
+            resultat = session.execute(
+                update(SmsOutbox)
+                .where(SmsOutbox.id == sms_id, SmsOutbox.status == "pending", SmsOutbox.next_attempt_at <= maintenant)
+                .values(status="sending", updated_at=maintenant)
+            )
+            session.commit()
+            if resultat.rowcount != 1:
+                return None
+            return session.get(SmsOutbox, sms_id)
+
+    def _terminer(self, sms_id: int, **valeurs):
+        with Session(self.engine) as session:
+            valeurs["updated_at"] = datetime.utcnow()
+            session.execute(update(SmsOutbox).where(SmsOutbox.id == sms_id).values(**valeurs))
+            session.commit()
+
+    def _a_envoyer(self) -> List[int]:
+        """Identifiants des SMS en attente et dus, y compris ceux bloqués en 'sending' après un arrêt brutal."""
+        with Session(self.engine) as session:
+            maintenant = datetime.utcnow()
+            session.execute(
+                update(SmsOutbox)
+                .where(SmsOutbox.status == "sending", SmsOutbox.updated_at < maintenant - timedelta(minutes=5))
+                .values(status="pending", updated_at=maintenant)
+            )
+            session.commit()
+            return list(session.exec(
+                select(SmsOutbox.id)
+                .where(SmsOutbox.status == "pending", SmsOutbox.next_attempt_at <= maintenant)
+                .order_by(SmsOutbox.next_attempt_at)
+                .limit(1000)
+            ))
+
+    def _nombre_en_attente(self) -> int:
+        with Session(self.engine) as session:
+            return session.exec(select(func.count()).select_from(SmsOutbox).where(SmsOutbox.status.in_(("pending", "sending")))).one()
+
+    # --- Cycle de vie ---
+
+    async def demarrer(self):
+        self._file = asyncio.Queue()
+        self._taches = [asyncio.create_task(self._worker()) for _ in range(self.concurrence)]
+        self._taches.append(asyncio.create_task(self._balayer()))
+
+    async def arreter(self):
+        for tache in self._taches:
+            tache.cancel()
+        await asyncio.gather(*self._taches, return_exceptions=True)
+        self._taches = []
+
+    async def ajouter(self, reference: str, to_number: str, body: str) -> bool:
+        """Enregistre un SMS à envoyer. Retourne False si un SMS existe déjà pour cette référence."""
+        sms_id = await asyncio.to_thread(self._inserer, reference, to_number, body)
+        return self.signaler_ajout(sms_id)
+
+    def signaler_ajout(self, sms_id: Optional[int]) -> bool:
+        """Met en file d'envoi un SMS enregistré (id), ou compte un doublon (None)."""
+        if sms_id is None:
+            self.stats["doublons"] += 1
+            return False
+        self.stats["ajoutes"] += 1
+        self._mettre_en_file(sms_id)
+        return True
+
+    def _mettre_en_file(self, sms_id: int):
+        if self._file is not None and sms_id not in self._en_file:
+            self._en_file.add(sms_id)
+            self._file.put_nowait(sms_id)
+
+    async def _balayer(self):
+        # Reprend les SMS laissés en attente (redémarrage, autre worker, nouvelles tentatives)
+        while True:
+            try:
+                for sms_id in await asyncio.to_thread(self._a_envoyer):
+                    self._mettre_en_file(sms_id)
+            except Exception as e:
+                journal.error("Erreur lors du balayage de la file SMS : %s", e)
+            await asyncio.sleep(self.intervalle_balayage)
+
+    async def _worker(self):
+        while True:
+            sms_id = await self._file.get()
+            self._en_file.discard(sms_id)
+            try:
+                await self._traiter(sms_id)
+            except Exception as e:
+                journal.exception("Erreur inattendue dans la file SMS", extra={"sms_id": sms_id})
+            finally:
+                self._file.task_done()
+
+    async def _traiter(self, sms_id: int):
+        sms = await asyncio.to_thread(self._reclamer, sms_id)
+        if sms is None:
+            return # Déjà envoyé, pris par un autre worker ou pas encore dû
+        await self.limiteur.acquerir()
+        debut = time.perf_counter()
+        try:
+            await self.envoyer(sms.to_number, sms.body)
+        except Exception as e:
+            tentatives = sms.attempts + 1
+            if isinstance(e, ErreurSmsDefinitive) or tentatives >= self.max_tentatives:
+                self.stats["echecs_definitifs"] += 1
+                await asyncio.to_thread(self._terminer, sms_id, status="failed", attempts=tentatives, last_error=str(e)[:500])
+                journal.error("Échec définitif du SMS : %s", e, extra={"sms_id": sms_id, "reference": sms.notchpay_reference})
+                return
+            delai = self.backoff_initial * (2 ** (tentatives - 1))
+            self.stats["nouvelles_tentatives"] += 1
+            await asyncio.to_thread(
+                self._terminer, sms_id,
+                status="pending", attempts=tentatives, last_error=str(e)[:500],
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=delai)
+            )
+            # Petite marge pour que next_attempt_at soit bien échu au moment de la réclamation
+            asyncio.get_running_loop().call_later(delai + 0.5, self._mettre_en_file, sms_id)
+            return
+        duree = time.perf_counter() - debut
+        self.stats["envoyes"] += 1
+        self.stats["latence_envoi_totale_s"] += duree
+        self.stats["latence_envoi_max_s"] = max(self.stats["latence_envoi_max_s"], duree)
+        await asyncio.to_thread(self._terminer, sms_id, status="sent", attempts=sms.attempts + 1, sent_at=datetime.utcnow(), last_error=None)
+
+    async def statistiques(self) -> Dict[str, Any]:
+        """Compteurs de la file : profondeur (mémoire et base), envois, échecs et latence d'envoi."""
+        stats = dict(self.stats)
+        stats["profondeur_file"] = self._file.qsize() if self._file is not None else 0
+        stats["en_attente_base"] = await asyncio.to_thread(self._nombre_en_attente)
+        stats["latence_envoi_moyenne_ms"] = round(1000 * stats["latence_envoi_totale_s"] / stats["envoyes"], 2) if stats["envoyes"] else 0.0
+        return stats
@@ -1,21 +1,45 @@
-from fastapi import FastAPI, HTTPException, Query, Request, Depends, status, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import googlemaps
+from fastapi import FastAPI, HTTPException, Header, Path, Query, Request, Depends, status, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, TypeAdapter, ValidationError, field_validator
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import csv
+import hmac
+import io
 import json
+import logging
 import re
-import unicodedata
 from math import radians, sin, cos, sqrt, atan2
 import os
 from dotenv import load_dotenv
-import requests
-from sqlmodel import Field, Session, SQLModel, create_engine, select
+import httpx
+from sqlmodel import Field, Session, SQLModel, select
+from sqlalchemy import Index, UniqueConstraint, event, update
+from sqlalchemy.orm import Session as SessionORM, object_session
+from sqlalchemy.exc import IntegrityError
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from twilio.rest import Client # Import Twilio Client
 from googlemaps.convert import decode_polyline
+from catalogue import normalize_text, bit_jour, parser_duree
+from planificateur import parser_heure
+from gestion_catalogue import GestionnaireCatalogue, ErreurCatalogue, lire_agences
+from catalogue_db import Agence, Trajet, ImportCatalogue, CatalogueSQL, importer_agences # noqa: F401 - Agence, Trajet et ImportCatalogue enregistrent leurs tables
+from base_donnees import creer_engine, en_session, sauvegarder
+from journalisation import configurer_journalisation
+from metriques import BORNES_SQL, AgregateurMultiprocessus, MiddlewareMetriques, Registre, chronometre, exposer, instrumenter_engine
+from directions_cache import CacheDirections
+from clients_http import ClientsHTTP, ConfigService
+from sms_queue import FileSMS, ErreurSmsDefinitive
+from inventaire import Inventaire, PlacesDepart, Reservation, cle_depart # noqa: F401 - PlacesDepart et Reservation enregistrent leurs tables
+from positions import StorePositions
+from diffusion import PREFIXE_CONTROLE, ConnectionManager, creer_bus
+from historique import HistoriquePositions, vers_utc_naif
+from eta import MoteurETA
+from auth_cache import CacheAuth
+from cache_reponses import CacheReponses, quantifier
+from pagination import avant_curseur, decoder_curseur, encoder_curseur
+from hachage import PoolHachage, PoolSature
 
 # New imports for authentication
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 
@@ -24,14 +48,6 @@ SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key") # CHANGE THIS IN PRODUC
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -71,43 +87,49 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, vehicle_id: str):
-        await websocket.accept()
-        self.active_connections[vehicle_id] = websocket
-
-    def disconnect(self, vehicle_id: str):
-        del self.active_connections[vehicle_id]
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+# --- CONFIGURATION ---
+load_dotenv() # Charge les variables depuis le fichier .env
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections.values():
-            await connection.send_text(message)
+# Journal structuré : LOG_LEVEL (DEBUG, INFO...) et LOG_FORMAT (texte ou json)
+configurer_journalisation(os.getenv("LOG_LEVEL", "INFO"), os.getenv("LOG_FORMAT", "texte"))
+journal = logging.getLogger("voyage")
+
+# Hub WebSocket : un sujet par véhicule, file d'envoi bornée par client.
+# Avec plusieurs workers gunicorn, le bus 'sqlite' relaie les positions entre processus.
+# Créé après load_dotenv() : les réglages peuvent venir du fichier .env.
+manager = ConnectionManager(
+    taille_file=int(os.getenv("WS_SEND_QUEUE_SIZE", "32")),
+    politique=os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest"), # drop_oldest ou disconnect
+    bus=creer_bus(os.getenv("BROADCAST_BACKEND", "memory"), os.getenv("BROADCAST_SQLITE_PATH", "./broadcast_bus.db"))
+)
 
-manager = ConnectionManager()
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12")) # Coût bcrypt : les hachages existants sont mis à jour à la connexion
 
-# --- CONFIGURATION ---
-load_dotenv() # Charge les variables depuis le fichier .env
+# Calculs bcrypt dans des processus dédiés, hors de la boucle et du threadpool du serveur
+pool_hachage = PoolHachage(
+    processus=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    file_max=int(os.getenv("PASSWORD_HASH_QUEUE", "32")),
+    rounds=BCRYPT_ROUNDS,
+)
 
 # Clé API Google Maps (optionnelle)
 API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "VOTRE_CLE_API_ICI")
 
-# Initialisation de Google Maps (si la clé API est fournie)
-if API_KEY != "VOTRE_CLE_API_ICI" and API_KEY != "":
-    gmaps = googlemaps.Client(key=API_KEY)
-else:
-    gmaps = None
-    print("Avertissement: Clé API Google Maps non configurée. Certaines fonctionnalités seront limitées.")
+GOOGLE_MAPS_DIRECTIONS_URL = os.getenv("GOOGLE_MAPS_DIRECTIONS_URL", "https://maps.googleapis.com/maps/api/directions/json")
+
+# Google Maps est utilisé seulement si la clé API est fournie
+gmaps_configure = API_KEY != "VOTRE_CLE_API_ICI" and API_KEY != ""
+if not gmaps_configure:
+    journal.warning("Clé API Google Maps non configurée. Certaines fonctionnalités seront limitées.")
+
+# Cache des itinéraires Google Maps : mémoire (par worker) + SQLite partagé entre les workers gunicorn
+DIRECTIONS_CACHE_PATH = os.getenv("DIRECTIONS_CACHE_PATH", "./directions_cache.db") # Vide = pas de niveau disque
+DIRECTIONS_CACHE_TTL = int(os.getenv("DIRECTIONS_CACHE_TTL", str(7 * 24 * 3600))) # 7 jours par défaut
+cache_directions = CacheDirections(DIRECTIONS_CACHE_PATH or None, ttl_secondes=DIRECTIONS_CACHE_TTL)
 
 # Clé API Notch Pay (requise pour le paiement)
 NOTCH_PAY_PUBLIC_KEY = os.getenv("NOTCH_PAY_PUBLIC_KEY")
-# print(f"DEBUG: NOTCH_PAY_PUBLIC_KEY lue: {NOTCH_PAY_PUBLIC_KEY}") # Ligne de débogage temporaire
-NOTCH_PAY_API_URL = "https://api.notchpay.co/payments" # Endpoint corrigé
+NOTCH_PAY_API_URL = os.getenv("NOTCH_PAY_API_URL", "https://api.notchpay.co/payments") # Endpoint corrigé
 
 # URL publique de notre serveur (à configurer pour le déploiement)
 # Pour les tests locaux, on utilisera un outil comme ngrok
@@ -115,41 +137,85 @@ APP_BASE_URL = os.getenv("APP_BASE_URL", "http://127.0.0.1:8000")
 
 # Configuration de la base de données SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db") # Utilise PostgreSQL en prod, SQLite en dev
-engine = create_engine(DATABASE_URL, echo=True)
+engine = creer_engine(DATABASE_URL) # Profil DB_PROFILE (pool, WAL SQLite) ; journal SQL seulement avec DB_ECHO=1
+
+# --- MÉTRIQUES (GET /metrics, format Prometheus) ---
+registre_metriques = Registre()
+DUREE_REQUETES = registre_metriques.histogramme("voyage_http_requete_duree_secondes", "Durée des requêtes HTTP par route.", ("methode", "route", "statut"))
+DUREE_APPELS_SORTANTS = registre_metriques.histogramme("voyage_appel_sortant_duree_secondes", "Durée des appels aux services externes.", ("operation",))
+ERREURS_APPELS_SORTANTS = registre_metriques.compteur("voyage_appel_sortant_erreurs_total", "Appels aux services externes en échec.", ("operation",))
+DUREE_SQL = registre_metriques.histogramme("voyage_sql_requete_duree_secondes", "Durée des requêtes SQL par opération.", ("operation",), bornes=BORNES_SQL)
+ERREURS_SQL = registre_metriques.compteur("voyage_sql_erreurs_total", "Requêtes SQL en erreur par opération.", ("operation",))
+instrumenter_engine(engine, DUREE_SQL, ERREURS_SQL)
+registre_metriques.jauge("voyage_ws_connexions", "Connexions WebSocket de suivi ouvertes.", fonction=lambda: manager.nombre_connexions)
+registre_metriques.jauge("voyage_ws_vehicules_suivis", "Véhicules ayant au moins un abonné WebSocket.", fonction=lambda: len(manager.sujets))
+registre_metriques.jauge(
+    "voyage_ws_abonnes_max_par_vehicule", "Plus grand nombre d'abonnés d'un même véhicule (diffusion la plus large).",
+    fonction=lambda: max((len(abonnes) for abonnes in manager.sujets.values()), default=0),
+)
+for _nom in ("messages_publies", "messages_recus_bus", "messages_livres", "clients_lents_deconnectes"):
+    registre_metriques.compteur(f"voyage_ws_{_nom}_total", f"Compteur '{_nom}' du hub WebSocket.", fonction=lambda nom=_nom: manager.stats[nom])
+# Avec plusieurs workers gunicorn : METRICS_DIR partagé (vidé au démarrage du serveur), /metrics additionne tous les workers
+agregateur_metriques = AgregateurMultiprocessus(registre_metriques, os.getenv("METRICS_DIR") or None)
 
 # Configuration Twilio
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 TEST_SMS_RECIPIENT_NUMBER = os.getenv("TEST_SMS_RECIPIENT_NUMBER") # Nouveau: pour les tests
-
-try:
-    twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-except Exception as e:
-    print(f"Avertissement: Impossible d'initialiser le client Twilio. Vérifiez les variables d'environnement: {e}")
-    twilio_client = None
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL", "https://api.twilio.com")
+
+if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
+    journal.warning("Identifiants Twilio manquants. Vérifiez les variables d'environnement.")
+
+# Clients HTTP sortants (pool keep-alive par service, délais et nouvelles tentatives propres à chacun)
+clients_http = ClientsHTTP({
+    "notchpay": ConfigService(
+        timeout_connexion=5.0,
+        timeout_lecture=float(os.getenv("NOTCH_PAY_TIMEOUT", "15")),
+    ),
+    "google_maps": ConfigService(
+        timeout_connexion=3.0,
+        timeout_lecture=float(os.getenv("GOOGLE_MAPS_TIMEOUT", "5")),
+    ),
+    "twilio": ConfigService(
+        timeout_connexion=5.0,
+        timeout_lecture=float(os.getenv("TWILIO_TIMEOUT", "10")),
+    ),
+})
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Code à exécuter au démarrage
-    global agences_data
-    try:
-        with open("agences.json", "r", encoding="utf-8") as f:
-            agences_data = json.load(f)
-        print("Données des agences chargées avec succès.")
-    except FileNotFoundError:
-        print("Erreur: Le fichier agences.json est introuvable.")
-    except json.JSONDecodeError:
-        print("Erreur: Impossible de décoder le fichier agences.json.")
+    if CATALOGUE_BACKEND == "json":
+        await catalogue_agences.demarrer()
+    await clients_http.demarrer()
+    await file_sms.demarrer()
+    await inventaire.demarrer()
+    await store_positions.demarrer()
+    await historique_positions.demarrer()
+    await manager.demarrer()
+    await pool_hachage.demarrer()
+    await agregateur_metriques.demarrer()
     
     yield
     
     # Code à exécuter à l'arrêt (si nécessaire)
-    print("Application arrêtée.")
+    await agregateur_metriques.arreter()
+    await pool_hachage.arreter()
+    await catalogue_agences.arreter()
+    await manager.arreter()
+    await store_positions.arreter() # Écrit en base les dernières positions en attente
+    await historique_positions.arreter()
+    await inventaire.arreter()
+    await file_sms.arreter()
+    await clients_http.fermer()
+    journal.info("Application arrêtée.")
 
 app = FastAPI(
     title="API de Voyage avec Paiement et Gestion de Billets",
@@ -173,23 +239,70 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MiddlewareMetriques, histogramme=DUREE_REQUETES)
+
+# Catalogue des agences : 'json' (agences.json indexé en mémoire, rechargé à chaud quand le fichier change)
+# ou 'sql' (tables Agence et Trajet, importées avec `python catalogue_db.py agences.json`)
+CATALOGUE_BACKEND = os.getenv("CATALOGUE_BACKEND", "json")
+AGENCES_PATH = os.getenv("AGENCES_PATH", "agences.json")
+catalogue_agences = GestionnaireCatalogue(AGENCES_PATH, intervalle=float(os.getenv("CATALOGUE_WATCH_INTERVAL", "5")))
+catalogue_sql = CatalogueSQL(engine)
+
+def catalogue_courant():
+    """Catalogue à utiliser pour toute la durée d'une requête (SnapshotCatalogue ou CatalogueSQL)."""
+    return catalogue_sql if CATALOGUE_BACKEND == "sql" else catalogue_agences.snapshot
+
+async def lire_catalogue(fonction, *args):
+    """
+    Appel depuis une route async d'une fonction qui lit le catalogue. Catalogue SQL : requêtes
+    bloquantes, exécutées dans un thread ; catalogue en mémoire : appel direct, sans thread.
+    """
+    if CATALOGUE_BACKEND == "sql":
+        return await asyncio.to_thread(fonction, *args)
+    return fonction(*args)
+
+# Réponses des routes dérivées du catalogue : clé = version du catalogue + paramètres normalisés,
+# corps pré-sérialisés et compressés, ETag et 304 pour les clients qui revalident
+cache_reponses = CacheReponses(
+    max_entrees=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+    max_octets=int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+    max_age=int(os.getenv("RESPONSE_CACHE_MAX_AGE", "60")), # Cache-Control: max-age envoyé aux clients
+)
+PAS_GRILLE_PROXIMITE = float(os.getenv("PROXIMITY_GRID_DEG", "0.01")) # ~1,1 km : les voisins partagent une entrée (0 = coordonnées exactes)
+for _nom in ("hits", "misses", "non_modifies"):
+    registre_metriques.compteur(f"voyage_cache_reponses_{_nom}_total", f"Compteur '{_nom}' du cache des réponses.", fonction=lambda nom=_nom: cache_reponses.stats[nom])
 
-agences_data: List[Dict[str, Any]] = [] # Déclaration de la variable globale
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "") # Clé des routes d'administration (désactivées si vide)
+SUJET_CATALOGUE = "_catalogue" # Sujet du bus : rechargement demandé dans un autre worker
 
 # --- MODÈLES DE DONNÉES ---
 
 class Ticket(SQLModel, table=True):
+    # Listes des billets (GET /billets) : un filtre puis un parcours par date de création, sans tri en mémoire
+    __table_args__ = (
+        Index("ix_ticket_status_created_at", "status", "created_at"),
+        Index("ix_ticket_email_created_at", "email", "created_at"),
+        Index("ix_ticket_phone_created_at", "phone", "created_at"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
-    notchpay_reference: str = Field(index=True) # Référence de la transaction Notch Pay
+    notchpay_reference: str = Field(index=True, unique=True) # Référence de la transaction Notch Pay
     status: str = Field(default="pending") # pending, completed, failed, cancelled
     amount: int
     currency: str = "XAF"
     email: str
     phone: str
     description: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True) # Exports par période, sans autre filtre
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class WebhookEvent(SQLModel, table=True):
+    # Journal append-only des notifications Notch Pay : une ligne par couple (référence, statut)
+    __table_args__ = (UniqueConstraint("notchpay_reference", "status"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    notchpay_reference: str = Field(index=True)
+    status: str
+    received_at: datetime = Field(default_factory=datetime.utcnow)
+
 class VehicleLocation(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     vehicle_id: str = Field(index=True, unique=True) # ID unique du véhicule (ex: numéro de bus)
@@ -203,19 +316,44 @@ class PaiementRequest(BaseModel):
     amount: int
     description: str
     customer_name: Optional[str] = "Client Test" # Ajout d'un nom client optionnel
+    # Départ réservé (facultatif) : des places sont retenues pendant le paiement
+    depart: Optional[str] = None
+    destination: Optional[str] = None
+    date_voyage: Optional[str] = None # YYYY-MM-DD
+    agence: Optional[str] = None # Nom de l'agence si plusieurs desservent la ligne
+    heure_depart: Optional[str] = None # "08:00" si l'agence a plusieurs départs dans la journée
+    classe: str = "classique" # classique ou vip
+    places: int = 1
+
+class PointGPS(BaseModel):
+    latitude: float
+    longitude: float
+
+class ProximiteBatchRequest(BaseModel):
+    points: List[PointGPS]
+    limit: int = 5 # Nombre d'agences par point
+    radius_km: Optional[float] = None
 
 class VehicleLocationUpdate(BaseModel):
     vehicle_id: str
     latitude: float
     longitude: float
+    timestamp: Optional[datetime] = None # Heure du point GPS (traceurs qui envoient en différé), défaut : réception
 
-# --- FONCTIONS UTILITAIRES ---
+    @field_validator("vehicle_id")
+    @classmethod
+    def verifier_vehicle_id(cls, vehicle_id: str) -> str:
+        # Préfixe réservé aux sujets de contrôle du bus de diffusion
+        if vehicle_id.startswith(PREFIXE_CONTROLE):
+            raise ValueError(f"L'identifiant du véhicule ne peut pas commencer par {PREFIXE_CONTROLE!r}.")
+        return vehicle_id
+
+class AffectationTrajet(BaseModel):
+    depart: str
+    destination: str
+    agence: Optional[str] = None # Nom de l'agence si plusieurs desservent la ligne
 
-def normalize_text(text: str) -> str:
-    """Normalise le texte en minuscules, sans accents et sans espaces superflus."""
-    s = ''.join(c for c in unicodedata.normalize('NFD', text)
-                if unicodedata.category(c) != 'Mn')
-    return s.lower().strip() # Ajout de strip() pour enlever les espaces
+# --- FONCTIONS UTILITAIRES ---
 
 def calculer_distance(lat1, lon1, lat2, lon2) -> float:
     """Calcule la distance en km entre deux points GPS (formule Haversine)."""
@@ -236,20 +374,56 @@ def get_session():
     with Session(engine) as session:
         yield session
 
-def send_sms(to_number: str, message_body: str):
-    """Envoie un SMS via Twilio."""
-    if not twilio_client or not TWILIO_PHONE_NUMBER:
-        print("Erreur: Client Twilio non initialisé ou numéro Twilio manquant.")
-        return
-    try:
-        message = twilio_client.messages.create(
-            to=to_number,
-            from_=TWILIO_PHONE_NUMBER,
-            body=message_body
+async def send_sms(to_number: str, message_body: str) -> str:
+    """Envoie un SMS via l'API REST Twilio et retourne son SID. Lève une exception en cas d'échec."""
+    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
+        raise ErreurSmsDefinitive("Client Twilio non initialisé ou numéro Twilio manquant.")
+    with chronometre(DUREE_APPELS_SORTANTS, "twilio.messages.create", erreurs=ERREURS_APPELS_SORTANTS):
+        response = await clients_http.requete(
+            "twilio", "POST",
+            f"{TWILIO_API_BASE_URL}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json",
+            auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+            data={"To": to_number, "From": TWILIO_PHONE_NUMBER, "Body": message_body}
         )
-        print(f"SMS envoyé à {to_number}. SID: {message.sid}")
-    except Exception as e:
-        print(f"Erreur lors de l'envoi du SMS à {to_number}: {e}")
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            # Numéro invalide, identifiants refusés... : inutile de réessayer
+            raise ErreurSmsDefinitive(f"Twilio a refusé le SMS ({response.status_code}): {response.text}")
+        response.raise_for_status()
+    sid = response.json().get('sid')
+    journal.info("SMS envoyé", extra={"destinataire": to_number, "sid": sid})
+    return sid
+
+# File d'envoi des SMS (table SmsOutbox + workers asynchrones), démarrée dans lifespan
+file_sms = FileSMS(
+    engine,
+    envoyer=send_sms,
+    concurrence=int(os.getenv("SMS_WORKERS", "4")),
+    debit_par_seconde=float(os.getenv("SMS_RATE_PER_SECOND", "1")), # Débit par worker gunicorn
+    max_tentatives=int(os.getenv("SMS_MAX_ATTEMPTS", "5")),
+)
+
+# Places par départ : table PlacesDepart (décrément conditionnel) + compteur en mémoire pour les lectures
+SUJET_INVENTAIRE = "_inventaire" # Sujet du bus : places restantes modifiées dans un autre worker
+
+def publier_places(cle, places: int):
+    manager.publier_controle(SUJET_INVENTAIRE, json.dumps({"cle": list(cle), "places": places}))
+
+inventaire = Inventaire(
+    engine,
+    capacites={
+        "classique": int(os.getenv("SEATS_CLASSIQUE", "70")),
+        "vip": int(os.getenv("SEATS_VIP", "20")),
+    },
+    duree_retenue=timedelta(minutes=int(os.getenv("SEAT_HOLD_MINUTES", "15"))),
+    intervalle_balayage=float(os.getenv("SEAT_HOLD_SWEEP_INTERVAL", "30")),
+    publier=publier_places,
+)
+
+def recevoir_places_distantes(message: str):
+    data = json.loads(message)
+    inventaire.compteur.mettre_a_jour(tuple(data["cle"]), data["places"])
+
+manager.ecouter_controle(SUJET_INVENTAIRE, recevoir_places_distantes)
 
 def validate_password_strength(password: str):
     if len(password) < 8:
@@ -265,51 +439,44 @@ def validate_password_strength(password: str):
 
 # --- LOGIQUE MÉTIER ---
 
-def trouver_trajet_disponible(depart: str, destination: str, date_voyage: Optional[str] = None) -> List[Dict[str, Any]]:
-    trajets_trouves = []
-    jour_semaine = None
-    if date_voyage:
-        try:
-            # Convertir la date YYYY-MM-DD en nom de jour en français
-            date_obj = datetime.strptime(date_voyage, "%Y-%m-%d")
-            jours_fr = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
-            jour_semaine = jours_fr[date_obj.weekday()]
-        except ValueError:
-            # Si le format de date est invalide, on ne filtre pas par jour
-            jour_semaine = None
-
-    depart_normalized = normalize_text(depart)
-    destination_normalized = normalize_text(destination)
-
-    for agence in agences_data:
-        if normalize_text(agence.get('ville_depart', '')) == depart_normalized:
-            for trajet in agence.get('trajets', []):
-                if normalize_text(trajet.get('destination', '')) == destination_normalized:
-                    # La logique de vérification du jour reste la même pour l'instant
-                    # Si un jour est spécifié, on vérifie qu'il correspond
-                    if jour_semaine and trajet.get('days_of_week') and jour_semaine not in trajet.get('days_of_week'):
-                        continue # Ce trajet ne circule pas le jour demandé
-
-                    # On ajoute la date au résultat pour la clarté
-                    trajet_info = {
-                        'agence': agence.get('nom_agence'),
-                        'destination': trajet.get('destination'),
-                        'latitude': trajet.get('latitude'),
-                        'longitude': trajet.get('longitude'),
-                        'prix_vip': trajet.get('prix_vip'),
-                        'prix_classique': trajet.get('prix_classique'),
-                        'heureDepart': trajet.get('departure'),
-                        'dureeEstimee': trajet.get('duration'),
-                        'date': date_voyage # Ajout de la date
-                    }
-                    trajets_trouves.append(trajet_info)
-    return trajets_trouves
-
-def obtenir_infos_google_maps(depart: str, destination: str) -> Optional[Dict[str, Any]]:
-    if not gmaps:
+def trouver_trajet_disponible(depart: str, destination: str, date_voyage: Optional[str] = None, catalogue=None, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    # Recherche par index (départ, destination), filtrée par jour de circulation si une date est donnée
+    if catalogue is None:
+        catalogue = catalogue_courant()
+    return catalogue.trajets(depart, destination, date_voyage, limit=limit, offset=offset)
+
+def trajets_catalogue(depart: str, destination: str, date_voyage: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Trajets directs du catalogue courant ; 503 si le catalogue n'est pas chargé. Bloquant avec le catalogue SQL."""
+    catalogue = catalogue_courant()
+    if not catalogue:
+        raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
+    return trouver_trajet_disponible(depart, destination, date_voyage, catalogue)
+
+def agence_catalogue(nom_agence: str) -> Optional[Dict[str, Any]]:
+    return catalogue_courant().agence(nom_agence)
+
+async def obtenir_infos_google_maps(depart: str, destination: str) -> Optional[Dict[str, Any]]:
+    if not gmaps_configure:
         return None
+    # Les itinéraires entre villes changent rarement : résultat traité mis en cache par paire normalisée
+    cle = (normalize_text(depart), normalize_text(destination))
+    return await cache_directions.obtenir(cle, lambda: _appeler_google_maps(depart, destination))
+
+async def _appeler_google_maps(depart: str, destination: str) -> Optional[Dict[str, Any]]:
     try:
-        directions = gmaps.directions(depart, destination, mode="driving", language="fr")
+        with chronometre(DUREE_APPELS_SORTANTS, "gmaps.directions", erreurs=ERREURS_APPELS_SORTANTS):
+            response = await clients_http.requete(
+                "google_maps", "GET", GOOGLE_MAPS_DIRECTIONS_URL,
+                params={"origin": depart, "destination": destination, "mode": "driving", "language": "fr", "key": API_KEY}
+            )
+            response.raise_for_status()
+        data = response.json()
+        if data.get("status") != "OK":
+            if data.get("status") != "ZERO_RESULTS":
+                ERREURS_APPELS_SORTANTS.inc("gmaps.directions")
+                journal.error("Erreur API Google", extra={"statut_google": data.get("status"), "erreur": data.get("error_message", "")})
+            return None
+        directions = data.get("routes")
         if not directions:
             return None
 
@@ -327,8 +494,8 @@ def obtenir_infos_google_maps(depart: str, destination: str) -> Optional[Dict[st
             "etapes_cles": [re.sub('<[^<]+?>', '', step['html_instructions']) for step in leg['steps'][:5]],
             "polyline_coords": polyline_coords # Ajouter les coordonnées de la polyligne
         }
-    except googlemaps.exceptions.ApiError as e:
-        print(f"Erreur API Google : {e}")
+    except httpx.HTTPError as e:
+        journal.error("Erreur API Google : %s", e)
         return None
 
 # --- ÉVÉNEMENTS DE L'APPLICATION ---
@@ -343,28 +510,75 @@ def read_root():
 
 @app.get("/agences/proches", summary="Trouver les agences les plus proches")
 def trouver_agences_proches(
+    request: Request,
     latitude: float = Query(..., description="Latitude de l'utilisateur"), 
-    longitude: float = Query(..., description="Longitude de l'utilisateur")
+    longitude: float = Query(..., description="Longitude de l'utilisateur"),
+    limit: int = Query(10, ge=1, le=100, description="Nombre maximum d'agences renvoyées"),
+    radius_km: Optional[float] = Query(None, gt=0, description="Rayon de recherche en km (optionnel)"),
+    offset: int = Query(0, ge=0, le=1000, description="Nombre d'agences à sauter (pagination)")
 ):
-    if not agences_data:
+    catalogue = catalogue_courant()
+    if not catalogue:
         raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
+    # Position ramenée sur une grille : les utilisateurs voisins partagent la même réponse en cache
+    latitude, longitude = quantifier(latitude, PAS_GRILLE_PROXIMITE), quantifier(longitude, PAS_GRILLE_PROXIMITE)
+    cle = ("agences_proches", catalogue.version, latitude, longitude, limit, radius_km, offset)
+    return cache_reponses.servir(request, cle, lambda: (catalogue.agences_proches(latitude, longitude, limit, rayon_km=radius_km, offset=offset), {}))
 
-    agences_avec_distance = []
-    for agence in agences_data:
-        dist = calculer_distance(latitude, longitude, agence['latitude'], agence['longitude'])
-        agence_info = agence.copy()
-        agence_info['distance_km'] = round(dist, 2)
-        agences_avec_distance.append(agence_info)
-    
-    return sorted(agences_avec_distance, key=lambda x: x['distance_km'])
+MAX_POINTS_BATCH = 1000 # Nombre maximum de points GPS par requête groupée
+
+@app.post("/agences/proches/batch", summary="Trouver les agences les plus proches pour plusieurs points GPS")
+def trouver_agences_proches_batch(requete: ProximiteBatchRequest):
+    catalogue = catalogue_courant()
+    if not catalogue:
+        raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
+    if len(requete.points) > MAX_POINTS_BATCH:
+        raise HTTPException(status_code=400, detail=f"Trop de points : maximum {MAX_POINTS_BATCH} par requête.")
+    if not 1 <= requete.limit <= 100:
+        raise HTTPException(status_code=400, detail="Le paramètre 'limit' doit être compris entre 1 et 100.")
+    if requete.radius_km is not None and requete.radius_km <= 0:
+        raise HTTPException(status_code=400, detail="Le paramètre 'radius_km' doit être positif.")
+
+    agences_par_point = catalogue.agences_proches_lot(
+        [p.latitude for p in requete.points],
+        [p.longitude for p in requete.points],
+        limit=requete.limit,
+        rayon_km=requete.radius_km
+    )
+    return [
+        {"latitude": point.latitude, "longitude": point.longitude, "agences": agences}
+        for point, agences in zip(requete.points, agences_par_point)
+    ]
 
 @app.get("/trajets/", summary="Rechercher des trajets")
-def rechercher_trajets(depart: str, destination: str, date: Optional[str] = Query(None, description="Date du voyage au format YYYY-MM-DD", examples=["2025-07-13"])):
-    if not agences_data:
+def rechercher_trajets(
+    request: Request,
+    depart: str,
+    destination: str,
+    date: Optional[str] = Query(None, description="Date du voyage au format YYYY-MM-DD", examples=["2025-07-13"]),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Nombre maximum de trajets renvoyés (pagination)"),
+    offset: int = Query(0, ge=0, description="Nombre de trajets à sauter (pagination)")
+):
+    catalogue = catalogue_courant()
+    if not catalogue:
         raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
-    
+    cle = ("trajets", catalogue.version, normalize_text(depart), normalize_text(destination), date, limit, offset)
+    return cache_reponses.servir(request, cle, lambda: chercher_trajets(catalogue, depart, destination, date, limit, offset))
+
+def chercher_trajets(catalogue, depart: str, destination: str, date: Optional[str], limit: Optional[int], offset: int) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """Trajets trouvés et en-têtes de la réponse. Lève une 404 si aucun trajet (réponse non mise en cache)."""
+    en_tetes: Dict[str, str] = {}
     # Le paramètre 'date' est passé à la fonction de logique métier
-    trajets = trouver_trajet_disponible(depart, destination, date)
+    trajets = trouver_trajet_disponible(depart, destination, date, catalogue, limit=limit, offset=offset)
+
+    if not trajets:
+        # Pas de correspondance exacte : noms de villes corrigés (fautes de frappe, « Yaoundé Centre », « Doual »)
+        depart_corrige = catalogue.villes.resoudre(depart)
+        destination_corrigee = catalogue.villes.resoudre(destination)
+        if depart_corrige and destination_corrigee and (depart_corrige, destination_corrigee) != (normalize_text(depart), normalize_text(destination)):
+            trajets = trouver_trajet_disponible(depart_corrige, destination_corrigee, date, catalogue, limit=limit, offset=offset)
+            if trajets:
+                en_tetes["X-Villes-Corrigees"] = f"{depart_corrige} -> {destination_corrigee}" # Noms normalisés (ASCII)
     
     if not trajets:
         # Message d'erreur plus précis
@@ -375,26 +589,229 @@ def rechercher_trajets(depart: str, destination: str, date: Optional[str] = Quer
             detail_message += "."
         raise HTTPException(status_code=404, detail=detail_message)
         
-    return trajets
+    return trajets, en_tetes
 
-@app.get("/trajets/details", summary="Obtenir les détails complets d'un trajet")
-def get_trajet_details(depart: str, destination: str):
-    if not agences_data:
+@app.get("/villes/suggest", summary="Suggestions de villes pour l'autocomplétion")
+def suggerer_villes(
+    q: str = Query(..., min_length=1, max_length=100, description="Début ou nom approché de la ville"),
+    limit: int = Query(10, ge=1, le=50, description="Nombre maximum de suggestions")
+):
+    catalogue = catalogue_courant()
+    if not catalogue:
         raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
-    trajets_locaux = trouver_trajet_disponible(depart, destination)
-    if not trajets_locaux:
-        raise HTTPException(status_code=404, detail="Aucun trajet direct trouvé dans nos agences.")
-    infos_gmaps = obtenir_infos_google_maps(depart, destination)
+    return catalogue.villes.suggerer(q, limit)
+
+CORRESPONDANCE_MIN_MINUTES = int(os.getenv("TRANSFER_MIN_MINUTES", "30")) # Temps minimal entre deux trajets d'un itinéraire
+HORIZON_ITINERAIRES_HEURES = 48 # Les itinéraires doivent partir dans les 48h suivant l'heure demandée
+
+@app.get("/itineraires", summary="Rechercher des itinéraires avec correspondances")
+def rechercher_itineraires(
+    depart: str,
+    destination: str,
+    date: Optional[str] = Query(None, description="Date du voyage au format YYYY-MM-DD (défaut : aujourd'hui)", examples=["2025-07-13"]),
+    heure: Optional[str] = Query(None, description="Heure de départ au plus tôt, HH:MM (défaut : 00:00, ou maintenant pour aujourd'hui)"),
+    critere: str = Query("arrivee", pattern="^(arrivee|prix)$", description="Tri : arrivée la plus tôt ou prix le plus bas"),
+    classe: str = Query("classique", pattern="^(classique|vip)$"),
+    max_correspondances: int = Query(2, ge=0, le=4),
+    limit: int = Query(3, ge=1, le=10, description="Nombre maximum d'itinéraires renvoyés")
+):
+    catalogue = catalogue_courant()
+    if not catalogue:
+        raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
+    maintenant = datetime.now()
+    try:
+        date_voyage = datetime.strptime(date, "%Y-%m-%d").date() if date else maintenant.date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Le paramètre 'date' doit être au format YYYY-MM-DD.")
+    if heure is not None:
+        heure_min = parser_heure(heure)
+        if heure_min is None:
+            raise HTTPException(status_code=400, detail="Le paramètre 'heure' doit être au format HH:MM.")
+    else:
+        heure_min = maintenant.hour * 60 + maintenant.minute if date_voyage == maintenant.date() else 0
+
+    reseau = catalogue.reseau
+    # Noms approchés acceptés, comme pour /trajets/
+    depart_norm = catalogue.villes.resoudre(depart) or normalize_text(depart)
+    destination_norm = catalogue.villes.resoudre(destination) or normalize_text(destination)
+    etiquettes = reseau.rechercher(
+        depart_norm, destination_norm, date_voyage, heure_min,
+        classe=classe,
+        max_trajets=max_correspondances + 1,
+        correspondance_min=CORRESPONDANCE_MIN_MINUTES,
+        horizon_heures=HORIZON_ITINERAIRES_HEURES,
+    )
+    if not etiquettes:
+        raise HTTPException(status_code=404, detail=f"Aucun itinéraire trouvé de {depart} à {destination} dans les {HORIZON_ITINERAIRES_HEURES}h suivant le {date_voyage}.")
+    if critere == "prix":
+        etiquettes.sort(key=lambda e: (e.prix, e.arrivee, e.etapes))
+    else:
+        etiquettes.sort(key=lambda e: (e.arrivee, e.prix, e.etapes))
     return {
-        "trajets_disponibles": trajets_locaux,
-        "details_google_maps": infos_gmaps or "Non disponible (vérifiez la clé API)"
+        "depart": reseau.villes[reseau.ids_villes[depart_norm]],
+        "destination": reseau.villes[reseau.ids_villes[destination_norm]],
+        "date": str(date_voyage),
+        "critere": critere,
+        "classe": classe,
+        "itineraires": [reseau.decrire(etiquette, date_voyage) for etiquette in etiquettes[:limit]]
     }
 
+def lire_trajets_details(depart: str, destination: str):
+    # (clé du cache, réponse en cache ou None, trajets du catalogue si la réponse est à calculer)
+    catalogue = catalogue_courant()
+    if not catalogue:
+        raise HTTPException(status_code=503, detail="Les données des agences ne sont pas disponibles.")
+    cle = ("trajets_details", catalogue.version, normalize_text(depart), normalize_text(destination))
+    entree = cache_reponses.obtenir(cle)
+    if entree is not None:
+        return cle, entree, None
+    trajets_locaux = trouver_trajet_disponible(depart, destination, catalogue=catalogue)
+    if not trajets_locaux:
+        raise HTTPException(status_code=404, detail="Aucun trajet direct trouvé dans nos agences.")
+    return cle, None, trajets_locaux
+
+@app.get("/trajets/details", summary="Obtenir les détails complets d'un trajet")
+async def get_trajet_details(request: Request, depart: str, destination: str):
+    cle, entree, trajets_locaux = await lire_catalogue(lire_trajets_details, depart, destination)
+    if entree is None:
+        infos_gmaps = await obtenir_infos_google_maps(depart, destination)
+        entree = cache_reponses.preparer({
+            "trajets_disponibles": trajets_locaux,
+            "details_google_maps": infos_gmaps or "Non disponible (vérifiez la clé API)"
+        })
+        if infos_gmaps or not gmaps_configure:
+            cache_reponses.enregistrer(cle, entree) # Google Maps en erreur : on redemandera à la prochaine requête
+    return cache_reponses.reponse(request, entree)
+
+@app.get("/stats/cache-reponses", summary="Statistiques du cache des réponses (trajets, agences proches)")
+def stats_cache_reponses():
+    return cache_reponses.statistiques()
+
+@app.get("/stats/cache-directions", summary="Statistiques du cache des itinéraires Google Maps")
+def stats_cache_directions():
+    return cache_directions.statistiques()
+
+@app.get("/stats/catalogue", summary="Version et statistiques du catalogue des agences")
+def stats_catalogue():
+    if CATALOGUE_BACKEND == "sql":
+        return catalogue_sql.statistiques()
+    return catalogue_agences.statistiques()
+
+def verifier_cle_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dépendance des routes d'administration : en-tête X-Admin-Token égal à ADMIN_API_KEY."""
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Les routes d'administration ne sont pas configurées sur le serveur.")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Clé d'administration invalide.")
+
+@app.post("/admin/catalogue/recharger", summary="Recharger agences.json sans redémarrer", dependencies=[Depends(verifier_cle_admin)])
+async def recharger_catalogue():
+    if CATALOGUE_BACKEND == "sql":
+        # Catalogue en base : réimport du fichier, visible immédiatement par tous les workers
+        try:
+            agences, version, _ = await asyncio.to_thread(lire_agences, AGENCES_PATH)
+        except ErreurCatalogue as e:
+            raise HTTPException(status_code=422, detail=f"Catalogue refusé, version précédente conservée : {e}")
+        nombre_agences, nombre_trajets = await asyncio.to_thread(importer_agences, engine, agences, version)
+        catalogue_sql.invalider()
+        return {"recharge": True, "version": version, "agences": nombre_agences, "trajets": nombre_trajets}
+    try:
+        recharge = await catalogue_agences.recharger()
+    except ErreurCatalogue as e:
+        raise HTTPException(status_code=422, detail=f"Catalogue refusé, version précédente conservée : {e}")
+    # Les autres workers rechargent aussi (sans attendre leur propre surveillance du fichier)
+    manager.publier_controle(SUJET_CATALOGUE, json.dumps({"version": catalogue_agences.snapshot.version}))
+    return {"recharge": recharge, **catalogue_agences.snapshot.resume()}
+
+async def recharger_catalogue_distant():
+    try:
+        await catalogue_agences.recharger()
+    except ErreurCatalogue as e:
+        journal.error("Erreur lors du rechargement du catalogue, version précédente conservée : %s", e)
+
+def recevoir_rechargement_catalogue(message: str):
+    if json.loads(message)["version"] != catalogue_agences.snapshot.version:
+        asyncio.create_task(recharger_catalogue_distant())
+
+manager.ecouter_controle(SUJET_CATALOGUE, recevoir_rechargement_catalogue)
+
+@app.get("/disponibilites", summary="Places restantes sur les départs d'un trajet à une date")
+async def disponibilites(
+    depart: str,
+    destination: str,
+    date: str = Query(..., description="Date du voyage au format YYYY-MM-DD", examples=["2025-07-13"]),
+    agence: Optional[str] = None
+):
+    try:
+        date_voyage = str(datetime.strptime(date, "%Y-%m-%d").date())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Le paramètre 'date' doit être au format YYYY-MM-DD.")
+    resultats = []
+    for trajet in await lire_catalogue(trajets_catalogue, depart, destination, date_voyage):
+        if agence is not None and trajet['agence'] != agence:
+            continue
+        places = {}
+        for classe in inventaire.capacites:
+            if trajet.get(f"prix_{classe}") is not None:
+                cle = cle_depart(trajet['agence'], depart, destination, trajet.get('heureDepart'), date_voyage, classe)
+                places[classe] = await inventaire.disponibles(cle)
+        resultats.append({"agence": trajet['agence'], "heureDepart": trajet.get('heureDepart'), "date": date_voyage, "places": places})
+    if not resultats:
+        raise HTTPException(status_code=404, detail=f"Aucun départ de {depart} à {destination} le {date_voyage}.")
+    return resultats
+
+@app.get("/stats/inventaire", summary="Statistiques des places retenues et vendues")
+async def stats_inventaire():
+    return await inventaire.statistiques()
+
+@app.get("/stats/sms", summary="Statistiques de la file d'envoi des SMS")
+async def stats_sms():
+    return await file_sms.statistiques()
+
+def depart_reserve(paiement_req: PaiementRequest):
+    """Clé du départ (trajet du catalogue à la date demandée) visé par un paiement."""
+    if paiement_req.classe not in inventaire.capacites:
+        raise HTTPException(status_code=400, detail="La classe doit être 'classique' ou 'vip'.")
+    if paiement_req.places < 1:
+        raise HTTPException(status_code=400, detail="Le nombre de places doit être au moins 1.")
+    if not paiement_req.depart or not paiement_req.destination:
+        raise HTTPException(status_code=400, detail="'depart' et 'destination' sont requis avec 'date_voyage'.")
+    try:
+        date_voyage = str(datetime.strptime(paiement_req.date_voyage, "%Y-%m-%d").date())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="'date_voyage' doit être au format YYYY-MM-DD.")
+    candidats = [
+        trajet for trajet in trajets_catalogue(paiement_req.depart, paiement_req.destination, date_voyage)
+        if (paiement_req.agence is None or trajet['agence'] == paiement_req.agence)
+        and (paiement_req.heure_depart is None or trajet.get('heureDepart') == paiement_req.heure_depart)
+    ]
+    if not candidats:
+        raise HTTPException(status_code=404, detail=f"Aucun départ de {paiement_req.depart} à {paiement_req.destination} le {date_voyage} ne correspond à la demande.")
+    trajet = candidats[0]
+    if trajet.get(f"prix_{paiement_req.classe}") is None:
+        raise HTTPException(status_code=400, detail=f"La classe '{paiement_req.classe}' n'est pas proposée sur ce trajet.")
+    return cle_depart(trajet['agence'], paiement_req.depart, paiement_req.destination, trajet.get('heureDepart'), date_voyage, paiement_req.classe)
+
 @app.post("/paiement/initier", summary="Initier une demande de paiement")
-def initier_paiement(paiement_req: PaiementRequest, session: Session = Depends(get_session)):
+async def initier_paiement(paiement_req: PaiementRequest):
     if not NOTCH_PAY_PUBLIC_KEY:
         raise HTTPException(status_code=500, detail="La clé API de paiement n'est pas configurée sur le serveur.")
 
+    # Places retenues avant l'appel à Notch Pay : on ne fait pas payer un départ complet
+    reservation_id = None
+    if paiement_req.date_voyage:
+        reservation_id = await inventaire.retenir(await lire_catalogue(depart_reserve, paiement_req), paiement_req.places)
+        if reservation_id is None:
+            raise HTTPException(status_code=409, detail="Il ne reste plus assez de places sur ce départ.")
+    try:
+        return await demander_paiement(paiement_req, reservation_id)
+    except Exception:
+        if reservation_id is not None:
+            await inventaire.liberer(reservation_id) # Paiement non initié : les places sont rendues tout de suite
+        raise
+
+async def demander_paiement(paiement_req: PaiementRequest, reservation_id: Optional[int]):
+
     headers = {
         "Authorization": NOTCH_PAY_PUBLIC_KEY,
         "Content-Type": "application/json"
@@ -412,26 +829,21 @@ def initier_paiement(paiement_req: PaiementRequest, session: Session = Depends(g
     }
 
     try:
-        response = requests.post(NOTCH_PAY_API_URL, headers=headers, json=payload)
-        response.raise_for_status() # Lève une exception pour les erreurs 4xx/5xx
+        with chronometre(DUREE_APPELS_SORTANTS, "notchpay.payments.create", erreurs=ERREURS_APPELS_SORTANTS):
+            response = await clients_http.requete("notchpay", "POST", NOTCH_PAY_API_URL, headers=headers, json=payload)
+            response.raise_for_status() # Lève une exception pour les erreurs 4xx/5xx
         data = response.json()
-        
-        # --- DÉBOGAGE : Affiche la réponse brute de Notch Pay dans la console ---
-        print("--- Réponse brute de Notch Pay ---")
-        print(json.dumps(data, indent=2))
-        print("----------------------------------")
-        # --- FIN DÉBOGAGE ---
+
+        # Réponse brute seulement en DEBUG : ni sérialisation ni écriture sinon
+        if journal.isEnabledFor(logging.DEBUG):
+            journal.debug("Réponse brute de Notch Pay", extra={"reponse": data})
 
         payment_link = data.get("authorization_url")
         # CORRECTION : La référence est sous la clé 'transaction'
         reference = data.get("transaction", {}).get("reference")
+        journal.debug("Paiement Notch Pay initié", extra={"reference": reference, "payment_link": payment_link})
 
-        # --- NOUVEAU DÉBOGAGE : Affiche les valeurs extraites ---
-        print(f"DEBUG: payment_link = {payment_link}")
-        print(f"DEBUG: reference = {reference}")
-        # --- FIN NOUVEAU DÉBOGAGE ---
-
-        if response.ok and payment_link and reference:
+        if response.is_success and payment_link and reference:
             # Créer un enregistrement de billet en attente dans la base de données
             ticket = Ticket(
                 notchpay_reference=reference,
@@ -441,69 +853,145 @@ def initier_paiement(paiement_req: PaiementRequest, session: Session = Depends(g
                 phone=paiement_req.phone,
                 description=paiement_req.description
             )
-            session.add(ticket)
-            session.commit()
-            session.refresh(ticket)
+            if reservation_id is not None:
+                # Avant le billet : le webhook peut arriver dès que le lien de paiement existe
+                await inventaire.associer(reservation_id, reference)
+            ticket = await en_session(engine, sauvegarder, ticket)
 
             return {
                 "message": "Lien de paiement généré avec succès.",
                 "payment_link": payment_link,
                 "reference": reference,
-                "ticket_id": ticket.id
+                "ticket_id": ticket.id,
+                "reservation_id": reservation_id
             }
         else:
             raise HTTPException(status_code=400, detail=f"Erreur de l'API Notch Pay: {data.get('message', 'Réponse invalide')}")
 
-    except requests.exceptions.RequestException as e:
-        print(f"ERREUR DE REQUÊTE NOTCH PAY: {e}") # Ajout du débogage détaillé
+    except httpx.HTTPError as e:
+        journal.error("Erreur de requête Notch Pay : %s", e)
         raise HTTPException(status_code=503, detail=f"Impossible de contacter le service de paiement: {e}")
     except Exception as e:
-        print(f"ERREUR INATTENDUE: {e}") # Ajout du débogage détaillé
+        journal.exception("Erreur inattendue lors de l'initiation du paiement")
         raise HTTPException(status_code=500, detail=f"Une erreur inattendue est survenue: {e}")
 
+# Statuts de billet qu'une notification peut remplacer : 'complete' remplace l'attente ou un échec
+# (paiement finalement abouti) ; les autres statuts ne remplacent que 'pending', si bien qu'un
+# 'failed' reçu en retard n'écrase jamais 'complete'.
+def statuts_remplacables(nouveau_statut: str) -> tuple:
+    if nouveau_statut == "pending":
+        return ()
+    if nouveau_statut == "complete":
+        return ("pending", "failed", "expired", "canceled")
+    return ("pending",)
+
+# Notifications déjà traitées par ce worker (acquittement immédiat des doublons)
+MAX_NOTIFICATIONS_VUES = 100000
+notifications_vues: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+
+def message_confirmation(ticket) -> str:
+    return f"Votre billet de voyage (Ref: {ticket.notchpay_reference}) est confirmé ! Montant: {ticket.amount} {ticket.currency}. Destination: {ticket.description}."
+
+def enregistrer_notification_paiement(reference: str, statut: str) -> Tuple[str, Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Journalise la notification, met à jour le billet, confirme ou rend ses places et, pour un
+    paiement abouti, met le SMS de confirmation dans la file, en une seule transaction : si une
+    étape échoue, rien n'est enregistré et la nouvelle tentative de Notch Pay n'est pas prise
+    pour un doublon.
+    Retourne ("doublon" | "mis_a_jour" | "inchange" | "absent", billet mis à jour ou None, effets à
+    signaler après le commit : "reservation", "places_rendues", "sms_id").
+    Billet absent (webhook arrivé avant l'insertion du billet, cf. demander_paiement) : rien
+    n'est journalisé, pour que la nouvelle tentative de Notch Pay soit traitée normalement.
+    Exécutée dans un thread : la session SQLModel est bloquante.
+    """
+    with Session(engine) as session:
+        session.add(WebhookEvent(notchpay_reference=reference, status=statut))
+        try:
+            session.flush()
+        except IntegrityError:
+            # Notification déjà reçue (rejeu Notch Pay ou autre worker) : le billet n'est pas touché
+            session.rollback()
+            return "doublon", None, {}
+        # UPDATE conditionnel, sans lecture préalable du billet
+        ligne = session.execute(
+            update(Ticket)
+            .where(Ticket.notchpay_reference == reference, Ticket.status.in_(statuts_remplacables(statut)))
+            .values(status=statut, updated_at=datetime.utcnow())
+            .returning(Ticket.id, Ticket.notchpay_reference, Ticket.phone, Ticket.amount, Ticket.currency, Ticket.description)
+        ).first()
+        if ligne is None and session.exec(select(Ticket.id).where(Ticket.notchpay_reference == reference)).first() is None:
+            session.rollback()
+            return "absent", None, {}
+        if ligne is None:
+            session.commit()
+            return "inchange", None, {}
+        # Places retenues : confirmées si le paiement aboutit, rendues s'il échoue
+        reservation, places_rendues = inventaire.appliquer_paiement(session, reference, statut)
+        sms_id = None
+        if statut == "complete":
+            # Utilise TEST_SMS_RECIPIENT_NUMBER si défini, sinon le numéro du billet
+            destinataire = TEST_SMS_RECIPIENT_NUMBER if TEST_SMS_RECIPIENT_NUMBER else ligne.phone
+            sms_id = file_sms.inserer_en_session(session, reference, destinataire, message_confirmation(ligne))
+        session.commit()
+    return "mis_a_jour", dict(ligne._mapping), {"reservation": reservation, "places_rendues": places_rendues, "sms_id": sms_id}
+
 @app.post("/paiement/webhook", summary="Webhook pour les notifications de paiement") # Changé de POST à GET
-async def paiement_webhook(reference: str = Query(...), status: str = Query(...), session: Session = Depends(get_session)):
+async def paiement_webhook(reference: str = Query(...), status: str = Query(...)):
     """
     Reçoit les notifications de statut de paiement de la part de Notch Pay (via GET).
     Met à jour le statut du billet dans la base de données.
+    Les notifications en double sont acquittées sans toucher au billet.
     """
+    reponse = {"status": "received", "reference": reference, "status_from_notchpay": status}
+    cle = (reference, status)
+    if cle in notifications_vues:
+        return {**reponse, "duplicate": True}
     try:
-        print("--- Webhook Notch Pay Reçu (GET) ---")
-        print(f"Référence: {reference}")
-        print(f"Statut: {status}")
-        print("----------------------------------")
-
-        # Mettre à jour le statut du billet dans la base de données
-        ticket = session.exec(select(Ticket).where(Ticket.notchpay_reference == reference)).first()
+        journal.info("Webhook Notch Pay reçu", extra={"reference": reference, "statut": status})
+
+        # Billet, places et SMS de confirmation enregistrés ensemble (hors de la boucle d'événements)
+        resultat, ticket, effets = await asyncio.to_thread(enregistrer_notification_paiement, reference, status)
+        if resultat == "absent":
+            # Réponse non 2xx : Notch Pay renverra la notification, une fois le billet enregistré
+            journal.warning("Webhook reçu pour un billet inconnu", extra={"reference": reference, "statut": status})
+            raise HTTPException(status_code=404, detail="Billet non trouvé pour cette référence.")
+
+        if resultat == "doublon":
+            marquer_notification_vue(cle)
+            return {**reponse, "duplicate": True}
         if ticket:
-            ticket.status = status # 'complete' ou 'failed'
-            ticket.updated_at = datetime.utcnow()
-            session.add(ticket)
-            session.commit()
-            session.refresh(ticket)
-            print(f"Statut du billet {ticket.id} mis à jour à: {status}")
-            
-            # --- ENVOI DU SMS DE CONFIRMATION ---
+            journal.info("Statut du billet mis à jour", extra={"ticket_id": ticket['id'], "statut": status})
+            inventaire.paiement_applique(reference, effets["reservation"], effets["places_rendues"])
             if status == "complete":
-                # Utilise TEST_SMS_RECIPIENT_NUMBER si défini, sinon le numéro du billet
-                recipient_phone = TEST_SMS_RECIPIENT_NUMBER if TEST_SMS_RECIPIENT_NUMBER else ticket.phone
-                sms_message = f"Votre billet de voyage (Ref: {ticket.notchpay_reference}) est confirmé ! Montant: {ticket.amount} {ticket.currency}. Destination: {ticket.description}."
-                send_sms(recipient_phone, sms_message)
-            # --- FIN ENVOI DU SMS ---
-
+                # SMS déjà enregistré dans la file : envoi en arrière-plan
+                file_sms.signaler_ajout(effets["sms_id"])
         else:
-            print(f"Billet avec référence {reference} non trouvé.")
+            journal.info("Billet non trouvé ou statut inchangé", extra={"reference": reference, "statut": status})
 
-        return {"status": "received", "reference": reference, "status_from_notchpay": status}
+        # Seulement une fois tous les effets appliqués : une erreur plus haut laisse Notch Pay réessayer
+        marquer_notification_vue(cle)
+        return {**reponse, "duplicate": False}
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Erreur lors du traitement du webhook: {e}")
+        journal.exception("Erreur lors du traitement du webhook", extra={"reference": reference, "statut": status})
         raise HTTPException(status_code=500, detail="Erreur interne du serveur.")
 
+def marquer_notification_vue(cle: Tuple[str, str]):
+    notifications_vues[cle] = None
+    if len(notifications_vues) > MAX_NOTIFICATIONS_VUES:
+        notifications_vues.popitem(last=False)
+
 @app.post("/billet/annuler/{ticket_id}", summary="Annuler un billet")
-def annuler_billet(ticket_id: int, session: Session = Depends(get_session)):
+async def annuler_billet(ticket_id: int):
     """
-    Met à jour le statut d'un billet à 'cancelled'.
+    Met à jour le statut d'un billet à 'cancelled' et rend ses places au départ.
     """
+    ticket = await en_session(engine, annuler_billet_en_base, ticket_id)
+    await inventaire.notifier_paiement(ticket.notchpay_reference, "cancelled")
+    return {"message": "Billet annulé avec succès", "ticket_id": ticket.id, "new_status": "cancelled"}
+
+def annuler_billet_en_base(session: Session, ticket_id: int) -> Ticket:
     ticket = session.get(Ticket, ticket_id)
     if not ticket:
         raise HTTPException(status_code=404, detail="Billet non trouvé")
@@ -511,20 +999,147 @@ def annuler_billet(ticket_id: int, session: Session = Depends(get_session)):
     if ticket.status == "completed":
         ticket.status = "cancelled"
         ticket.updated_at = datetime.utcnow()
-        session.add(ticket)
-        session.commit()
-        session.refresh(ticket)
-        return {"message": "Billet annulé avec succès", "ticket_id": ticket.id, "new_status": "cancelled"}
+        return sauvegarder(session, ticket)
     elif ticket.status == "cancelled":
         raise HTTPException(status_code=400, detail="Le billet a déjà été annulé.")
     else:
         raise HTTPException(status_code=400, detail=f"Le billet ne peut pas être annulé car son statut est '{ticket.status}'.")
 
+# --- CONSULTATION DES BILLETS (finance, support) ---
+
+MAX_BILLETS_PAGE = 500
+MAX_JOURS_EXPORT = 366 # Plage maximale d'un export
+TAILLE_LOT_EXPORT = 1000 # Lignes lues par aller-retour avec la base pendant un export
+COLONNES_BILLET = ("id", "notchpay_reference", "status", "amount", "currency", "email", "phone", "description", "created_at", "updated_at")
+
+def filtrer_billets(requete, email: Optional[str], phone: Optional[str], statut: Optional[str], debut: Optional[datetime], fin: Optional[datetime]):
+    # Chaque filtre d'égalité correspond à un index (colonne, created_at)
+    if email:
+        requete = requete.where(Ticket.email == email)
+    if phone:
+        requete = requete.where(Ticket.phone == phone)
+    if statut:
+        requete = requete.where(Ticket.status == statut)
+    if debut:
+        requete = requete.where(Ticket.created_at >= debut)
+    if fin:
+        requete = requete.where(Ticket.created_at < fin)
+    return requete
+
+def lire_page_billets(session: Session, requete, limite: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    # Une ligne de plus que demandé : indique s'il existe une page suivante sans COUNT(*)
+    billets = session.exec(requete.limit(limite + 1)).all()
+    suivant = None
+    if len(billets) > limite:
+        billets = billets[:limite]
+        suivant = encoder_curseur(billets[-1].created_at, billets[-1].id)
+    return [billet.model_dump() for billet in billets], suivant
+
+@app.get("/billets", summary="Lister les billets (pagination par curseur)", dependencies=[Depends(verifier_cle_admin)])
+async def lister_billets(
+    email: Optional[str] = Query(None, description="Adresse e-mail exacte du client"),
+    phone: Optional[str] = Query(None, description="Numéro de téléphone exact du client"),
+    statut: Optional[str] = Query(None, alias="status", description="Statut du billet (pending, complete, failed, cancelled...)"),
+    debut: Optional[datetime] = Query(None, alias="from", description="Créés à partir de cette date (ISO 8601, UTC par défaut)"),
+    fin: Optional[datetime] = Query(None, alias="to", description="Créés avant cette date (ISO 8601, UTC par défaut)"),
+    limit: int = Query(50, ge=1, le=MAX_BILLETS_PAGE, description="Nombre de billets par page"),
+    cursor: Optional[str] = Query(None, description="Curseur 'next_cursor' de la page précédente"),
+):
+    """
+    Billets du plus récent au plus ancien. La page suivante se demande avec `cursor` (mêmes filtres) :
+    elle reprend juste après le dernier billet renvoyé, en temps constant quelle que soit la page.
+    """
+    curseur = decoder_curseur(cursor)
+    requete = filtrer_billets(select(Ticket), email, phone, statut, debut and vers_utc_naif(debut), fin and vers_utc_naif(fin))
+    if curseur:
+        requete = requete.where(avant_curseur(Ticket.created_at, Ticket.id, curseur))
+    requete = requete.order_by(Ticket.created_at.desc(), Ticket.id.desc())
+    billets, suivant = await en_session(engine, lire_page_billets, requete, limit)
+    return {"billets": billets, "next_cursor": suivant}
+
+FORMULE_NUMERIQUE = re.compile(r"^[+-]?[\d\s.]+$") # Numéros de téléphone, montants : pas de formule possible
+
+def cellule_csv(valeur: Any) -> Any:
+    # Texte commençant par = + - @ : interprété comme formule par les tableurs (injection CSV)
+    if isinstance(valeur, str) and valeur[:1] in ("=", "+", "-", "@") and not FORMULE_NUMERIQUE.match(valeur):
+        return "'" + valeur
+    return valeur
+
+def valeur_json(valeur: Any) -> str:
+    return valeur.isoformat() if isinstance(valeur, datetime) else str(valeur)
+
+@app.get("/billets/export", summary="Exporter les billets d'une période (CSV ou NDJSON, en flux)", dependencies=[Depends(verifier_cle_admin)])
+def exporter_billets(
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv ou ndjson"),
+    email: Optional[str] = Query(None),
+    phone: Optional[str] = Query(None),
+    statut: Optional[str] = Query(None, alias="status"),
+    debut: Optional[datetime] = Query(None, alias="from", description="Début de la période (ISO 8601, UTC par défaut). Défaut : 30 jours avant 'to'"),
+    fin: Optional[datetime] = Query(None, alias="to", description="Fin de la période (ISO 8601, UTC par défaut). Défaut : maintenant"),
+):
+    fin = vers_utc_naif(fin) if fin else datetime.utcnow()
+    debut = vers_utc_naif(debut) if debut else fin - timedelta(days=30)
+    if debut >= fin:
+        raise HTTPException(status_code=400, detail="Le paramètre 'from' doit précéder 'to'.")
+    if fin - debut > timedelta(days=MAX_JOURS_EXPORT):
+        raise HTTPException(status_code=400, detail=f"La période exportée ne peut pas dépasser {MAX_JOURS_EXPORT} jours.")
+    colonnes = [getattr(Ticket, nom) for nom in COLONNES_BILLET]
+    requete = filtrer_billets(select(*colonnes), email, phone, statut, debut, fin).order_by(Ticket.created_at, Ticket.id)
+
+    def generer():
+        # Curseur côté serveur (stream_results) lu par lots : mémoire constante, quelle que soit la période.
+        # StreamingResponse appelle ce générateur dans le threadpool : la boucle d'événements n'attend pas la base.
+        tampon = io.StringIO()
+        ecrivain = csv.writer(tampon)
+        if format == "csv":
+            ecrivain.writerow(COLONNES_BILLET)
+        with engine.connect() as connexion:
+            resultat = connexion.execution_options(stream_results=True, yield_per=TAILLE_LOT_EXPORT).execute(requete)
+            for lot in resultat.partitions():
+                for ligne in lot:
+                    if format == "csv":
+                        ecrivain.writerow([cellule_csv(valeur) for valeur in ligne])
+                    else:
+                        tampon.write(json.dumps(dict(zip(COLONNES_BILLET, ligne)), ensure_ascii=False, default=valeur_json) + "\n")
+                yield tampon.getvalue()
+                tampon.seek(0)
+                tampon.truncate()
+        if tampon.tell():
+            yield tampon.getvalue()
+
+    nom_fichier = f"billets-{debut:%Y%m%d}-{fin:%Y%m%d}.{format}"
+    return StreamingResponse(
+        generer(),
+        media_type="text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{nom_fichier}"'},
+    )
+
 # New User Authentication Routes
 
+def service_hachage_sature() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Service d'authentification surchargé, veuillez réessayer.",
+        headers={"Retry-After": "1"},
+    )
+
 @app.post("/register", response_model=User, summary="Enregistrer un nouvel utilisateur")
-def register_user(user: UserCreate, session: Session = Depends(get_session)):
+async def register_user(user: UserCreate):
     validate_password_strength(user.password)
+    # Pas de connexion à la base gardée pendant le calcul bcrypt
+    await en_session(engine, verifier_disponibilite_utilisateur, user)
+
+    # Convertir l'e-mail vide en None pour la base de données
+    email_to_save = user.email if user.email else None
+
+    try:
+        hashed_password = await pool_hachage.hacher(user.password)
+    except PoolSature:
+        raise service_hachage_sature()
+    db_user = User(username=user.username, hashed_password=hashed_password, email=email_to_save)
+    return await en_session(engine, sauvegarder, db_user)
+
+def verifier_disponibilite_utilisateur(session: Session, user: UserCreate):
     db_user_by_username = session.exec(select(User).where(User.username == user.username)).first()
     if db_user_by_username:
         raise HTTPException(status_code=400, detail="Nom d'utilisateur déjà enregistré")
@@ -535,20 +1150,20 @@ def register_user(user: UserCreate, session: Session = Depends(get_session)):
         if db_user_by_email:
             raise HTTPException(status_code=400, detail="Adresse e-mail déjà enregistrée")
 
-    # Convertir l'e-mail vide en None pour la base de données
-    email_to_save = user.email if user.email else None
-
-    hashed_password = get_password_hash(user.password)
-    db_user = User(username=user.username, hashed_password=hashed_password, email=email_to_save)
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
-    return db_user
-
 @app.post("/token", response_model=Token, summary="Obtenir un token d'accès (connexion)")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await en_session(engine, utilisateur_par_nom, form_data.username)
+    correct = False
+    if user:
+        try:
+            correct, nouveau_hachage = await pool_hachage.verifier(form_data.password, user.hashed_password)
+        except PoolSature:
+            raise service_hachage_sature()
+        if correct and nouveau_hachage:
+            # Coût bcrypt modifié depuis la création du hachage : mise à jour transparente
+            user.hashed_password = nouveau_hachage
+            user = await en_session(engine, sauvegarder, user)
+    if not correct:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Nom d'utilisateur ou mot de passe incorrect",
@@ -556,73 +1171,299 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), ses
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={"sub": user.username, "id": user.id}, # L'id permet de retrouver l'utilisateur par clé primaire
         expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+def utilisateur_par_nom(session: Session, username: str) -> Optional[User]:
+    return session.exec(select(User).where(User.username == username)).first()
+
+# Tokens déjà validés (claims + utilisateur) : les requêtes authentifiées ne touchent pas la base
+cache_auth = CacheAuth(
+    ttl_secondes=float(os.getenv("AUTH_CACHE_TTL", "60")),
+    max_entrees=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000")),
+)
+SUJET_INVALIDATION_AUTH = "_invalidation_auth" # Sujet du bus : utilisateurs modifiés dans un autre worker
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def marquer_utilisateur_modifie(mapper, connection, target):
+    session_orm = object_session(target)
+    if session_orm is not None and target.id is not None:
+        session_orm.info.setdefault("utilisateurs_modifies", set()).add(target.id)
+
+@event.listens_for(SessionORM, "after_commit")
+def invalider_utilisateurs_modifies(session_orm):
+    # Invalidation après le commit : une requête concurrente ne peut pas remettre en cache l'ancienne version
+    for user_id in session_orm.info.pop("utilisateurs_modifies", ()):
+        cache_auth.invalider_utilisateur(user_id)
+        manager.publier_controle(SUJET_INVALIDATION_AUTH, json.dumps({"user_id": user_id}))
+
+@event.listens_for(SessionORM, "after_rollback")
+def oublier_utilisateurs_modifies(session_orm):
+    session_orm.info.pop("utilisateurs_modifies", None)
+
+def recevoir_invalidation_auth(message: str):
+    cache_auth.invalider_utilisateur(json.loads(message)["user_id"])
+
+manager.ecouter_controle(SUJET_INVALIDATION_AUTH, recevoir_invalidation_auth)
+
+def charger_utilisateur(payload: Dict[str, Any]) -> Optional[User]:
+    with Session(engine) as session:
+        if payload.get("id") is not None:
+            user = session.get(User, payload["id"])
+            # Le nom vérifie que l'id n'a pas été réattribué à un autre compte
+            return user if user is not None and user.username == payload.get("sub") else None
+        # Anciens tokens sans id
+        return session.exec(select(User).where(User.username == payload.get("sub"))).first()
+
 # Dependency to get current user
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Impossible de valider les identifiants",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    en_cache = cache_auth.obtenir(token)
+    if en_cache is not None:
+        return User(**en_cache[1])
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = session.exec(select(User).where(User.username == token_data.username)).first()
-    if user is None:
+    user = await asyncio.to_thread(charger_utilisateur, payload)
+    if user is None or not user.is_active:
         raise credentials_exception
+    cache_auth.enregistrer(token, payload, user.model_dump())
     return user
 
 @app.get("/users/me", response_model=User, summary="Obtenir l'utilisateur actuel")
 def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
+# Dernières positions des véhicules en mémoire, écrites en base par lots en arrière-plan
+store_positions = StorePositions(
+    engine,
+    VehicleLocation.__table__,
+    intervalle=float(os.getenv("TRACKING_FLUSH_INTERVAL", "2")),
+    seuil=int(os.getenv("TRACKING_FLUSH_THRESHOLD", "500")),
+)
+
+# Historique des positions (base SQLite dédiée, une table par jour)
+historique_positions = HistoriquePositions(
+    os.getenv("TRACKING_HISTORY_PATH", "./positions_history.db"),
+    retention_jours=int(os.getenv("TRACKING_HISTORY_RETENTION_DAYS", "30")),
+    max_tampon=int(os.getenv("TRACKING_HISTORY_MAX_BUFFER", "100000")), # Points en attente d'écriture, par worker
+)
+MAX_JOURS_HISTORIQUE = 31 # Plage maximale d'une requête d'historique
+
+# Estimation des heures d'arrivée des véhicules affectés à un trajet
+moteur_eta = MoteurETA(fenetre=int(os.getenv("ETA_SPEED_WINDOW", "10")))
+SUJET_AFFECTATIONS = "_affectations_eta" # Sujet de contrôle du bus : affectations partagées entre workers
+
+def recevoir_position_distante(vehicle_id: str, message: str):
+    # Position publiée par un autre worker : on garde la mémoire à jour pour GET /track/{vehicle_id}
+    data = json.loads(message)
+    if "latitude" in data and "longitude" in data:
+        timestamp = datetime.fromisoformat(data["timestamp"])
+        store_positions.enregistrer_distante(vehicle_id, data["latitude"], data["longitude"], timestamp)
+        moteur_eta.mettre_a_jour(vehicle_id, data["latitude"], data["longitude"], timestamp)
+
+def recevoir_affectation_distante(message: str):
+    data = json.loads(message)
+    if data.get("route") is None:
+        moteur_eta.retirer(data["vehicle_id"])
+    else:
+        moteur_eta.affecter(data["vehicle_id"], data["route"], data["coords"], data.get("duree_minutes"))
+
+manager.ecouteurs_distants.append(recevoir_position_distante)
+manager.ecouter_controle(SUJET_AFFECTATIONS, recevoir_affectation_distante)
+
+def publier_position(position):
+    # L'ETA voyage dans le message de position : les clients reçoivent toujours vehicle_id, latitude et longitude
+    message = position.en_dict()
+    eta = moteur_eta.mettre_a_jour(position.vehicle_id, position.latitude, position.longitude, position.timestamp)
+    if eta is not None:
+        message["eta"] = eta
+    manager.publier(position.vehicle_id, message)
+
+# Avance tolérée de l'horloge d'un traceur : au-delà, le point est refusé (il masquerait les positions suivantes)
+DECALAGE_HORLOGE_MAX = timedelta(seconds=int(os.getenv("TRACKING_MAX_CLOCK_SKEW_SECONDS", "30")))
+
+def horodatage_point(timestamp: Optional[datetime], maintenant: datetime) -> datetime:
+    """Heure UTC naïve d'un point GPS (réception par défaut) ; 422 si elle est dans le futur."""
+    if timestamp is None:
+        return maintenant
+    timestamp = vers_utc_naif(timestamp)
+    if timestamp > maintenant + DECALAGE_HORLOGE_MAX:
+        raise HTTPException(status_code=422, detail=f"Horodatage dans le futur : {timestamp.isoformat()} (heure du serveur : {maintenant.isoformat()} UTC).")
+    return timestamp
+
 @app.post("/track/update", summary="Mettre à jour la position d'un véhicule")
-async def update_vehicle_location(location_update: VehicleLocationUpdate, session: Session = Depends(get_session)):
-    # Vérifier si le véhicule existe déjà
-    vehicle_location = session.exec(select(VehicleLocation).where(VehicleLocation.vehicle_id == location_update.vehicle_id)).first()
-
-    if vehicle_location:
-        # Mettre à jour la position existante
-        vehicle_location.latitude = location_update.latitude
-        vehicle_location.longitude = location_update.longitude
-        vehicle_location.timestamp = datetime.utcnow()
+async def update_vehicle_location(location_update: VehicleLocationUpdate):
+    timestamp = horodatage_point(location_update.timestamp, datetime.utcnow())
+    historique_positions.ajouter(location_update.vehicle_id, location_update.latitude, location_update.longitude, timestamp)
+    # La position est enregistrée en mémoire ; l'écriture en base est différée et groupée
+    position = store_positions.mettre_a_jour(location_update.vehicle_id, location_update.latitude, location_update.longitude, timestamp)
+    if position is not None:
+        # Diffuser la mise à jour (et l'ETA) aux abonnés de ce véhicule via WebSocket
+        publier_position(position)
+    return {"message": "Position du véhicule mise à jour", "vehicle_id": location_update.vehicle_id, "latitude": location_update.latitude, "longitude": location_update.longitude}
+
+MAX_POINTS_TELEMETRIE = 10000 # Nombre maximum de points par lot
+lots_telemetrie = TypeAdapter(List[VehicleLocationUpdate])
+
+@app.post("/track/update/batch", summary="Mettre à jour les positions de plusieurs véhicules en une requête")
+async def update_vehicle_locations_batch(request: Request):
+    """
+    Accepte un tableau JSON ou du NDJSON (une position par ligne) de VehicleLocationUpdate.
+    Tous les points vont dans l'historique ; seul le plus récent de chaque véhicule met à jour
+    la dernière position et n'est diffusé qu'une fois.
+    """
+    corps = await request.body()
+    try:
+        if corps.lstrip().startswith(b"["):
+            points = lots_telemetrie.validate_json(corps)
+        else:
+            lignes = [ligne for ligne in corps.splitlines() if ligne.strip()]
+            points = lots_telemetrie.validate_json(b"[" + b",".join(lignes) + b"]")
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    if len(points) > MAX_POINTS_TELEMETRIE:
+        raise HTTPException(status_code=413, detail=f"Trop de points : maximum {MAX_POINTS_TELEMETRIE} par lot.")
+
+    maintenant = datetime.utcnow()
+    plus_recents: Dict[str, Tuple[VehicleLocationUpdate, datetime]] = {}
+    historique = []
+    for point in points:
+        # Un point dans le futur refuse tout le lot, comme une erreur de validation : rien n'est écrit
+        timestamp = horodatage_point(point.timestamp, maintenant)
+        historique.append((point.vehicle_id, point.latitude, point.longitude, timestamp))
+        actuel = plus_recents.get(point.vehicle_id)
+        if actuel is None or actuel[1] <= timestamp:
+            plus_recents[point.vehicle_id] = (point, timestamp)
+
+    # Tout le lot est écrit dans l'historique en une seule transaction
+    historique_positions.ajouter_lot(historique)
+    if not await historique_positions.vider():
+        # Le tracker garde son tampon et renvoie le lot (réécriture idempotente : INSERT OR REPLACE)
+        raise HTTPException(status_code=503, detail="Historique des positions indisponible, renvoyez le lot plus tard.")
+
+    diffuses = 0
+    for point, timestamp in plus_recents.values():
+        position = store_positions.mettre_a_jour(point.vehicle_id, point.latitude, point.longitude, timestamp)
+        if position is not None:
+            publier_position(position)
+            diffuses += 1
+    return {"message": "Positions des véhicules mises à jour", "points_recus": len(points), "vehicules": len(plus_recents), "positions_diffusees": diffuses}
+
+@app.get("/track/{vehicle_id}", summary="Obtenir la dernière position d'un véhicule")
+def get_vehicle_location(vehicle_id: str):
+    position = store_positions.obtenir(vehicle_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Véhicule non trouvé")
+    return position.en_dict()
+
+@app.post("/track/{vehicle_id}/trajet", summary="Affecter un véhicule à un trajet pour le calcul de son ETA")
+async def affecter_trajet_vehicule(affectation: AffectationTrajet, vehicle_id: str = Path(..., pattern=f"^[^{PREFIXE_CONTROLE}]")):
+    trajets = await lire_catalogue(trajets_catalogue, affectation.depart, affectation.destination)
+    if affectation.agence:
+        trajets = [t for t in trajets if normalize_text(t['agence'] or '') == normalize_text(affectation.agence)]
+    if not trajets:
+        raise HTTPException(status_code=404, detail=f"Aucun trajet direct trouvé de {affectation.depart} à {affectation.destination}.")
+    trajet = trajets[0]
+
+    cle = f"{normalize_text(affectation.depart)}|{normalize_text(affectation.destination)}"
+    infos_gmaps = await obtenir_infos_google_maps(affectation.depart, affectation.destination)
+    if infos_gmaps and len(infos_gmaps.get("polyline_coords") or []) >= 2:
+        route_id, coords = f"{cle}|google", infos_gmaps["polyline_coords"]
     else:
-        # Créer une nouvelle entrée pour le véhicule
-        vehicle_location = VehicleLocation(
-            vehicle_id=location_update.vehicle_id,
-            latitude=location_update.latitude,
-            longitude=location_update.longitude
-        )
-    
-    session.add(vehicle_location)
-    session.commit()
-    session.refresh(vehicle_location)
-    # Diffuser la mise à jour de la position via WebSocket
-    await manager.broadcast(json.dumps({
-        "vehicle_id": vehicle_location.vehicle_id,
-        "latitude": vehicle_location.latitude,
-        "longitude": vehicle_location.longitude,
-        "timestamp": str(vehicle_location.timestamp)
-    }))
-    return {"message": "Position du véhicule mise à jour", "vehicle_id": vehicle_location.vehicle_id, "latitude": vehicle_location.latitude, "longitude": vehicle_location.longitude}
+        # Sans Google Maps : ligne droite de l'agence de départ aux coordonnées de destination du trajet
+        agence = await lire_catalogue(agence_catalogue, trajet['agence'])
+        if agence is None or None in (agence.get('latitude'), agence.get('longitude'), trajet['latitude'], trajet['longitude']):
+            raise HTTPException(status_code=422, detail="Coordonnées du trajet indisponibles pour estimer l'arrivée.")
+        route_id = f"{cle}|{normalize_text(trajet['agence'])}|directe" # Le point de départ dépend de l'agence
+        coords = [[agence['latitude'], agence['longitude']], [trajet['latitude'], trajet['longitude']]]
+
+    duree_minutes = parser_duree(trajet.get('dureeEstimee'))
+    suivi = moteur_eta.affecter(vehicle_id, route_id, coords, duree_minutes)
+    manager.publier_controle(SUJET_AFFECTATIONS, json.dumps({"vehicle_id": vehicle_id, "route": route_id, "coords": coords, "duree_minutes": duree_minutes}))
+
+    position = store_positions.obtenir(vehicle_id)
+    eta = moteur_eta.mettre_a_jour(vehicle_id, position.latitude, position.longitude, position.timestamp) if position else None
+    return {
+        "vehicle_id": vehicle_id,
+        "trajet": trajet,
+        "route": route_id,
+        "longueur_km": round(suivi.geometrie.longueur_km, 2),
+        "vitesse_nominale_kmh": round(suivi.vitesse_nominale_kmh, 1),
+        "eta": eta
+    }
+
+@app.delete("/track/{vehicle_id}/trajet", summary="Terminer le suivi ETA d'un véhicule")
+def retirer_trajet_vehicule(vehicle_id: str):
+    if vehicle_id not in moteur_eta.vehicules:
+        raise HTTPException(status_code=404, detail="Aucun trajet affecté à ce véhicule.")
+    moteur_eta.retirer(vehicle_id)
+    manager.publier_controle(SUJET_AFFECTATIONS, json.dumps({"vehicle_id": vehicle_id, "route": None}))
+    return {"message": "Suivi ETA terminé", "vehicle_id": vehicle_id}
+
+@app.get("/track/{vehicle_id}/eta", summary="Obtenir l'heure d'arrivée estimée d'un véhicule")
+def get_vehicle_eta(vehicle_id: str):
+    suivi = moteur_eta.vehicules.get(vehicle_id)
+    if suivi is None:
+        raise HTTPException(status_code=404, detail="Aucun trajet affecté à ce véhicule.")
+    if suivi.derniere_eta is None:
+        raise HTTPException(status_code=404, detail="Aucune position reçue depuis l'affectation du trajet.")
+    return {"vehicle_id": vehicle_id, **suivi.derniere_eta}
+
+@app.get("/track/{vehicle_id}/history", summary="Historique des positions d'un véhicule (NDJSON)")
+def get_vehicle_history(
+    vehicle_id: str,
+    debut: Optional[datetime] = Query(None, alias="from", description="Début de la plage (ISO 8601, UTC par défaut). Défaut : 24h avant 'to'"),
+    fin: Optional[datetime] = Query(None, alias="to", description="Fin de la plage (ISO 8601, UTC par défaut). Défaut : maintenant")
+):
+    fin = vers_utc_naif(fin) if fin else datetime.utcnow()
+    debut = vers_utc_naif(debut) if debut else fin - timedelta(days=1)
+    if debut >= fin:
+        raise HTTPException(status_code=400, detail="Le paramètre 'from' doit précéder 'to'.")
+    if fin - debut > timedelta(days=MAX_JOURS_HISTORIQUE):
+        raise HTTPException(status_code=400, detail=f"La plage demandée ne peut pas dépasser {MAX_JOURS_HISTORIQUE} jours.")
+
+    def generer():
+        # Une ligne JSON par point, lue par lots : la réponse n'est jamais chargée entièrement en mémoire
+        for latitude, longitude, timestamp in historique_positions.lire(vehicle_id, debut, fin):
+            yield json.dumps({"latitude": latitude, "longitude": longitude, "timestamp": str(timestamp)}) + "\n"
+
+    return StreamingResponse(generer(), media_type="application/x-ndjson")
 
 @app.websocket("/ws/track/{vehicle_id}")
 async def websocket_endpoint(websocket: WebSocket, vehicle_id: str):
-    await manager.connect(websocket, vehicle_id)
+    abonne = await manager.connect(websocket, vehicle_id)
     try:
         while True:
             # Keep connection alive, or handle messages from client if needed
             await websocket.receive_text() 
     except WebSocketDisconnect:
-        manager.disconnect(vehicle_id)
+        pass
+    finally:
+        manager.disconnect(abonne)
+
+@app.get("/stats/auth", summary="Statistiques du cache d'authentification et du hachage des mots de passe")
+def stats_auth():
+    return {"cache": cache_auth.statistiques(), "hachage": pool_hachage.statistiques()}
+
+@app.get("/metrics", summary="Métriques au format d'exposition Prometheus")
+async def metrics():
+    instantane = await asyncio.to_thread(agregateur_metriques.collecter)
+    return Response(exposer(instantane), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/stats/websockets", summary="Statistiques des connexions WebSocket de suivi")
+def stats_websockets():
+    return manager.statistiques()
 
 # Pour lancer le serveur : uvicorn voyage:app --reload
\ No newline at end of file